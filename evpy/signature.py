@@ -99,10 +99,50 @@ def sign(data, keyfile=None, key=None):
 	return ctypes.string_at(output, output_buflen)
 
 
-def verify(data, sig, keyfile=None, key=None):
+class VerificationKey(object):
+	"""A parsed public key, to be passed as vkey to verify().
+
+	Parsing a PEM key is much more expensive than verifying a
+	signature, so a key used to verify many signatures should
+	be parsed once. The native key is freed by free(), or when
+	the object is garbage collected.
+
+	This class raises SignatureError on error.
+
+	Usage:
+		>>> from evpy import signature
+		>>> f = open("test/short.txt", "rb")
+		>>> data = f.read()
+		>>> private_key = "test/keys/private1.pem"
+		>>> public_key = open("test/keys/public1.pem").read()
+		>>> s = signature.sign(data, private_key)
+		>>> vkey = signature.VerificationKey(public_key)
+		>>> signature.verify(data, s, vkey=vkey)
+		True
+	"""
+
+	# bound to the class, as the evp module may already be torn
+	# down when the object is collected at interpreter shutdown
+	_EVP_PKEY_free = staticmethod(evp.EVP_PKEY_free)
+
+	def __init__(self, key):
+		self._vkey = None
+		self._vkey = _build_vkey_from_string(key)
+
+	def free(self):
+		"""Frees the native key. The object may not be used afterwards."""
+		if self._vkey:
+			self._EVP_PKEY_free(self._vkey)
+			self._vkey = None
+
+	def __del__(self):
+		self.free()
+
+def verify(data, sig, keyfile=None, key=None, vkey=None):
 	"""Verifies the given signature, returning a boolean.
 
-	Exactly one of keyfile, key should be specified.
+	Exactly one of keyfile, key, vkey should be specified,
+	where vkey is a VerificationKey.
 
 	This function raises SignatureError on error.
 
@@ -117,37 +157,46 @@ def verify(data, sig, keyfile=None, key=None):
 		True
 	"""
 	# add the digests
-	evp.OpenSSL_add_all_digests()
+	_add_all_digests()
 	
 	# build the context
 	ctx = evp.EVP_MD_CTX_create()
 	if not ctx:
 		raise SignatureError("Could not create context")
 
-	# get the vkey
-	if key and not keyfile:
+	# get the vkey, which is only freed here if it is built here
+	if len([arg for arg in (keyfile, key, vkey) if arg]) != 1:
+		evp.EVP_MD_CTX_destroy(ctx)
+		raise SignatureError("Exactly one of key, keyfile, vkey must be specified")
+	if vkey:
+		if not vkey._vkey:
+			evp.EVP_MD_CTX_destroy(ctx)
+			raise SignatureError("The verification key has been freed")
+		verification_key = vkey
+		vkey = vkey._vkey
+	elif key:
+		verification_key = None
 		vkey = _build_vkey_from_string(key)
-	elif keyfile and not key:
-		vkey = _build_vkey_from_file(keyfile)
 	else:
-		raise SignatureError("Exactly one of key, keyfile must be specified")
+		verification_key = None
+		vkey = _build_vkey_from_file(keyfile)
 
 	# build the hash object
 	evp_hash = _build_hash()
 	if not evp.EVP_DigestInit(ctx, evp_hash):
-		_cleanup(vkey, ctx)
+		_cleanup(vkey, ctx, free_key=verification_key is None)
 		raise SignatureError("Could not initialize verifier")
 
 	# update
 	if not evp.EVP_DigestUpdate(ctx, data, len(data)):
-		_cleanup(vkey, ctx)
+		_cleanup(vkey, ctx, free_key=verification_key is None)
 		raise SignatureError("Could not update verifier")
 
 	# finalize
 	retcode = evp.EVP_VerifyFinal(ctx, sig, len(sig), vkey)
 
 	# cleanup
-	_cleanup(vkey, ctx)
+	_cleanup(vkey, ctx, free_key=verification_key is None)
 
 	# and go home
 	if retcode == 1:
@@ -157,11 +206,126 @@ def verify(data, sig, keyfile=None, key=None):
 	else:
 		raise SignatureError("Error verifying signature")
 
-def _cleanup(key, ctx):
-	evp.EVP_PKEY_free(key)
+class Verifier(object):
+	"""Verifies signatures over data that is given in pieces.
+
+	The data is digested as it is passed to update(), so that
+	it need not be held in memory all at once. verify() may be
+	called several times, e.g. once for each signature over the
+	same data, and takes the same keys as the verify() function.
+	The native context is freed by free(), or when the object is
+	garbage collected.
+
+	This class raises SignatureError on error.
+
+	Usage:
+		>>> from evpy import signature
+		>>> f = open("test/short.txt", "rb")
+		>>> data = f.read()
+		>>> public_key = "test/keys/public1.pem"
+		>>> private_key = "test/keys/private1.pem"
+		>>> s = signature.sign(data, private_key)
+		>>> verifier = signature.Verifier()
+		>>> verifier.update(data[:3])
+		>>> verifier.update(data[3:])
+		>>> verifier.verify(s, public_key)
+		True
+	"""
+
+	# bound to the class, as the evp module may already be torn
+	# down when the object is collected at interpreter shutdown
+	_EVP_MD_CTX_cleanup = staticmethod(evp.EVP_MD_CTX_cleanup)
+	_EVP_MD_CTX_destroy = staticmethod(evp.EVP_MD_CTX_destroy)
+
+	def __init__(self):
+		self._ctx = None
+
+		# add the digests
+		_add_all_digests()
+
+		# build the context
+		self._ctx = evp.EVP_MD_CTX_create()
+		if not self._ctx:
+			raise SignatureError("Could not create context")
+
+		# build the hash object
+		evp_hash = _build_hash()
+		if not evp.EVP_DigestInit(self._ctx, evp_hash):
+			self.free()
+			raise SignatureError("Could not initialize verifier")
+
+	def update(self, data):
+		"""Adds the given data to the data being verified."""
+		if not self._ctx:
+			raise SignatureError("The verifier has been freed")
+		if not evp.EVP_DigestUpdate(self._ctx, data, len(data)):
+			raise SignatureError("Could not update verifier")
+
+	def verify(self, sig, keyfile=None, key=None, vkey=None):
+		"""Verifies the given signature over the data given so far,
+		returning a boolean.
+
+		Exactly one of keyfile, key, vkey should be specified,
+		where vkey is a VerificationKey.
+		"""
+		if not self._ctx:
+			raise SignatureError("The verifier has been freed")
+
+		# get the vkey, which is only freed here if it is built here
+		if len([arg for arg in (keyfile, key, vkey) if arg]) != 1:
+			raise SignatureError("Exactly one of key, keyfile, vkey must be specified")
+		if vkey:
+			if not vkey._vkey:
+				raise SignatureError("The verification key has been freed")
+			free_key = False
+			vkey = vkey._vkey
+		elif key:
+			free_key = True
+			vkey = _build_vkey_from_string(key)
+		else:
+			free_key = True
+			vkey = _build_vkey_from_file(keyfile)
+
+		# finalize, which leaves the context itself untouched
+		retcode = evp.EVP_VerifyFinal(self._ctx, sig, len(sig), vkey)
+
+		# cleanup
+		if free_key:
+			evp.EVP_PKEY_free(vkey)
+
+		# and go home
+		if retcode == 1:
+			return True
+		elif retcode == 0:
+			return False
+		else:
+			raise SignatureError("Error verifying signature")
+
+	def free(self):
+		"""Frees the native context. The object may not be used afterwards."""
+		if self._ctx:
+			self._EVP_MD_CTX_cleanup(self._ctx)
+			self._EVP_MD_CTX_destroy(self._ctx)
+			self._ctx = None
+
+	def __del__(self):
+		self.free()
+
+def _cleanup(key, ctx, free_key=True):
+	if free_key:
+		evp.EVP_PKEY_free(key)
 	evp.EVP_MD_CTX_cleanup(ctx)
 	evp.EVP_MD_CTX_destroy(ctx)
 
+_digests_added = False
+
+def _add_all_digests():
+	# the digest table only needs to be loaded once
+	global _digests_added
+	if not _digests_added:
+		evp.OpenSSL_add_all_digests()
+		_digests_added = True
+
 def _string_to_bio(s):
 	return evp.BIO_new_mem_buf(s, len(s))
 
@@ -204,6 +368,7 @@ def _build_vkey_from_string(key):
 	buf = ctypes.create_string_buffer(key)
 	bio = evp.BIO_new_mem_buf(buf, len(buf.value))
 	vkey = evp.PEM_read_bio_PUBKEY(bio, None, None, None)
+	evp.BIO_free(bio)
 	if not vkey:
 		raise SignatureError("Could not construct verification key from the given string")
 	return vkey
@@ -234,6 +234,11 @@ class TestSignature(unittest.TestCase):
 		v = signature.verify(text, s, key=open(keys[1], 'rb').read())
 		return v
 
+	def round_trip_verification_key(self, keys, text):
+		s = signature.sign(text, keys[0])
+		vkey = signature.VerificationKey(open(keys[1], 'rb').read())
+		return signature.verify(text, s, vkey=vkey)
+
 	def round_trip_all_keys(self, text):
 		self.assertTrue(self.round_trip(KEY_1, text))
 		self.assertTrue(self.round_trip(KEY_2, text))
@@ -243,6 +248,10 @@ class TestSignature(unittest.TestCase):
 		self.assertTrue(self.round_trip_strings(KEY_2, text))
 		self.assertFalse(self.round_trip_strings(MISMATCH_1, text))
 		self.assertFalse(self.round_trip_strings(MISMATCH_2, text))
+		self.assertTrue(self.round_trip_verification_key(KEY_1, text))
+		self.assertTrue(self.round_trip_verification_key(KEY_2, text))
+		self.assertFalse(self.round_trip_verification_key(MISMATCH_1, text))
+		self.assertFalse(self.round_trip_verification_key(MISMATCH_2, text))
 
 	def test_round_trip_long(self):
 		self.round_trip_all_keys(LONG)
@@ -267,6 +276,11 @@ class TestSignature(unittest.TestCase):
 		s = signature.sign(text, keyfile=keys[0])
 		self.failUnlessRaises(signature.SignatureError, signature.verify, text, s, key=open(keys[1], 'rb').read(), keyfile=keys[1])
 		self.failUnlessRaises(signature.SignatureError, signature.verify, text, s)
+		vkey = signature.VerificationKey(open(keys[1], 'rb').read())
+		self.failUnlessRaises(signature.SignatureError, signature.verify, text, s, keyfile=keys[1], vkey=vkey)
+		vkey.free()
+		self.failUnlessRaises(signature.SignatureError, signature.verify, text, s, vkey=vkey)
+		self.failUnlessRaises(signature.SignatureError, signature.VerificationKey, 'bad key')
 
 	def test_bad_ctx(self):
 		s = signature.sign(SHORT, KEY_1[0])
@@ -138,6 +138,14 @@ class DownloadError(Error):
 
 
 
+class BadDeltaError(Error):
+  """Indicate that a metadata delta is invalid or cannot be applied."""
+  pass
+
+
+
+
+
 class KeyAlreadyExistsError(Error):
   """Indicate that a key already exists and cannot be added."""
   pass
@@ -100,16 +100,27 @@
 
 """
 
+import array
+import binascii
+import collections
 import errno
 import logging
+import multiprocessing.pool
 import os
+import Queue
+import re
 import shutil
+import sys
+import tempfile
+import threading
 import time
 
 import tuf
 import tuf.conf
+import tuf.delta
 import tuf.download
 import tuf.formats
+import tuf.hash
 import tuf.keydb
 import tuf.log
 import tuf.mirrors
@@ -118,8 +129,27 @@ import tuf.roledb
 import tuf.sig
 import tuf.util
 
+from tuf.compatibility import urlparse
+
 logger = logging.getLogger('tuf.client.updater')
 
+# The version of the format of the metadata cache files written by
+# Updater._save_metadata_to_cache().  Cache files of any other version are
+# ignored.  Version 1 files were written with marshal, version 2 in JSON.
+_METADATA_CACHE_VERSION = 2
+
+# The version of the format of the target index file written by
+# Updater._save_target_index().  Index files of any other version are ignored.
+# Version 1 files were written with marshal, version 2 in JSON.
+_TARGET_INDEX_VERSION = 2
+
+# The coarsest modification time resolution, in seconds, of the filesystems
+# target files may be stored on (FAT records even seconds).  A file modified
+# this recently may be modified again without changing its size or mtime, so
+# its hashes are not recorded in the target index (see
+# Updater._record_target_index_entry()).
+_MTIME_RESOLUTION = 2
+
 
 class Updater(object):
   """
@@ -189,6 +219,10 @@ class Updater(object):
       This method performs the actual download of the specified target.  The
       file is saved to the 'destination_directory' argument.
 
+    download_targets(targets, destination_directory):
+      Like download_target(), but downloads a list of targets concurrently.
+      A report of the targets downloaded and of those that failed is returned.
+
     remove_obsolete_targets(destination_directory):
       Any files located in 'destination_directory' that were previously
       served by the repository but have since been removed, can be deleted
@@ -281,6 +315,20 @@ class Updater(object):
     
     # Store the location of the client's metadata directory.
     self.metadata_directory = {}
+
+    # Store the compiled '_DelegationMatcher' of each role that delegates,
+    # keyed by role name.  See _get_delegation_matcher().
+    self._delegation_matchers = {}
+
+    # The index of verified local target files, loaded on first use, and the
+    # lock that guards it against concurrent downloads.  See
+    # _get_target_index().
+    self._target_index = None
+    self._target_index_lock = threading.Lock()
+
+    # The HTTP validators of the current metadata files, loaded on first use.
+    # See _get_metadata_validators().
+    self._metadata_validators = None
     
     # Ensure the repository metadata directory has been set.
     if tuf.conf.repository_directory is None:
@@ -369,7 +417,8 @@ class Updater(object):
       If the metadata is loaded successfully, it is saved to the metadata
       store.  If 'metadata_role' is 'root', the role and key databases
       are reloaded.  If 'metadata_role' is a target metadata, all its
-      delegated roles are refreshed.
+      delegated roles are refreshed.  If 'tuf.conf.metadata_cache' is set,
+      the metadata object may be loaded from, or saved to, the metadata cache.
 
     <Returns>
       None.
@@ -387,18 +436,48 @@ class Updater(object):
     
     # Ensure the metadata path is valid/exists, else ignore the call. 
     if os.path.exists(metadata_filepath):
-      # Load the file.  The loaded object should conform to
-      # 'tuf.formats.SIGNABLE_SCHEMA'.
-      metadata_signable = tuf.util.load_json_file(metadata_filepath)
-
-      # Ensure the loaded json object is properly formatted.
-      try: 
-        tuf.formats.check_signable_object_format(metadata_signable)
-      except tuf.FormatError, e:
-        raise tuf.RepositoryError('Invalid format: '+repr(metadata_filepath)+'.')
-
-      # Extract the 'signed' role object from 'metadata_signable'.
-      metadata_object = metadata_signable['signed']
+      # Use the parsed and validated metadata object saved to the metadata
+      # cache, if the file has not changed since.
+      metadata_object = None
+      if tuf.conf.metadata_cache:
+        file_length, file_hashes = tuf.util.get_file_details(metadata_filepath)
+        metadata_object = self._load_metadata_from_cache(metadata_set,
+                                                         metadata_role,
+                                                         file_length,
+                                                         file_hashes)
+
+      if metadata_object is None:
+        # Load the file.  The loaded object should conform to
+        # 'tuf.formats.SIGNABLE_SCHEMA'.  A large file is loaded a piece at a
+        # time if it is in canonical JSON, and its targets stored compactly.
+        if self._stream_metadata(os.path.getsize(metadata_filepath)):
+          try:
+            metadata_file = open(metadata_filepath, 'rb')
+          except IOError, e:
+            raise tuf.Error(e)
+          try:
+            metadata_signable = \
+              tuf.util.load_signable_json_file_object(metadata_file,
+                                      targets_factory=_CompactTargets)[0]
+          finally:
+            metadata_file.close()
+        else:
+          metadata_signable = tuf.util.load_json_file(metadata_filepath)
+
+        # Ensure the loaded json object is properly formatted.
+        try: 
+          tuf.formats.check_signable_object_format(metadata_signable)
+        except tuf.FormatError, e:
+          message = 'Invalid format: '+repr(metadata_filepath)+'.'
+          raise tuf.RepositoryError(message)
+
+        # Extract the 'signed' role object from 'metadata_signable'.
+        metadata_object = metadata_signable['signed']
+
+        if tuf.conf.metadata_cache:
+          self._save_metadata_to_cache(metadata_set, metadata_role,
+                                       file_length, file_hashes,
+                                       metadata_object)
    
       # Save the metadata object to the metadata store.
       self.metadata[metadata_set][metadata_role] = metadata_object
@@ -417,6 +496,321 @@ class Updater(object):
 
 
 
+  def _stream_metadata(self, file_length):
+    """Return True if a metadata file of 'file_length' bytes is loaded a piece
+    at a time, with its targets stored compactly (see
+    'tuf.conf.metadata_streaming_threshold')."""
+
+    threshold = tuf.conf.metadata_streaming_threshold
+    return threshold is not None and file_length >= threshold
+
+
+
+
+
+  def _get_metadata_cache_filepath(self, metadata_set, metadata_role):
+    """
+    <Purpose>
+      Return the path of the metadata cache file of 'metadata_role' in
+      'metadata_set'.  Cache files are stored under 'metadata/cache/', next to
+      the 'current' and 'previous' metadata directories.
+
+    <Arguments>
+      metadata_set:
+        The string 'current' or 'previous'.
+
+      metadata_role:
+        The name of the metadata. This is a role name and should
+        not end in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      None.
+
+    <Returns>
+      The path of the cache file.
+
+    """
+
+    metadata_directory = os.path.dirname(self.metadata_directory[metadata_set])
+    return os.path.join(metadata_directory, 'cache', metadata_set,
+                        metadata_role + '.cache')
+
+
+
+
+
+  def _load_metadata_from_cache(self, metadata_set, metadata_role,
+                                file_length, file_hashes):
+    """
+    <Purpose>
+      Load the parsed and validated metadata object of 'metadata_role' saved
+      to the metadata cache by _save_metadata_to_cache().  The cached object
+      is only returned if it was saved for a metadata file with the same
+      length and hashes as the metadata file now on disk, and in the current
+      format version.  The cache file is JSON, so a tampered cache file can
+      at worst hold the wrong metadata: the metadata cache is only as trusted
+      as the metadata directory it is stored in.
+
+    <Arguments>
+      metadata_set:
+        The string 'current' or 'previous'.
+
+      metadata_role:
+        The name of the metadata. This is a role name and should
+        not end in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+      file_length:
+        The length of the metadata file of 'metadata_role'.
+
+      file_hashes:
+        The hashes of the metadata file of 'metadata_role', conformant to
+        'tuf.formats.HASHDICT_SCHEMA'.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      The metadata cache file is read.
+
+    <Returns>
+      The metadata object, or None if it is not cached, the cache file is
+      invalid, or the metadata file has changed.
+
+    """
+
+    cache_filepath = self._get_metadata_cache_filepath(metadata_set,
+                                                       metadata_role)
+    if not os.path.exists(cache_filepath):
+      return None
+
+    try:
+      cache_file = open(cache_filepath, 'rb')
+      try:
+        json = tuf.util.import_json()
+        cache_entry = json.load(cache_file)
+      finally:
+        cache_file.close()
+    except (IOError, ValueError), e:
+      logger.warn('Could not load metadata cache '+repr(cache_filepath)+\
+                  ': '+str(e))
+      return None
+
+    if not isinstance(cache_entry, dict) or \
+       cache_entry.get('version') != _METADATA_CACHE_VERSION or \
+       cache_entry.get('length') != file_length or \
+       cache_entry.get('hashes') != file_hashes or \
+       not isinstance(cache_entry.get('metadata'), dict):
+      logger.info('The metadata cache of '+repr(metadata_role)+' is stale.')
+      return None
+
+    # The cached targets are loaded as a plain dict.
+    metadata_object = cache_entry['metadata']
+    if self._stream_metadata(file_length) and \
+       type(metadata_object.get('targets')) is dict:
+      metadata_object['targets'] = _CompactTargets(metadata_object['targets'])
+
+    return metadata_object
+
+
+
+
+
+  def _save_metadata_to_cache(self, metadata_set, metadata_role, file_length,
+                              file_hashes, metadata_object):
+    """
+    <Purpose>
+      Save the parsed and validated 'metadata_object' of 'metadata_role' to
+      the metadata cache in JSON, along with the format version and the
+      length and hashes of the metadata file it was loaded from.  The cache
+      file is written to a uniquely named temporary file in the cache
+      directory and renamed into place, so a partially written cache file is
+      never loaded, even if several updaters share the repository directory.
+      Failures are logged and otherwise ignored.
+
+    <Arguments>
+      metadata_set:
+        The string 'current' or 'previous'.
+
+      metadata_role:
+        The name of the metadata. This is a role name and should
+        not end in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+      file_length:
+        The length of the metadata file of 'metadata_role'.
+
+      file_hashes:
+        The hashes of the metadata file of 'metadata_role', conformant to
+        'tuf.formats.HASHDICT_SCHEMA'.
+
+      metadata_object:
+        The validated metadata object loaded from the metadata file.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      The metadata cache file is written.
+
+    <Returns>
+      None.
+
+    """
+
+    cache_filepath = self._get_metadata_cache_filepath(metadata_set,
+                                                       metadata_role)
+
+    # Compact targets are saved as a plain dict.
+    if isinstance(metadata_object.get('targets'), _CompactTargets):
+      metadata_object = dict(metadata_object)
+      metadata_object['targets'] = metadata_object['targets'].to_dict()
+
+    cache_entry = {'version': _METADATA_CACHE_VERSION,
+                   'length': file_length,
+                   'hashes': file_hashes,
+                   'metadata': metadata_object}
+
+    temporary_filepath = None
+    try:
+      tuf.util.ensure_parent_dir(cache_filepath)
+      file_descriptor, temporary_filepath = \
+        tempfile.mkstemp(prefix=os.path.basename(cache_filepath)+'.',
+                         dir=os.path.dirname(cache_filepath))
+      cache_file = os.fdopen(file_descriptor, 'wb')
+      try:
+        json = tuf.util.import_json()
+        json.dump(cache_entry, cache_file, separators=(',', ':'))
+      finally:
+        cache_file.close()
+      os.rename(temporary_filepath, cache_filepath)
+    except (IOError, OSError, ValueError), e:
+      logger.warn('Could not save metadata cache '+repr(cache_filepath)+\
+                  ': '+str(e))
+      if temporary_filepath is not None and os.path.exists(temporary_filepath):
+        os.remove(temporary_filepath)
+
+
+
+
+
+  def _get_metadata_validators_filepath(self):
+    """Return the path of the metadata validators file, 'metadata/validators'
+    under the repository directory."""
+
+    metadata_directory = os.path.dirname(self.metadata_directory['current'])
+    return os.path.join(metadata_directory, 'validators')
+
+
+
+
+
+  def _get_metadata_validators(self, metadata_filename):
+    """
+    <Purpose>
+      Return the validators (see 'tuf.download') that each mirror sent with
+      the copy of 'metadata_filename' it last served, keyed by the mirror's
+      url for the file.  The validators of all metadata files are loaded from
+      the metadata validators file the first time they are needed.  A missing
+      or invalid file yields no validators.
+
+    <Arguments>
+      metadata_filename:
+        The name of the metadata file, e.g., 'timestamp.txt'.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      The metadata validators file may be read.
+
+    <Returns>
+      A new dictionary, conformant to the values of
+      'tuf.formats.VALIDATORSDICT_SCHEMA'.
+
+    """
+
+    if self._metadata_validators is None:
+      self._metadata_validators = {}
+      validators_filepath = self._get_metadata_validators_filepath()
+      if os.path.exists(validators_filepath):
+        try:
+          saved_validators = tuf.util.load_json_file(validators_filepath)
+          tuf.formats.VALIDATORSDICT_SCHEMA.check_match(saved_validators)
+        except (tuf.Error, ValueError, IOError), e:
+          logger.warn('Ignoring metadata validators '+\
+                      repr(validators_filepath)+': '+str(e))
+        else:
+          self._metadata_validators = saved_validators
+
+    validators = self._metadata_validators.get(metadata_filename, {})
+    return dict([(mirror_url, dict(mirror_validators)) for
+                 mirror_url, mirror_validators in validators.items()])
+
+
+
+
+
+  def _save_metadata_validators(self, metadata_filename, mirror_url,
+                                validators):
+    """
+    <Purpose>
+      Record the 'validators' that 'mirror_url' sent with the copy of
+      'metadata_filename' that was just installed, and save the validators of
+      all metadata files to the metadata validators file.  The file is
+      written to a temporary file and renamed into place.  Failures are
+      logged and otherwise ignored.
+
+    <Arguments>
+      metadata_filename:
+        The name of the metadata file, e.g., 'timestamp.txt'.
+
+      mirror_url:
+        The url the metadata file was downloaded from.
+
+      validators:
+        A dictionary conformant to 'tuf.formats.VALIDATORS_SCHEMA'.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      The metadata validators file is written.
+
+    <Returns>
+      None.
+
+    """
+
+    # Load the validators of the other metadata files first.
+    self._get_metadata_validators(metadata_filename)
+    file_validators = \
+      self._metadata_validators.setdefault(metadata_filename, {})
+    if validators:
+      file_validators[mirror_url] = validators
+    else:
+      file_validators.pop(mirror_url, None)
+
+    validators_filepath = self._get_metadata_validators_filepath()
+    temporary_filepath = validators_filepath + '.tmp'
+    try:
+      validators_file = open(temporary_filepath, 'w')
+      try:
+        json = tuf.util.import_json()
+        json.dump(self._metadata_validators, validators_file, indent=1,
+                  sort_keys=True)
+      finally:
+        validators_file.close()
+      os.rename(temporary_filepath, validators_filepath)
+    except (IOError, OSError), e:
+      logger.warn('Could not save metadata validators '+\
+                  repr(validators_filepath)+': '+str(e))
+
+
+
+
+
   def _rebuild_key_and_role_db(self):
     """
     <Purpose>
@@ -569,14 +963,19 @@ class Updater(object):
     # Update the top-level metadata.  The _update_metadata_if_changed() and
     # _update_metadata() calls below do NOT perform an update if there
     # is insufficient trusted signatures for the specified metadata.
-    # Raise 'tuf.RepositoryError' if an update fails.
-    self._update_metadata('timestamp')
+    # Raise 'tuf.RepositoryError' if an update fails.  The mirror statistics
+    # gathered while downloading are saved, even if an update fails.
+    try:
+      self._update_metadata('timestamp')
 
-    self._update_metadata_if_changed('release', referenced_metadata='timestamp')
+      self._update_metadata_if_changed('release',
+                                       referenced_metadata='timestamp')
 
-    self._update_metadata_if_changed('root')
+      self._update_metadata_if_changed('root')
 
-    self._update_metadata_if_changed('targets')
+      self._update_metadata_if_changed('targets')
+    finally:
+      tuf.mirrors.save_mirror_statistics()
 
     # Updated the top-level metadata (which all had valid signatures), however,
     # have they expired?  Raise 'tuf.ExpiredMetadataError' if any of the metadata
@@ -588,7 +987,8 @@ class Updater(object):
 
 
 
-  def _update_metadata(self, metadata_role, fileinfo=None, compression=None):
+  def _update_metadata(self, metadata_role, fileinfo=None, compression=None,
+                       delta=None, compressed_fileinfo=None):
     """
     <Purpose>
       Download, verify, and 'install' the metadata belonging to 'metadata_role'.
@@ -609,9 +1009,17 @@ class Updater(object):
 
       compression:
         A string designating the compression type of 'metadata_role'.
-        The 'release' metadata file may be optionally downloaded and stored in
-        compressed form.  Currently, only metadata files compressed with 'gzip'
-        are considered.  Any other string is ignored.
+        The 'release' and Targets metadata files may be optionally downloaded
+        in compressed form.  See 'tuf.util.register_compression()'.
+
+      delta:
+        A (delta_filename, delta_fileinfo) tuple designating a delta of the
+        current 'metadata_role' file that is tried first, or None.  See
+        _download_metadata_update().
+
+      compressed_fileinfo:
+        The length and hashes of the compressed metadata file, if
+        'compression' is set.
 
     <Exceptions>
       tuf.RepositoryError:
@@ -624,129 +1032,787 @@ class Updater(object):
       repository mirror.  If the metadata is valid, it is stored to the 
       metadata store.
 
+      If 'fileinfo' is None and 'tuf.conf.conditional_metadata_requests' is
+      set, the request is conditional on the validators of the copy of the
+      current metadata file that the mirror served.  If the mirror has not
+      modified the file, the current metadata is kept (its expiration is
+      checked by the caller, e.g., refresh()).  The validators of the
+      downloaded file are saved.
+
     <Returns>
       None.
     
     """
     
-    # Construct the metadata filename as expected by the download/mirror modules.
+    # Download the metadata from the first mirror that serves a properly
+    # signed copy, and then install it.  The download and signature checks are
+    # performed separately so that they may be done outside of the thread
+    # that manages the metadata store (see _refresh_targets_metadata()).
+    # Metadata that is downloaded without a trusted length and hashes (i.e.,
+    # 'timestamp') is requested with the validators of the copy each mirror
+    # last served.  They are only used while that copy is current.
     metadata_filename = metadata_role + '.txt'
-   
-    # The 'release' or Targets metadata may be compressed.  Add the appropriate
-    # extension to 'metadata_filename'. 
-    if compression == 'gzip':
-      metadata_filename = metadata_filename + '.gz'
+    validators = None
+    if fileinfo is None and tuf.conf.conditional_metadata_requests:
+      validators = {}
+      if metadata_role in self.metadata['current']:
+        validators = self._get_metadata_validators(metadata_filename)
+
+    downloaded, compression = \
+      self._download_metadata_update(metadata_role, fileinfo, compression,
+                                     compressed_fileinfo, delta, validators)
+    metadata_file_object, metadata_signable, mirror_url = downloaded
+
+    if metadata_file_object is None:
+      logger.info(mirror_url+' has not been modified.  Keeping the current '+\
+                  repr(metadata_filename)+'.')
+      return
 
-    # Reference to the 'get_list_of_mirrors' function.
-    get_mirrors = tuf.mirrors.get_list_of_mirrors
+    self._install_metadata(metadata_role, metadata_file_object,
+                           metadata_signable, mirror_url, compression)
+    if validators is not None:
+      self._save_metadata_validators(metadata_filename, mirror_url,
+                                     validators[mirror_url])
 
-    # Reference to the 'download_url_to_tempfileobj' function.
-    download_file = tuf.download.download_url_to_tempfileobj
 
-    # Extract file length and file hashes.  They will be passed as arguments
-    # to 'download_file' function.
-    if fileinfo is not None:
-      file_length=fileinfo['length']
-      file_hashes=fileinfo['hashes']
-    else:
-      file_length=None
-      file_hashes=None
 
-    # Attempt a file download from each mirror until the file is downloaded and
-    # verified.  If the signature of the downloaded file is valid, proceed,
-    # otherwise log a warning and try the next mirror.  'metadata_file_object'
-    # is the file-like object returned by 'download.py'.  'metadata_signable'
-    # is the object extracted from 'metadata_file_object'.  Metadata saved to
-    # files are regarded as 'signable' objects, conformant to
-    # 'tuf.formats.SIGNABLE_SCHEMA'.
-    metadata_file_object = None
-    metadata_signable = None
-    for mirror_url in get_mirrors('meta', metadata_filename.encode("utf-8"), self.mirrors):
-      try:
-        metadata_file_object = download_file(mirror_url, file_hashes, 
-                                             file_length)
-      except tuf.DownloadError, e:
-        logger.warn('Download failed from '+mirror_url+'.')
-        continue
-      if compression:
-        metadata_file_object.decompress_temp_file_object(compression)
 
-      # Read and load the downloaded file.
-      metadata_signable = tuf.util.load_json_string(metadata_file_object.read())
 
-      # Verify the signature on the downloaded metadata object.
-      try:
-        valid = tuf.sig.verify(metadata_signable, metadata_role)
-      except (tuf.UnknownRoleError, tuf.FormatError, tuf.Error), e:
-        # FIXME: Exception.message is deprecated in 2.6, and gone in 3.0,
-        # but this is a workaround for Unicode messages. We need a long-term
-        # solution with #61.
-        # http://bugs.python.org/issue2517
-        message = 'Unable to verify '+metadata_filename+':'+e.message.encode("utf-8")
-        logger.exception(message)
-        metadata_signable = None
-        continue
-      else:
-        if valid:
-          logger.debug('Good signature on '+mirror_url+'.')
-          break
-        else:
-          logger.warn('Bad signature on '+mirror_url+'.')
-          metadata_signable = None
-          continue
-    
-    # Raise an exception if a valid metadata signable could not be downloaded
-    # from any of the mirrors.
-    if metadata_signable is None:
-      message = 'Unable to update '+repr(metadata_filename)+'.'
-      logger.error(message)
-      raise tuf.RepositoryError(message)
+  def _download_metadata_update(self, metadata_role, fileinfo, compression,
+                                compressed_fileinfo, delta, validators=None):
+    """
+    <Purpose>
+      Download the changed metadata belonging to 'metadata_role' and verify its
+      signatures.  If 'delta' is set, the delta is downloaded and applied to
+      the current metadata file first (see _download_metadata_delta()).
+      Otherwise, or if that fails, the whole file is downloaded (see
+      _download_metadata()).  Like _download_metadata(), this method may be
+      called from a worker thread.
 
-    # Ensure the loaded 'metadata_signable' is properly formatted.
-    try:
-      tuf.formats.check_signable_object_format(metadata_signable)
-    except tuf.FormatError, e:
-      message = 'Unable to load '+repr(metadata_filename)+' after update: '+str(e)
-      raise tuf.RepositoryError(message)
+    <Arguments>
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
 
-    # Is 'metadata_signable' newer than the currently installed
-    # version?
-    current_metadata_role = self.metadata['current'].get(metadata_role)
-    
-    # Compare metadata version numbers.  Ensure there is a current
-    # version of the metadata role to be updated.
-    if current_metadata_role is not None:
-      current_version = current_metadata_role['version'] 
-      downloaded_version = metadata_signable['signed']['version']
-      if downloaded_version < current_version:
-        message = repr(mirror_url)+' is older than the version currently '+\
-          'installed.\nDownloaded version: '+repr(downloaded_version)+'\n'+\
-          'Current version: '+repr(current_version)
-        raise tuf.RepositoryError(message)
-      
-    # Reject the metadata if any specified targets are not allowed.
-    if metadata_signable['signed']['_type'] == 'Targets':
-      self._ensure_all_targets_allowed(metadata_role, metadata_signable['signed'])
+      fileinfo:
+        The trusted length and hashes of the metadata file.
 
-    # The metadata has been verified. Move the metadata file into place.
-    # First, move the 'current' metadata file to the 'previous' directory
-    # if it exists.
-    current_filepath = os.path.join(self.metadata_directory['current'],
-                                    metadata_filename)
-    current_filepath = os.path.abspath(current_filepath)
-    tuf.util.ensure_parent_dir(current_filepath)
-    
-    previous_filepath = os.path.join(self.metadata_directory['previous'],
-                                     metadata_filename)
-    previous_filepath = os.path.abspath(previous_filepath)
-    if os.path.exists(current_filepath):
-      # Previous metadata might not exist, say when delegations are added.
-      tuf.util.ensure_parent_dir(previous_filepath)
-      shutil.move(current_filepath, previous_filepath)
+      compression:
+        A string designating the compression type of 'metadata_role', or None.
 
-    # Next, move the verified updated metadata file to the 'current' directory.
-    # Note that the 'move' method comes from tuf.util's TempFile class.
-    # 'metadata_file_object' is an instance of tuf.util.TempFile.
+      compressed_fileinfo:
+        The trusted length and hashes of the compressed metadata file, if
+        'compression' is set.
+
+      delta:
+        A (delta_filename, delta_fileinfo) tuple, as returned by
+        _get_metadata_delta(), or None.
+
+      validators:
+        The validators to make the download of the whole file conditional on,
+        as for _download_metadata(), or None.
+
+    <Exceptions>
+      tuf.RepositoryError:
+        The metadata could not be downloaded and verified from any of the
+        mirrors.
+
+    <Side Effects>
+      The delta or metadata file is downloaded from a repository mirror.
+
+    <Returns>
+      A (downloaded, compression) tuple, where 'downloaded' is the tuple
+      returned by _download_metadata() and 'compression' the compression type
+      to install the metadata with: None if the delta was applied.
+
+    """
+
+    if delta is not None:
+      delta_filename, delta_fileinfo = delta
+      downloaded = self._download_metadata_delta(metadata_role, fileinfo,
+                                                 delta_filename,
+                                                 delta_fileinfo)
+      if downloaded is not None:
+        return downloaded, None
+
+    # A compressed file is downloaded with its own length and hashes, and
+    # decompressed to the trusted length of the metadata file.
+    uncompressed_length = None
+    if compression is not None:
+      if fileinfo is not None:
+        uncompressed_length = fileinfo['length']
+      fileinfo = compressed_fileinfo
+    downloaded = self._download_metadata(metadata_role, fileinfo, compression,
+                                         uncompressed_length, validators)
+    return downloaded, compression
+
+
+
+
+
+  def _download_metadata_delta(self, metadata_role, fileinfo, delta_filename,
+                               delta_fileinfo):
+    """
+    <Purpose>
+      Update the metadata belonging to 'metadata_role' by downloading the delta
+      'delta_filename' and applying it to the current metadata file (see
+      'tuf.delta').  The delta is downloaded with its trusted length and
+      hashes, and the file it produces is accepted only if it matches the
+      trusted length and hashes in 'fileinfo'.  Its signatures are then
+      verified, and its targets checked, as for a downloaded file.  Only the
+      current metadata file of 'metadata_role', which is not modified while
+      the metadata is downloaded, is read from the metadata store.
+
+    <Arguments>
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'targets', 'targets/linux/x86'.
+
+      fileinfo:
+        The trusted length and hashes of the metadata file.
+
+      delta_filename:
+        The name of the delta, e.g., 'targets.txt.delta.<sha256 hex digest>'.
+
+      delta_fileinfo:
+        The trusted length and hashes of the delta.
+
+    <Exceptions>
+      Exceptions other than download, delta, and signature verification errors
+      are not handled.
+
+    <Side Effects>
+      The delta is downloaded from a repository mirror, and the current
+      metadata file is read.
+
+    <Returns>
+      A (metadata_file_object, metadata_signable, mirror_url) tuple, like
+      _download_metadata(), or None if the metadata could not be updated with
+      the delta.
+
+    """
+
+    metadata_filename = metadata_role + '.txt'
+    current_filepath = os.path.join(self.metadata_directory['current'],
+                                    metadata_filename)
+    target_check = self._get_target_check(metadata_role)
+
+    mirror_urls = tuf.mirrors.get_list_of_mirrors('meta',
+                                                  delta_filename.encode('utf-8'),
+                                                  self.mirrors)
+    for mirror_url in mirror_urls:
+      try:
+        delta_file_object = \
+          tuf.download.download_url_to_tempfileobj(mirror_url,
+                                                   delta_fileinfo['hashes'],
+                                                   delta_fileinfo['length'])
+      except tuf.DownloadError, e:
+        logger.warn('Download failed from '+mirror_url+'.')
+        continue
+
+      # The delta matches its trusted hashes, so any other mirror would serve
+      # the same delta.  If it cannot be applied, the whole metadata file is
+      # downloaded instead.
+      metadata_file_object = tuf.util.TempFile()
+      try:
+        try:
+          current_file_object = open(current_filepath, 'rb')
+          try:
+            tuf.delta.apply_delta(current_file_object, delta_file_object,
+                                  metadata_file_object, fileinfo['length'],
+                                  fileinfo['hashes'])
+          finally:
+            current_file_object.close()
+        finally:
+          delta_file_object.close_temp_file()
+      except (IOError, tuf.BadDeltaError, tuf.BadHashError), e:
+        logger.warn('Unable to apply '+repr(delta_filename)+': '+str(e))
+        metadata_file_object.close_temp_file()
+        return None
+
+      logger.info('Applied '+repr(delta_filename)+' from '+mirror_url+'.')
+      metadata = self._load_downloaded_metadata(mirror_url, metadata_role,
+                                                metadata_filename,
+                                                metadata_file_object,
+                                                fileinfo['length'],
+                                                target_check)
+      if metadata is None:
+        return None
+      return metadata + (mirror_url,)
+
+    return None
+
+
+
+
+
+  def _download_metadata(self, metadata_role, fileinfo=None, compression=None,
+                         uncompressed_length=None, validators=None):
+    """
+    <Purpose>
+      Download the metadata belonging to 'metadata_role' and verify its
+      signatures.  Each mirror is tried in turn until a copy with a valid
+      length, hashes, and threshold of signatures is downloaded.  If
+      'tuf.conf.metadata_hedge_delay' is set, mirrors are instead raced with
+      hedged requests (see _download_metadata_hedged()).  The targets listed
+      by a delegated role are checked against the delegations of its parent
+      role as the metadata is loaded.  Other than the parent's metadata, the
+      metadata store is neither read nor modified, so this method may be called
+      from a worker thread, provided the parent's metadata is trusted and the
+      role and key databases already hold the delegation information for
+      'metadata_role'.
+
+    <Arguments>
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+      
+      fileinfo:
+        A dictionary containing length and hashes of the metadata file, as
+        downloaded: if 'compression' is set, of the compressed file.
+        Ex: {"hashes": {"sha256": "3a5a6ec1f353...dedce36e0"}, 
+             "length": 1340}
+
+      compression:
+        A string designating the compression type of 'metadata_role', one of
+        the compressions registered in 'tuf.util', or None.  The metadata is
+        decompressed as it is downloaded.
+
+      uncompressed_length:
+        The trusted length of the decompressed metadata file, if 'compression'
+        is set, or None.
+
+      validators:
+        If set, a dictionary of the validators (see 'tuf.download') sent by
+        each mirror with the copy of the file the client has, keyed by the
+        mirror's url for the file.  The request to each mirror is conditional
+        on them.  The validators of the mirror the file is downloaded from
+        are replaced with the validators of the downloaded file.
+
+    <Exceptions>
+      tuf.RepositoryError:
+        The metadata could not be downloaded and verified from any of the
+        mirrors, or the parent role of 'metadata_role' has not delegated to
+        it.
+
+    <Side Effects>
+      The metadata file belonging to 'metadata_role' is downloaded from a
+      repository mirror.  'validators' is updated.
+
+    <Returns>
+      A (metadata_file_object, metadata_signable, mirror_url) tuple, where
+      'metadata_file_object' is the 'tuf.util.TempFile' holding the downloaded
+      file and 'metadata_signable' the verified object loaded from it.  Both
+      are None if 'validators' is set and the mirror at 'mirror_url' has not
+      modified the file.
+
+    """
+
+    # Construct the metadata filename as expected by the download/mirror modules.
+    metadata_filename = metadata_role + '.txt'
+   
+    # The 'release' or Targets metadata may be compressed.  Add the appropriate
+    # extension to 'metadata_filename'. 
+    if compression is not None:
+      metadata_filename = \
+        tuf.util.get_compressed_filename(metadata_filename, compression)
+
+    # Extract file length and file hashes.  They will be passed as arguments
+    # to the download function.
+    if fileinfo is not None:
+      file_length=fileinfo['length']
+      file_hashes=fileinfo['hashes']
+    else:
+      file_length=None
+      file_hashes=None
+
+    # Attempt a file download from each mirror until the file is downloaded and
+    # verified.  If the signature of the downloaded file is valid, proceed,
+    # otherwise log a warning and try the next mirror.  'metadata_file_object'
+    # is the file-like object returned by 'download.py'.  'metadata_signable'
+    # is the object extracted from 'metadata_file_object'.  Metadata saved to
+    # files are regarded as 'signable' objects, conformant to
+    # 'tuf.formats.SIGNABLE_SCHEMA'.
+    mirror_urls = tuf.mirrors.get_list_of_mirrors('meta',
+                                              metadata_filename.encode("utf-8"),
+                                              self.mirrors)
+
+    # Each request updates a copy of the validators of its mirror, so that
+    # only those of the winning request are kept.
+    mirror_validators = None
+    if validators is not None:
+      mirror_validators = {}
+      for mirror_url in mirror_urls:
+        mirror_validators[mirror_url] = dict(validators.get(mirror_url, {}))
+
+    # The targets of a delegated role must be allowed by its parent role.
+    target_check = self._get_target_check(metadata_role)
+    download_arguments = (metadata_role, metadata_filename, file_hashes,
+                          file_length, compression, uncompressed_length,
+                          target_check, mirror_validators)
+
+    hedge_delay = tuf.conf.metadata_hedge_delay
+    if hedge_delay is not None and len(mirror_urls) > 1:
+      downloaded = self._download_metadata_hedged(mirror_urls,
+                                                  download_arguments,
+                                                  hedge_delay)
+    else:
+      downloaded = None
+      for mirror_url in mirror_urls:
+        metadata = self._download_metadata_from_mirror(mirror_url,
+                                                       *download_arguments)
+        if metadata is not None:
+          downloaded = metadata + (mirror_url,)
+          break
+    
+    # Raise an exception if a valid metadata signable could not be downloaded
+    # from any of the mirrors.
+    if downloaded is None:
+      message = 'Unable to update '+repr(metadata_filename)+'.'
+      logger.error(message)
+      raise tuf.RepositoryError(message)
+
+    if validators is not None:
+      mirror_url = downloaded[2]
+      validators[mirror_url] = mirror_validators[mirror_url]
+
+    return downloaded
+
+
+
+
+
+  def _download_metadata_from_mirror(self, mirror_url, metadata_role,
+                                     metadata_filename, file_hashes,
+                                     file_length, compression,
+                                     uncompressed_length, target_check,
+                                     mirror_validators=None,
+                                     cancel_event=None):
+    """
+    <Purpose>
+      Download the metadata belonging to 'metadata_role' from 'mirror_url' and
+      verify its signatures.  Like _download_metadata(), this method neither
+      reads nor modifies the metadata store.
+
+    <Arguments>
+      mirror_url:
+        The url of the metadata file on a mirror.
+
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+      metadata_filename:
+        The name of the metadata file, e.g., 'targets.txt.gz'.
+
+      file_hashes:
+        The trusted hashes of the metadata file, or None.
+
+      file_length:
+        The trusted length of the metadata file, or None.
+
+      compression:
+        A string designating the compression type of 'metadata_role', or None.
+        'file_hashes' and 'file_length' are checked against the downloaded
+        bytes, which are decompressed as they are downloaded.
+
+      uncompressed_length:
+        The trusted length of the decompressed metadata file, or None.
+
+      target_check:
+        The function returned by _get_target_check() for 'metadata_role', or
+        None.
+
+      mirror_validators:
+        A dictionary of the validators to make the request to each mirror
+        conditional on, keyed by mirror url, or None.  The validators of
+        'mirror_url' are updated (see 'tuf.download').
+
+      cancel_event:
+        A 'threading.Event' that cancels the download once set, or None (see
+        'tuf.download.download_url_to_tempfileobj()').
+
+    <Exceptions>
+      Exceptions other than download errors, disallowed targets and signature
+      verification errors are not handled (e.g., errors loading the
+      downloaded json).
+
+    <Side Effects>
+      The metadata file is downloaded from 'mirror_url'.  A mirror that serves
+      badly signed metadata is recorded as failing (see 'tuf.mirrors').
+
+    <Returns>
+      A (metadata_file_object, metadata_signable) tuple, (None, None) if the
+      mirror has not modified the file since the validators were recorded,
+      or None if a valid copy of the metadata could not be downloaded from
+      'mirror_url'.
+
+    """
+
+    download_options = {}
+    if mirror_validators is not None:
+      download_options['validators'] = mirror_validators[mirror_url]
+    if cancel_event is not None:
+      download_options['cancel_event'] = cancel_event
+
+    try:
+      metadata_file_object = \
+        tuf.download.download_url_to_tempfileobj(mirror_url, file_hashes,
+                                                 file_length,
+                                                 compression=compression,
+                                          uncompressed_length=uncompressed_length,
+                                                 **download_options)
+    except tuf.DownloadError, e:
+      logger.warn('Download failed from '+mirror_url+'.')
+      return None
+    if metadata_file_object is None:
+      return None, None
+
+    # The decompressed metadata is at least as long as the compressed file.
+    metadata_length = 0
+    if uncompressed_length is not None:
+      metadata_length = uncompressed_length
+    elif file_length is not None:
+      metadata_length = file_length
+
+    return self._load_downloaded_metadata(mirror_url, metadata_role,
+                                          metadata_filename,
+                                          metadata_file_object,
+                                          metadata_length, target_check)
+
+
+
+
+
+  def _load_downloaded_metadata(self, mirror_url, metadata_role,
+                                metadata_filename, metadata_file_object,
+                                metadata_length, target_check):
+    """
+    <Purpose>
+      Load the metadata belonging to 'metadata_role' from the (decompressed)
+      'metadata_file_object' downloaded from 'mirror_url', and verify its
+      signatures.  See _download_metadata_from_mirror().
+
+    <Arguments>
+      mirror_url:
+        The url the metadata, or its delta, was downloaded from.
+
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+      metadata_filename:
+        The name of the metadata file, e.g., 'targets.txt.gz'.
+
+      metadata_file_object:
+        The 'tuf.util.TempFile' holding the metadata.  It is closed if the
+        metadata is not valid.
+
+      metadata_length:
+        The trusted length of the metadata, or a lower bound of it (e.g., 0
+        if it is not known).  Long metadata is loaded a piece at a time (see
+        _stream_metadata()).
+
+      target_check:
+        The function returned by _get_target_check() for 'metadata_role', or
+        None.
+
+    <Exceptions>
+      Exceptions other than disallowed targets and signature verification
+      errors are not handled (e.g., errors loading the downloaded json).
+
+    <Side Effects>
+      A mirror that serves badly signed metadata is recorded as failing (see
+      'tuf.mirrors').
+
+    <Returns>
+      A (metadata_file_object, metadata_signable) tuple, or None if the
+      metadata is not valid.
+
+    """
+
+    # Load the downloaded file.  If the file is in canonical JSON, the signed
+    # bytes are taken from it rather than encoded again.  A large file is
+    # read a piece at a time, the signed bytes are digested as they are read,
+    # and each target is checked as it is loaded and stored compactly.  The
+    # signatures have not been verified yet, so a file listing targets that
+    # are not allowed is blamed on the mirror.
+    try:
+      if self._stream_metadata(metadata_length):
+        metadata_signable, signed_data = \
+          tuf.util.load_signable_json_file_object(metadata_file_object,
+                                                  tuf.sig.SignedData(),
+                                                  target_check,
+                                                  _CompactTargets)
+      else:
+        metadata_signable, signed_data = \
+          tuf.util.load_signable_json_string(metadata_file_object.read())
+        if target_check is not None:
+          # The loaded object has not been validated yet.
+          try:
+            targets = metadata_signable['signed']['targets']
+          except (KeyError, TypeError):
+            targets = None
+          if isinstance(targets, dict):
+            for target_filepath in targets:
+              target_check(target_filepath)
+    except tuf.RepositoryError, e:
+      logger.warn('Unable to load '+mirror_url+': '+str(e))
+      metadata_file_object.close_temp_file()
+      return None
+
+    # Verify the signature on the downloaded metadata object.
+    try:
+      valid = tuf.sig.verify(metadata_signable, metadata_role, signed_data)
+    except (tuf.UnknownRoleError, tuf.FormatError, tuf.Error), e:
+      # FIXME: Exception.message is deprecated in 2.6, and gone in 3.0,
+      # but this is a workaround for Unicode messages. We need a long-term
+      # solution with #61.
+      # http://bugs.python.org/issue2517
+      message = 'Unable to verify '+metadata_filename+':'+e.message.encode("utf-8")
+      logger.exception(message)
+      metadata_file_object.close_temp_file()
+      return None
+
+    if not valid:
+      logger.warn('Bad signature on '+mirror_url+'.')
+      # A mirror serving badly signed metadata is backed off from, like
+      # a mirror that could not be downloaded from.
+      tuf.mirrors.record_failure(mirror_url)
+      metadata_file_object.close_temp_file()
+      return None
+
+    logger.debug('Good signature on '+mirror_url+'.')
+    return metadata_file_object, metadata_signable
+
+
+
+
+
+  def _download_metadata_hedged(self, mirror_urls, download_arguments,
+                                hedge_delay):
+    """
+    <Purpose>
+      Download and verify a metadata file with hedged requests.  The file is
+      requested from the first mirror in 'mirror_urls'.  Whenever no request
+      has succeeded for 'hedge_delay' seconds, or a request fails, the file is
+      also requested from the next mirror.  The first copy that passes the
+      length, hash and signature checks wins.  Requests still in progress
+      are then cancelled: each stops before it reads its next block of data
+      and closes its connection, which is not reused (see
+      'tuf.download.download_url_to_tempfileobj()').  The downloads of
+      requests that complete in the meantime are discarded.
+
+    <Arguments>
+      mirror_urls:
+        The urls of the metadata file on each mirror, in order of preference.
+
+      download_arguments:
+        The arguments of _download_metadata_from_mirror() that follow
+        'mirror_url'.
+
+      hedge_delay:
+        The number of seconds to wait for a request before also sending the
+        next one.
+
+    <Exceptions>
+      Any exception not handled by _download_metadata_from_mirror() is
+      re-raised.
+
+    <Side Effects>
+      The metadata file is downloaded from one or more mirrors, by threads
+      that may outlive this call until their requests are cancelled.
+
+    <Returns>
+      A (metadata_file_object, metadata_signable, mirror_url) tuple, as
+      returned by _download_metadata(), or None if a valid copy could not be
+      downloaded from any of the mirrors.
+
+    """
+
+    results = Queue.Queue()
+
+    # Once set, requests that complete discard their downloads instead of
+    # queueing them.  Guarded by 'lock'.
+    state = {'abandoned': False}
+    lock = threading.Lock()
+
+    # The cancel events of the requests sent.
+    cancel_events = []
+
+    def request(mirror_url, cancel_event):
+      try:
+        metadata = \
+          self._download_metadata_from_mirror(mirror_url, *download_arguments,
+                                              cancel_event=cancel_event)
+        exc_info = None
+      except:
+        metadata = None
+        exc_info = sys.exc_info()
+      lock.acquire()
+      try:
+        if not state['abandoned']:
+          results.put((mirror_url, metadata, exc_info))
+          return
+      finally:
+        lock.release()
+      if metadata is not None and metadata[0] is not None:
+        metadata[0].close_temp_file()
+
+    def send_next_request():
+      mirror_url = pending_urls.pop(0)
+      logger.debug('Requesting '+mirror_url+'.')
+      cancel_event = threading.Event()
+      cancel_events.append(cancel_event)
+      thread = threading.Thread(target=request,
+                                args=(mirror_url, cancel_event))
+      thread.daemon = True
+      thread.start()
+
+    pending_urls = list(mirror_urls)
+    requests_in_progress = 0
+    try:
+      send_next_request()
+      requests_in_progress = 1
+      while requests_in_progress:
+        try:
+          if pending_urls:
+            result = results.get(timeout=hedge_delay)
+          else:
+            result = results.get()
+        except Queue.Empty:
+          logger.info('Hedging the request for '+repr(download_arguments[1])+\
+                      ' after '+str(hedge_delay)+' seconds.')
+          send_next_request()
+          requests_in_progress = requests_in_progress + 1
+          continue
+
+        requests_in_progress = requests_in_progress - 1
+        mirror_url, metadata, exc_info = result
+        if exc_info is not None:
+          raise exc_info[0], exc_info[1], exc_info[2]
+        if metadata is not None:
+          return metadata + (mirror_url,)
+        if pending_urls:
+          send_next_request()
+          requests_in_progress = requests_in_progress + 1
+
+      return None
+
+    finally:
+      # Cancel the requests still in progress, and discard the downloads of
+      # those that completed in the meantime.
+      lock.acquire()
+      try:
+        state['abandoned'] = True
+      finally:
+        lock.release()
+      for cancel_event in cancel_events:
+        cancel_event.set()
+      while True:
+        try:
+          mirror_url, metadata, exc_info = results.get_nowait()
+        except Queue.Empty:
+          break
+        if metadata is not None and metadata[0] is not None:
+          metadata[0].close_temp_file()
+
+
+
+
+
+  def _install_metadata(self, metadata_role, metadata_file_object,
+                        metadata_signable, mirror_url, compression=None):
+    """
+    <Purpose>
+      'Install' the downloaded and verified metadata belonging to
+      'metadata_role'.  The metadata is rejected if it is older than the
+      currently trusted version.  (Its targets were already checked against
+      the delegations of its parent role by _download_metadata().)  Otherwise,
+      the 'current' metadata file is moved to the 'previous' directory, the
+      downloaded file takes its place, and the current and previous metadata
+      stores are updated.
+
+    <Arguments>
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+      metadata_file_object:
+        The 'tuf.util.TempFile' returned by _download_metadata().
+
+      metadata_signable:
+        The verified signable object returned by _download_metadata().
+
+      mirror_url:
+        The url 'metadata_file_object' was downloaded from.
+
+      compression:
+        A string designating the compression type 'metadata_file_object' was
+        downloaded in, or None.  The metadata is stored decompressed.
+
+    <Exceptions>
+      tuf.RepositoryError:
+        The metadata is improperly formatted, or older than the currently
+        trusted metadata.
+
+    <Side Effects>
+      The metadata files and stores for 'metadata_role' are updated.
+
+    <Returns>
+      None.
+
+    """
+
+    # The metadata is stored decompressed, under its uncompressed name.
+    metadata_filename = metadata_role + '.txt'
+    downloaded_filename = metadata_filename
+    if compression is not None:
+      downloaded_filename = \
+        tuf.util.get_compressed_filename(metadata_filename, compression)
+
+    # Ensure the loaded 'metadata_signable' is properly formatted.
+    try:
+      tuf.formats.check_signable_object_format(metadata_signable)
+    except tuf.FormatError, e:
+      message = 'Unable to load '+repr(downloaded_filename)+' after update: '+\
+                str(e)
+      raise tuf.RepositoryError(message)
+
+    # Is 'metadata_signable' newer than the currently installed
+    # version?
+    current_metadata_role = self.metadata['current'].get(metadata_role)
+    
+    # Compare metadata version numbers.  Ensure there is a current
+    # version of the metadata role to be updated.
+    if current_metadata_role is not None:
+      current_version = current_metadata_role['version'] 
+      downloaded_version = metadata_signable['signed']['version']
+      if downloaded_version < current_version:
+        message = repr(mirror_url)+' is older than the version currently '+\
+          'installed.\nDownloaded version: '+repr(downloaded_version)+'\n'+\
+          'Current version: '+repr(current_version)
+        raise tuf.RepositoryError(message)
+      
+    # The metadata has been verified. Move the metadata file into place.
+    # First, move the 'current' metadata file to the 'previous' directory
+    # if it exists.
+    current_filepath = os.path.join(self.metadata_directory['current'],
+                                    metadata_filename)
+    current_filepath = os.path.abspath(current_filepath)
+    tuf.util.ensure_parent_dir(current_filepath)
+    
+    previous_filepath = os.path.join(self.metadata_directory['previous'],
+                                     metadata_filename)
+    previous_filepath = os.path.abspath(previous_filepath)
+    if os.path.exists(current_filepath):
+      # Previous metadata might not exist, say when delegations are added.
+      tuf.util.ensure_parent_dir(previous_filepath)
+      shutil.move(current_filepath, previous_filepath)
+
+    # Next, move the verified updated metadata file to the 'current' directory.
+    # Note that the 'move' method comes from tuf.util's TempFile class.
+    # 'metadata_file_object' is an instance of tuf.util.TempFile.
     metadata_file_object.move(current_filepath)
     
     # Extract the metadata object so we can store it to the metadata store.
@@ -785,7 +1851,9 @@ class Updater(object):
       updated before the delegated role.  Taking into account that
       'referenced_metadata' is updated and verified before 'metadata_role',
       this function determines if 'metadata_role' has changed by checking
-      the 'meta' field of the newly updated 'referenced_metadata'.
+      the 'meta' field of the newly updated 'referenced_metadata'.  If a delta
+      from the current version of 'metadata_role' is listed there, it is
+      applied instead of downloading the whole file, when it is smaller.
 
     <Arguments>
       metadata_role:
@@ -822,6 +1890,64 @@ class Updater(object):
     
     """
         
+    # Determine whether 'metadata_role' has changed, and if so, the file
+    # information and compression of the version that should be downloaded.
+    update_details = self._get_metadata_update_details(metadata_role,
+                                                       referenced_metadata)
+    if update_details is None:
+      return
+    new_fileinfo, compression, compressed_fileinfo, delta = update_details
+
+    try:
+      self._update_metadata(metadata_role, fileinfo=new_fileinfo,
+                            compression=compression, delta=delta,
+                            compressed_fileinfo=compressed_fileinfo)
+    except tuf.RepositoryError, e:
+      self._abandon_metadata(metadata_role, e)
+    else:
+      self._reload_delegations(metadata_role)
+
+
+
+
+
+  def _get_metadata_update_details(self, metadata_role,
+                                   referenced_metadata='release'):
+    """
+    <Purpose>
+      Determine whether 'metadata_role' has changed according to the 'meta'
+      field of 'referenced_metadata'.  See _update_metadata_if_changed() for
+      a description of how referenced metadata is used.  If 'metadata_role'
+      has changed, also determine whether a compressed version of it, or a
+      delta from the current version, is available for download.
+
+    <Arguments>
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+      referenced_metadata:
+        This is the metadata that provides the role information for
+        'metadata_role'.
+
+    <Exceptions>
+      tuf.RepositoryError:
+        If the referenced metadata is missing.
+
+    <Side Effects>
+      The fileinfo of the current 'metadata_role' file may be calculated
+      and stored.
+
+    <Returns>
+      None if 'metadata_role' has not changed.  Otherwise, a
+      (new_fileinfo, compression, compressed_fileinfo, delta) tuple with the
+      trusted file information of the changed metadata, the compression type
+      (e.g., 'gzip', or None) that should be used to download it, the trusted
+      file information of the compressed file (or None), and the delta that
+      should be tried first, as returned by _get_metadata_delta().
+
+    """
+
     metadata_filename = metadata_role + '.txt'
 
     # Need to ensure the referenced metadata has been loaded.
@@ -843,7 +1969,7 @@ class Updater(object):
     # Simply return if the fileinfo has not changed according to the
     # fileinfo provided by the referenced metadata.
     if not self._fileinfo_has_changed(metadata_filename, new_fileinfo):
-      return
+      return None
 
     logger.info('Metadata '+repr(metadata_filename)+' has changed.')
 
@@ -855,46 +1981,184 @@ class Updater(object):
     # must begin with 'targets/'.  The Release role lists all the Targets
     # metadata available on the repository, including any that may be in
     # compressed form.
+    # Of the compressions supported by the client (see
+    # 'tuf.util.register_compression()'), the one listed with the smallest
+    # length is chosen, unless the uncompressed file is smaller still.
     compression = None
-    gzip_path = metadata_filename + '.gz'
-    if metadata_role == 'release':
-      if gzip_path in self.metadata['current'][referenced_metadata]['meta']:
-        compression = 'gzip'
-    # Check for available compressed versions of 'targets.txt' and delegated
-    # Targets, which also start with 'targets'.
-    elif metadata_role.startswith('targets'):
+    compressed_fileinfo = None
+    if metadata_role == 'release' or metadata_role.startswith('targets'):
       # For 'targets.txt' and delegated metadata, 'referenced_metata'
       # should always be 'release'.  'release.txt' specifies all roles
       # provided by a repository, including their file sizes and hashes.
-      if gzip_path in self.metadata['current'][referenced_metadata]['meta']:
-        compression = 'gzip'
+      meta = self.metadata['current'][referenced_metadata]['meta']
+      if new_fileinfo is not None:
+        smallest_length = new_fileinfo['length']
+      else:
+        smallest_length = None
+      for name in sorted(tuf.util.get_compressions()):
+        fileinfo = \
+          meta.get(tuf.util.get_compressed_filename(metadata_filename, name))
+        if fileinfo is None:
+          continue
+        if smallest_length is None or fileinfo['length'] < smallest_length:
+          compression = name
+          compressed_fileinfo = fileinfo
+          smallest_length = fileinfo['length']
     else:
       message = 'Compressed version of '+repr(metadata_filename)+' not available.'
       logger.debug(message)
 
-    try:
-      self._update_metadata(metadata_role, fileinfo=new_fileinfo,
-                            compression=compression)
-    except tuf.RepositoryError, e:
-      # The current metadata we have is not current but we couldn't
-      # get new metadata. We shouldn't use the old metadata anymore.
-      # This will get rid of in-memory knowledge of the role and
-      # delegated roles, but will leave delegated metadata files as
-      # current files on disk.
-      # TODO: Should we get rid of the delegated metadata files?
-      # We shouldn't need to, but we need to check the trust
-      # implications of the current implementation.
-      self._delete_metadata(metadata_role)
-      message = 'Metadata for '+repr(metadata_role)+' could not be updated: '
-      raise tuf.MetadataNotAvailableError(message+str(e))
+    delta = self._get_metadata_delta(metadata_role, new_fileinfo,
+                                     compressed_fileinfo, referenced_metadata)
+
+    return new_fileinfo, compression, compressed_fileinfo, delta
+
+
+
+
+
+  def _get_metadata_delta(self, metadata_role, new_fileinfo,
+                          compressed_fileinfo=None,
+                          referenced_metadata='release'):
+    """
+    <Purpose>
+      Determine whether the changed Targets metadata of 'metadata_role' may be
+      updated with a delta from its current version.  The repository may list
+      deltas from recent versions of a metadata file in the release metadata
+      (see 'tuf.repo.signerlib.build_metadata_deltas()'); the delta that
+      applies to the current file is identified by the current file's hash
+      (see 'tuf.delta.get_delta_filename()').  It is only used if it is
+      smaller than the file that would otherwise be downloaded.
+
+    <Arguments>
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'targets', 'targets/linux/x86'.
+
+      new_fileinfo:
+        The trusted file information of the changed metadata.
+
+      compressed_fileinfo:
+        The trusted file information of the compressed file that would
+        otherwise be downloaded, or None.
+
+      referenced_metadata:
+        The metadata that lists 'metadata_role', which lists its deltas too.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      None.
+
+    <Returns>
+      None, or a (delta_filename, delta_fileinfo) tuple.
+
+    """
+
+    if not metadata_role.startswith('targets') or new_fileinfo is None:
+      return None
+
+    metadata_filename = metadata_role + '.txt'
+    current_fileinfo = self.fileinfo.get(metadata_filename)
+    if current_fileinfo is None:
+      return None
+
+    delta_filename = tuf.delta.get_delta_filename(metadata_filename,
+                                                  current_fileinfo['hashes'])
+    meta = self.metadata['current'][referenced_metadata]['meta']
+    delta_fileinfo = meta.get(delta_filename)
+    if delta_fileinfo is None:
+      return None
+
+    if compressed_fileinfo is not None:
+      download_length = compressed_fileinfo['length']
     else:
-      # We need to remove delegated roles because the delegated roles
-      # may not be trusted anymore.
-      if metadata_role == 'targets' or metadata_role.startswith('targets/'):
-        logger.debug('Removing delegated roles of '+repr(metadata_role)+'.')
-        # TODO: Should we also remove the keys of the delegated roles?
-        tuf.roledb.remove_delegated_roles(metadata_role)
-        self._import_delegations(metadata_role)
+      download_length = new_fileinfo['length']
+    if delta_fileinfo['length'] >= download_length:
+      return None
+
+    logger.debug('Delta '+repr(delta_filename)+' available.')
+    return delta_filename, delta_fileinfo
+
+
+
+
+
+  def _abandon_metadata(self, metadata_role, error):
+    """
+    <Purpose>
+      Handle the failed update of 'metadata_role'.  The current metadata we
+      have is not current but we couldn't get new metadata, so we shouldn't
+      use the old metadata anymore.
+
+    <Arguments>
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+      error:
+        The 'tuf.RepositoryError' that caused the update to fail.
+
+    <Exceptions>
+      tuf.MetadataNotAvailableError:
+        Always raised, after the metadata has been deleted.
+
+    <Side Effects>
+      The metadata for 'metadata_role' is deleted.
+
+    <Returns>
+      None.
+
+    """
+
+    # This will get rid of in-memory knowledge of the role and
+    # delegated roles, but will leave delegated metadata files as
+    # current files on disk.
+    # TODO: Should we get rid of the delegated metadata files?
+    # We shouldn't need to, but we need to check the trust
+    # implications of the current implementation.
+    self._delete_metadata(metadata_role)
+    message = 'Metadata for '+repr(metadata_role)+' could not be updated: '
+    raise tuf.MetadataNotAvailableError(message+str(error))
+
+
+
+
+
+  def _reload_delegations(self, metadata_role):
+    """
+    <Purpose>
+      Replace the delegated roles of 'metadata_role' with those listed by its
+      newly updated metadata.  Only Targets metadata has delegations.
+
+    <Arguments>
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+    <Exceptions>
+      tuf.FormatError:
+        If the delegated roles of 'metadata_role' are improperly formatted.
+
+      tuf.Error:
+        If a delegated role or key cannot be loaded.
+
+    <Side Effects>
+      The role and key databases are modified.
+
+    <Returns>
+      None.
+
+    """
+
+    # We need to remove delegated roles because the delegated roles
+    # may not be trusted anymore.
+    if metadata_role == 'targets' or metadata_role.startswith('targets/'):
+      logger.debug('Removing delegated roles of '+repr(metadata_role)+'.')
+      # TODO: Should we also remove the keys of the delegated roles?
+      tuf.roledb.remove_delegated_roles(metadata_role)
+      self._import_delegations(metadata_role)
 
 
 
@@ -907,15 +2171,7 @@ class Updater(object):
       determined by inspecting the 'delegations' field of the parent role
       of 'metadata_role'.  If a target specified by 'metadata_object'
       is not found in the parent role's delegations field, raise an exception.
-   
-      Targets allowed are either exlicitly listed under the 'paths' field, or
-      implicitly exist under a subdirectory of a parent directory listed
-      under 'paths'.  A parent role may delegate trust to all files under a 
-      particular directory, including files in subdirectories, by simply
-      listing the directory (e.g., 'packages/source/Django/', the equivalent
-      of 'packages/source/Django/*').  Targets listed in hashed bins are
-      also validated (i.e., its calculated path hash prefix must be delegated
-      by the parent role.
+      Each target is checked by the function returned by _get_target_check().
 
     <Arguments>
       metadata_role:
@@ -942,6 +2198,52 @@ class Updater(object):
     
     """
 
+    target_check = self._get_target_check(metadata_role)
+    if target_check is not None:
+      for child_target in metadata_object['targets']:
+        target_check(child_target)
+
+
+
+
+
+  def _get_target_check(self, metadata_role):
+    """
+    <Purpose>
+      Return a function that checks whether a target listed by 'metadata_role'
+      is allowed by the 'delegations' field of the parent role of
+      'metadata_role'.  The function raises tuf.RepositoryError if it is not.
+      Downloaded metadata is checked one target at a time before its
+      signatures are verified (see _load_downloaded_metadata()), so that it
+      never has to be walked again.
+   
+      Targets allowed are either exlicitly listed under the 'paths' field, or
+      implicitly exist under a subdirectory of a parent directory listed
+      under 'paths'.  A parent role may delegate trust to all files under a 
+      particular directory, including files in subdirectories, by simply
+      listing the directory (e.g., 'packages/source/Django/', the equivalent
+      of 'packages/source/Django/*').  Targets listed in hashed bins are
+      also validated (i.e., its calculated path hash prefix must be delegated
+      by the parent role.
+
+    <Arguments>
+      metadata_role:
+        The name of the metadata. This is a role name and should not end
+        in '.txt'.  Examples: 'root', 'targets', 'targets/linux/x86'.
+
+    <Exceptions>
+      tuf.RepositoryError:
+        If the parent role of 'metadata_role' has not delegated to it.
+    
+    <Side Effects>
+      The delegation matcher of the parent role may be compiled.
+
+    <Returns>
+      A function that takes a target path, or None if the targets of
+      'metadata_role' need not be checked.
+    
+    """
+
     # The algorithm used by the repository to generate the hashes of the
     # target filepaths.  The repository may optionally organize
     # targets into hashed bins to ease target delegations and role metadata
@@ -949,84 +2251,87 @@ class Updater(object):
     # distribution of targets into bins. 
     HASH_PATH_ALGORITHM = 'sha256'
     
-    # Return if 'metadata_role' is 'targets'.  'targets' is not
-    # a delegated role.
-    if metadata_role == 'targets':
-      return
+    # Return if 'metadata_role' is a top-level role, such as 'targets'.
+    # Only delegated roles have their targets checked.
+    if '/' not in metadata_role:
+      return None
     
     # The targets of delegated roles are stored in the parent's
     # metadata file.  Retrieve the parent role of 'metadata_role'
     # to confirm 'metadata_role' contains valid targets.
     parent_role = tuf.roledb.get_parent_rolename(metadata_role)
 
-    # Iterate over the targets of 'metadata_role' and confirm they are trusted,
-    # or their root parent directory exists in the role delegated paths of the
-    # parent role.
+    # Confirm each target of 'metadata_role' is trusted, or its root parent
+    # directory exists in the role delegated paths of the parent role.
     roles = self.metadata['current'][parent_role]['delegations']['roles']
     role_index = tuf.repo.signerlib.find_delegated_role(roles, metadata_role)
 
+    # Raise an exception if the parent has not delegated to the specified
+    # 'metadata_role' child role.
+    if role_index is None:
+      message = repr(parent_role)+' has not delegated to '+\
+        repr(metadata_role)+'.'
+      raise tuf.RepositoryError(message)
+
     # Ensure the delegated role exists prior to extracting trusted paths
     # from the parent's 'paths', or trusted path hash prefixes from the parent's
     # 'path_hash_prefix'.
-    if role_index is not None:
-      role = roles[role_index] 
-      allowed_child_paths = role.get('paths')
-      allowed_child_path_hash_prefix = role.get('path_hash_prefix') 
-      actual_child_targets = metadata_object['targets'].keys()
+    role = roles[role_index] 
+    allowed_child_paths = role.get('paths')
+    allowed_child_path_hash_prefix = role.get('path_hash_prefix') 
     
-      if allowed_child_path_hash_prefix is not None:
-        for child_target in actual_child_targets:
-          # Calculate the hash of 'child_target' to determine if it has been
-          # placed in the correct bin.  The client currently assumes the
-          # repository uses 'HASH_PATH_ALGORITHM' to generate hashes.
-          # TODO: Should the TUF spec restrict the repository to one particular
-          # algorithm?  Should we allow the repository to specify in the role
-          # dictionary the algorithm used for these generated hashed paths?
-          digest_object = tuf.hash.digest(HASH_PATH_ALGORITHM)
-          digest_object.update(child_target)
-          child_target_path_hash = digest_object.hexdigest()
-
-          if not child_target_path_hash.startswith(allowed_child_path_hash_prefix):
-            message = 'Role '+repr(metadata_role)+' specifies target '+\
-              repr(child_target)+ ' which does not have a path hash prefix '+\
-              'matching the prefix listed by the parent role '+\
-              repr(parent_role)+'.'
-            raise tuf.RepositoryError(message)
-      elif allowed_child_paths is not None: 
-
-        # Check that each delegated target is either explicitly listed or a parent
-        # directory is found under role['paths'], otherwise raise an exception.
-        # If the parent role explicitly lists target file paths in 'paths',
-        # this loop will run in O(n^2), the worst-case.  The repository
-        # maintainer will likely delegate entire directories, and opt for
-        # explicit file paths if the targets in a directory are delegated to 
-        # different roles/developers.
-        for child_target in actual_child_targets:
-          for allowed_child_path in allowed_child_paths:
-            prefix = os.path.commonprefix([child_target, allowed_child_path])
-            if prefix == allowed_child_path:
-              break
-          else: 
-            message = 'Role '+repr(metadata_role)+' specifies target '+\
-              repr(child_target)+' which is not an allowed path according '+\
-              'to the delegations set by '+repr(parent_role)+'.'
-            raise tuf.RepositoryError(message)
-      else:
-        
-        # 'role' should have been validated when it was downloaded.
-        # The 'paths' or 'path_hash_prefix' fields should not be missing,
-        # so log a warning if this else clause is reached. 
-        message = repr(role)+' unexpectedly did not contain one of '+\
-          'the required fields ("paths" or "path_hash_prefix").'
-        logger.warn(message)
+    if allowed_child_path_hash_prefix is not None:
+      # Copying an empty digest object is cheaper than creating a new one
+      # for each of the (possibly many) targets.
+      empty_digest_object = tuf.hash.digest(HASH_PATH_ALGORITHM)
+
+      def target_check(child_target):
+        # Calculate the hash of 'child_target' to determine if it has been
+        # placed in the correct bin.  The client currently assumes the
+        # repository uses 'HASH_PATH_ALGORITHM' to generate hashes.
+        # TODO: Should the TUF spec restrict the repository to one particular
+        # algorithm?  Should we allow the repository to specify in the role
+        # dictionary the algorithm used for these generated hashed paths?
+        digest_object = empty_digest_object.copy()
+        digest_object.update(child_target)
+        child_target_path_hash = digest_object.hexdigest()
+
+        if not child_target_path_hash.startswith(allowed_child_path_hash_prefix):
+          message = 'Role '+repr(metadata_role)+' specifies target '+\
+            repr(child_target)+ ' which does not have a path hash prefix '+\
+            'matching the prefix listed by the parent role '+\
+            repr(parent_role)+'.'
+          raise tuf.RepositoryError(message)
+
+      return target_check
+
+    elif allowed_child_paths is not None: 
+
+      # Check that each delegated target is either explicitly listed or a parent
+      # directory is found under role['paths'], otherwise raise an exception.
+      # The parent's compiled delegation matcher checks a target against all
+      # of the allowed paths with one lookup per distinct path length.
+      delegation_matcher = self._get_delegation_matcher(parent_role)
+
+      def target_check(child_target):
+        if not delegation_matcher.allows_path(metadata_role, child_target):
+          message = 'Role '+repr(metadata_role)+' specifies target '+\
+            repr(child_target)+' which is not an allowed path according '+\
+            'to the delegations set by '+repr(parent_role)+'.'
+          raise tuf.RepositoryError(message)
+
+      return target_check
 
-    # Raise an exception if the parent has not delegated to the specified
-    # 'metadata_role' child role.
     else:
-      message = repr(parent_role)+' has not delegated to '+\
-        repr(metadata_role)+'.'
-      raise tuf.RepositoryError(message)
-          
+      
+      # 'role' should have been validated when it was downloaded.
+      # The 'paths' or 'path_hash_prefix' fields should not be missing,
+      # so log a warning if this else clause is reached. 
+      message = repr(role)+' unexpectedly did not contain one of '+\
+        'the required fields ("paths" or "path_hash_prefix").'
+      logger.warn(message)
+      return None
+
 
 
 
@@ -1375,7 +2680,10 @@ class Updater(object):
     # See if this role provides metadata and, if we're including
     # delegations, look for metadata from delegated roles.
     role_prefix = rolename + '/'
+    # Compressed metadata and deltas are also listed, and skipped.
     for metadata_path in self.metadata['current']['release']['meta'].keys():
+      if not metadata_path.endswith('.txt'):
+        continue
       if metadata_path == rolename + '.txt':
         roles_to_update.append(metadata_path[:-len('.txt')])
       elif include_delegations and metadata_path.startswith(role_prefix):
@@ -1398,19 +2706,187 @@ class Updater(object):
     roles_to_update.sort()
     logger.debug('Roles to update: '+repr(roles_to_update)+'.')
 
-    # Iterate through 'roles_to_update', load its metadata
-    # file, and update it if it has changed.
-    for rolename in roles_to_update:
-      self._load_metadata_from_file('previous', rolename)
-      self._load_metadata_from_file('current', rolename)
+    # Delegated metadata may be downloaded concurrently if the client has
+    # configured more than one worker.  Raise 'tuf.FormatError' if the
+    # configured number of workers is invalid.
+    max_workers = tuf.conf.delegated_metadata_workers
+    tuf.formats.WORKERS_SCHEMA.check_match(max_workers)
+    if max_workers > 1 and len(roles_to_update) > 1:
+      self._refresh_roles_concurrently(roles_to_update, max_workers)
+      return
+
+    # Iterate through 'roles_to_update', load its metadata
+    # file, and update it if it has changed.
+    for rolename in roles_to_update:
+      self._load_metadata_from_file('previous', rolename)
+      self._load_metadata_from_file('current', rolename)
+
+      self._update_metadata_if_changed(rolename)
+
+      # Remove the role if it has expired.
+      self._remove_role_if_expired(rolename)
+
+
+
+
+
+  def _refresh_roles_concurrently(self, roles_to_update, max_workers):
+    """
+    <Purpose>
+      Refresh the metadata of 'roles_to_update' like _refresh_targets_metadata(),
+      but download up to 'max_workers' metadata files at a time.
+
+      Trust is still established from the top down.  A role is only scheduled
+      once its parent role (if also in 'roles_to_update') has been updated,
+      verified, and its delegated roles and keys imported.  Only the download
+      and signature verification of a role is performed by the worker threads.
+      Loading, installing, and importing the delegations of metadata, which
+      modify the metadata store and the role and key databases, are all done
+      by the calling thread, one role at a time.
+
+    <Arguments>
+      roles_to_update:
+        The list of Targets role names to refresh, sorted so that parent roles
+        come first.
+
+      max_workers:
+        The maximum number of metadata files to download concurrently.
+
+    <Exceptions>
+      tuf.MetadataNotAvailableError:
+        If the metadata for a role has changed but could not be updated.
+        No further roles are scheduled once a role fails, and the exception
+        is raised after the downloads already in progress have completed.
+
+    <Side Effects>
+      The metadata for the delegated roles are loaded and updated if they
+      have changed.  Delegated metadata is removed from the role database if
+      it has expired.
+
+    <Returns>
+      None.
+
+    """
+
+    # Map each role to the roles it directly delegates to.  The roles whose
+    # parent is not being refreshed can be scheduled immediately.
+    children = {}
+    ready_roles = []
+    for rolename in roles_to_update:
+      parent_role = '/'.join(rolename.split('/')[:-1])
+      if parent_role in roles_to_update:
+        children.setdefault(parent_role, []).append(rolename)
+      else:
+        ready_roles.append(rolename)
+
+    # The worker threads report each finished download, or the exception
+    # raised while downloading, through 'completed_downloads'.
+    completed_downloads = Queue.Queue()
+
+    def download_metadata(rolename, fileinfo, compression,
+                          compressed_fileinfo, delta):
+      try:
+        downloaded, compression = \
+          self._download_metadata_update(rolename, fileinfo, compression,
+                                         compressed_fileinfo, delta)
+      except Exception:
+        completed_downloads.put((rolename, compression, None, sys.exc_info()))
+      else:
+        completed_downloads.put((rolename, compression, downloaded, None))
+
+    pool = multiprocessing.pool.ThreadPool(max_workers)
+    downloads_in_progress = 0
+    error = None
+
+    try:
+      while ready_roles or downloads_in_progress:
+        # Schedule every role whose parent has been refreshed.  Roles that
+        # have not changed are finished without a download.
+        while ready_roles and error is None:
+          rolename = ready_roles.pop(0)
+          try:
+            self._load_metadata_from_file('previous', rolename)
+            self._load_metadata_from_file('current', rolename)
+            update_details = self._get_metadata_update_details(rolename)
+          except Exception:
+            error = sys.exc_info()
+            break
+
+          if update_details is None:
+            self._remove_role_if_expired(rolename)
+            ready_roles.extend(children.get(rolename, []))
+          else:
+            pool.apply_async(download_metadata, (rolename,) + update_details)
+            downloads_in_progress = downloads_in_progress + 1
+
+        if not downloads_in_progress:
+          break
+
+        # Install the next downloaded role and schedule its delegated roles.
+        rolename, compression, downloaded, download_error = \
+          completed_downloads.get()
+        downloads_in_progress = downloads_in_progress - 1
+
+        # A role has already failed.  Discard the remaining downloads.
+        if error is not None:
+          if downloaded is not None:
+            downloaded[0].close_temp_file()
+          continue
+
+        try:
+          try:
+            if download_error is not None:
+              raise download_error[0], download_error[1], download_error[2]
+            metadata_file_object, metadata_signable, mirror_url = downloaded
+            self._install_metadata(rolename, metadata_file_object,
+                                   metadata_signable, mirror_url, compression)
+          except tuf.RepositoryError, e:
+            self._abandon_metadata(rolename, e)
+          else:
+            self._reload_delegations(rolename)
+            self._remove_role_if_expired(rolename)
+        except Exception:
+          error = sys.exc_info()
+          continue
+
+        ready_roles.extend(children.get(rolename, []))
+    finally:
+      pool.close()
+      pool.join()
+
+    if error is not None:
+      raise error[0], error[1], error[2]
+
+
+
+
+
+  def _remove_role_if_expired(self, rolename):
+    """
+    <Purpose>
+      Remove 'rolename' from the role database if its current metadata has
+      expired.
+
+    <Arguments>
+      rolename:
+        This is a delegated role name and should not end
+        in '.txt'.  Example: 'targets/linux/x86'.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      The role database may be modified.
 
-      self._update_metadata_if_changed(rolename)
+    <Returns>
+      None.
 
-      # Remove the role if it has expired.
-      try:
-        self._ensure_not_expired(rolename)
-      except tuf.ExpiredMetadataError:
-        tuf.roledb.remove_role(rolename)
+    """
+
+    try:
+      self._ensure_not_expired(rolename)
+    except tuf.ExpiredMetadataError:
+      tuf.roledb.remove_role(rolename)
 
 
 
@@ -1472,8 +2948,10 @@ class Updater(object):
       logger.debug(message)
       return targets
 
-    # Get the targets specified by the role itself.
-    for filepath, fileinfo in self.metadata['current'][rolename]['targets'].items():
+    # Get the targets specified by the role itself.  The fileinfo of each
+    # target is built from its compact form as it is listed.
+    for filepath, fileinfo in \
+      self.metadata['current'][rolename]['targets'].iteritems():
       new_target = {} 
       new_target['filepath'] = filepath 
       new_target['fileinfo'] = fileinfo
@@ -1625,58 +3103,33 @@ class Updater(object):
         delegations = role_metadata.get('delegations', {})
         child_roles = delegations.get('roles', [])
 
-        # Does the current role name have our target?
+        # Does the current role name have our target?  The role's 'targets'
+        # dictionary is keyed by filepath, so it serves as the role's lookup
+        # index.  It is replaced whenever the role's metadata is updated.
         logger.info('Asking role '+role_name+' about target '+target_filepath)
-        for filepath, fileinfo in targets.iteritems():
-          if filepath == target_filepath:
-            logger.info('Found target '+target_filepath+' in role '+role_name)
-            target = {'filepath': filepath, 'fileinfo': fileinfo}
-            break
-
-        # Push children in reverse order of appearance onto the stack.
-        # NOTE: This may be a slow operation if there are many delegated roles
-        # or bins.
-        for child_role in reversed(child_roles):
-          child_role_name = child_role['name']
-          child_role_paths = child_role.get('paths')
-          child_role_path_hash_prefix = child_role.get('path_hash_prefix')
-
-          if child_role_path_hash_prefix is not None:
-            if target_file_path_hash.startswith(child_role_path_hash_prefix):
-              
-              # Found a matching path hash prefix.  The metadata for
-              # 'child_role_name' will be retrieved on the next iteration
-              # of the while-loop.
-              role_names.append(child_role_name)
-          elif child_role_paths is not None:
-            
-            # Ensure that we explore only delegated roles trusted with the target.
-            # We assume conservation of delegated paths in the complete tree of
-            # delegations. Note that the call to _ensure_all_targets_allowed in
-            # _update_metadata should already ensure that all targets metadata is
-            # valid; i.e. that the targets signed by a delegatee is a proper
-            # subset of the targets delegated to it by the delegator.
-            # Nevertheless, we check it again here for performance and safety
-            # reasons.
-            for child_role_path in child_role_paths:
-              
-              # A child role path may be a filepath or directory.  The child
-              # role 'child_role_name' is added if 'target_filepath' is located
-              # under 'child_role_path'.  Explicit filepaths are also added.
-              prefix = os.path.commonprefix([target_filepath, child_role_path])
-              if prefix == child_role_path:
-                
-                # The metadata for 'child_role_name' will be retrieved on the next
-                # iteration of the while-loop.
-                role_names.append(child_role_name)
-          else:
-            
-            # 'role_name' should have been validated when it was downloaded.
-            # The 'paths' or 'path_hash_prefix' fields should not be missing,
-            # so log a warning if this else clause is reached. 
-            message = repr(child_role)+' unexpectedly did not contain one of '+\
-              'the required fields ("paths" or "path_hash_prefix").'
-            logger.warn(message)
+        fileinfo = targets.get(target_filepath)
+        if fileinfo is not None:
+          logger.info('Found target '+target_filepath+' in role '+role_name)
+          target = {'filepath': target_filepath, 'fileinfo': fileinfo}
+
+        # Push the child roles trusted with the target onto the stack, in
+        # reverse order of appearance.  The compiled delegation matcher of
+        # 'role_name' finds them without comparing the target against each
+        # delegated path and path hash prefix in turn.  We assume conservation
+        # of delegated paths in the complete tree of delegations. Note that the
+        # target check in _download_metadata should already ensure that all
+        # targets metadata is valid; i.e. that the
+        # targets signed by a delegatee is a proper subset of the targets
+        # delegated to it by the delegator.  Nevertheless, we check it again
+        # here for performance and safety reasons.
+        if child_roles:
+          delegation_matcher = self._get_delegation_matcher(role_name)
+          child_role_names = \
+            delegation_matcher.get_delegated_roles(target_filepath,
+                                                   target_file_path_hash)
+          # The metadata for the child roles will be retrieved on the next
+          # iterations of the while-loop.
+          role_names.extend(reversed(child_role_names))
     except:
       raise
     finally:
@@ -1693,6 +3146,45 @@ class Updater(object):
 
 
 
+  def _get_delegation_matcher(self, rolename):
+    """
+    <Purpose>
+      Return the compiled '_DelegationMatcher' for the delegations of
+      'rolename'.  A matcher is compiled the first time it is needed after
+      the metadata of 'rolename' is loaded or updated.  Installing new
+      metadata replaces the delegated roles list, which invalidates the
+      cached matcher.
+
+    <Arguments>
+      rolename:
+        The name of a targets role whose metadata is currently trusted.
+
+    <Exceptions>
+      KeyError, if there is no current metadata for 'rolename'.
+
+    <Side Effects>
+      The compiled matcher is cached in 'self._delegation_matchers'.
+
+    <Returns>
+      A '_DelegationMatcher' object.
+
+    """
+
+    delegations = self.metadata['current'][rolename].get('delegations', {})
+    child_roles = delegations.get('roles', [])
+
+    delegation_matcher = self._delegation_matchers.get(rolename)
+    if delegation_matcher is None or \
+       delegation_matcher.child_roles is not child_roles:
+      delegation_matcher = _DelegationMatcher(child_roles)
+      self._delegation_matchers[rolename] = delegation_matcher
+
+    return delegation_matcher
+
+
+
+
+
   def remove_obsolete_targets(self, destination_directory):
     """
     <Purpose>
@@ -1729,8 +3221,9 @@ class Updater(object):
     for role in tuf.roledb.get_rolenames():
       if role.startswith('targets'):
         if role in self.metadata['previous'] and self.metadata['previous'][role] != None:
-          for target in self.metadata['previous'][role]['targets'].keys():
-            if target not in self.metadata['current'][role]['targets'].keys():
+          current_targets = self.metadata['current'][role]['targets']
+          for target in self.metadata['previous'][role]['targets']:
+            if target not in current_targets:
               # 'target' is only in 'previous', so remove it.
               logger.warn('Removing obsolete file: '+repr(target)+'.')
               # Remove the file if it hasn't been removed already.
@@ -1757,6 +3250,11 @@ class Updater(object):
       considered changed if they do not exist at 'destination_directory'
       or the target located there has mismatched file properties.
 
+      If 'tuf.conf.target_index' is set, a local target whose size,
+      modification time and inode are those recorded in the target index is
+      not read again; the hashes recorded for it are used instead (see
+      'tuf.conf.target_index_rehash_interval').
+
       The returned information is a list conformant to
       'tuf.formats.TARGETFILES_SCHEMA' and has the form:
       [{'filepath': 'a/b/c.txt',
@@ -1766,20 +3264,450 @@ class Updater(object):
 
     <Arguments>
       targets:
-        A list of target files.
+        A list of target files.
+
+      destination_directory:
+        The directory containing the target files.
+
+    <Exceptions>
+      tuf.FormatError:
+        If the arguments are improperly formatted.
+
+    <Side Effects>
+      The files in 'targets' are read and their hashes computed.  The target
+      index is updated and saved.
+
+    <Returns>
+      A list of targets, conformant to 'tuf.formats.TARGETFILES_SCHEMA'.
+
+    """
+
+    # Do the arguments have the correct format?
+    # Raise 'tuf.FormatError' if there is a mismatch.
+    tuf.formats.TARGETFILES_SCHEMA.check_match(targets)
+    tuf.formats.PATH_SCHEMA.check_match(destination_directory)
+
+    updated_targets = []
+
+    try:
+      # Get the targets' filepaths located in 'destination_directory'.
+      # We will compare targets against these files, which are hashed
+      # concurrently.
+      jobs = []
+      for target in targets:
+        target_filepath = os.path.join(destination_directory,
+                                       target['filepath'])
+        jobs.append((target_filepath, target['fileinfo']['hashes'].keys()))
+      local_hashes_list = self._get_local_targets_hashes(jobs)
+
+      for target, local_hashes in zip(targets, local_hashes_list):
+        # The target does not exist locally.
+        if local_hashes is None:
+          updated_targets.append(target)
+          continue
+
+        # The file does exist locally, check if its hash differs. 
+        for algorithm, digest in target['fileinfo']['hashes'].items():
+          if local_hashes[algorithm] != digest:
+            updated_targets.append(target)
+            break
+
+    finally:
+      if tuf.conf.target_index:
+        self._save_target_index()
+    
+    return updated_targets
+
+
+
+
+
+  def _get_local_targets_hashes(self, jobs):
+    """
+    <Purpose>
+      Return the hashes of local target files, computed by
+      'tuf.hash.digest_filenames()', which hashes the files concurrently and
+      reads each file once, for all of its algorithms.
+
+      If 'tuf.conf.target_index' is set, the hashes recorded in the target
+      index for a file are returned instead, if the file's size, modification
+      time and inode are those recorded, the hashes were recorded for all of
+      the requested algorithms and they were not recorded more than
+      'tuf.conf.target_index_rehash_interval' seconds ago.  Otherwise, the
+      computed hashes are recorded.
+
+    <Arguments>
+      jobs:
+        A list of (target_filepath, algorithms) tuples, where
+        'target_filepath' is the path of a local target file and 'algorithms'
+        a list of hash algorithm names (e.g., 'sha256').
+
+    <Exceptions>
+      tuf.UnsupportedAlgorithmError, if an algorithm is not supported.
+
+    <Side Effects>
+      The files are read, unless their hashes are found in the target index.
+      The target index entries of the files are updated.
+
+    <Returns>
+      A list with an item for each job, in order: a dictionary with the
+      algorithms as keys and the hexdigests as values, or None if the file
+      does not exist or cannot be read.
+
+    """
+
+    if not tuf.conf.target_index:
+      return tuf.hash.digest_filenames(jobs)
+
+    local_hashes_list = [None] * len(jobs)
+    file_stats = {}
+    jobs_to_hash = []
+    indices_to_hash = []
+    rehash_interval = tuf.conf.target_index_rehash_interval
+
+    # The files are stat'ed, and then hashed, after this time.
+    verified = time.time()
+
+    self._target_index_lock.acquire()
+    try:
+      target_index = self._get_target_index()
+      for index, (target_filepath, algorithms) in enumerate(jobs):
+        target_filepath = os.path.abspath(target_filepath)
+        try:
+          file_stat = os.stat(target_filepath)
+        except OSError:
+          # The file is gone, and so is its entry.
+          target_index.pop(target_filepath, None)
+          continue
+
+        entry = target_index.get(target_filepath)
+        if entry is not None and \
+           entry['length'] == file_stat.st_size and \
+           entry['mtime'] == file_stat.st_mtime and \
+           entry['inode'] == [file_stat.st_dev, file_stat.st_ino] and \
+           set(algorithms).issubset(entry['hashes']) and \
+           (rehash_interval is None or \
+            time.time() - entry['verified'] < rehash_interval):
+          local_hashes_list[index] = entry['hashes']
+          continue
+
+        file_stats[index] = file_stat
+        jobs_to_hash.append((target_filepath, algorithms))
+        indices_to_hash.append(index)
+    finally:
+      self._target_index_lock.release()
+
+    hashes_list = tuf.hash.digest_filenames(jobs_to_hash)
+
+    for index, (target_filepath, algorithms), local_hashes in \
+        zip(indices_to_hash, jobs_to_hash, hashes_list):
+      local_hashes_list[index] = local_hashes
+      if local_hashes is None:
+        continue
+
+      # The file may have changed while it was read, in which case the
+      # computed hashes must not be recorded against its new stat.
+      file_stat = file_stats[index]
+      try:
+        new_file_stat = os.stat(target_filepath)
+      except OSError:
+        continue
+      if new_file_stat.st_size == file_stat.st_size and \
+         new_file_stat.st_mtime == file_stat.st_mtime and \
+         new_file_stat.st_ino == file_stat.st_ino:
+        self._record_target_index_entry(target_filepath, file_stat,
+                                        local_hashes, verified)
+
+    return local_hashes_list
+
+
+
+
+
+  def _get_target_index_filepath(self):
+    """Return the path of the target index, 'metadata/target_index' under
+    the repository directory."""
+
+    metadata_directory = os.path.dirname(self.metadata_directory['current'])
+    return os.path.join(metadata_directory, 'target_index')
+
+
+
+
+
+  def _get_target_index(self):
+    """
+    <Purpose>
+      Return the target index, loading it from the target index file the
+      first time it is needed.  The index maps the absolute path of each
+      recorded target file to a dictionary holding its 'length', 'mtime',
+      'inode' (the device and inode numbers) and verified 'hashes', and the
+      time at which they were 'verified'.  The index file is JSON.  A
+      missing, unreadable or outdated index file, or one in another format
+      version, yields an empty index.
+
+      The caller must hold 'self._target_index_lock'.
+
+    <Arguments>
+      None.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      The target index file may be read.
+
+    <Returns>
+      The target index dictionary.
+
+    """
+
+    if self._target_index is not None:
+      return self._target_index
+
+    self._target_index = {}
+    index_filepath = self._get_target_index_filepath()
+    if not os.path.exists(index_filepath):
+      return self._target_index
+
+    try:
+      index_file = open(index_filepath, 'rb')
+      try:
+        json = tuf.util.import_json()
+        index_contents = json.load(index_file)
+      finally:
+        index_file.close()
+    except (IOError, ValueError), e:
+      logger.warn('Could not load target index '+repr(index_filepath)+\
+                  ': '+str(e))
+      return self._target_index
+
+    if not isinstance(index_contents, dict) or \
+       index_contents.get('version') != _TARGET_INDEX_VERSION or \
+       not isinstance(index_contents.get('targets'), dict):
+      logger.info('Ignoring outdated target index '+repr(index_filepath)+'.')
+      return self._target_index
+
+    self._target_index = index_contents['targets']
+    return self._target_index
+
+
+
+
+
+  def _record_target_index_entry(self, target_filepath, file_stat,
+                                 target_hashes, verified):
+    """
+    <Purpose>
+      Record in the target index that the local file 'target_filepath', with
+      the stat 'file_stat', has the verified hashes 'target_hashes'.
+
+      A file modified less than '_MTIME_RESOLUTION' seconds before 'verified'
+      is not recorded: it may have been modified again after it was verified,
+      within the same mtime, and the index could not tell (the "racy git"
+      problem).  It is hashed again the next time it is needed.
+
+    <Arguments>
+      target_filepath:
+        The absolute path of the local target file.
+
+      file_stat:
+        The result of 'os.stat()' for the file.
+
+      target_hashes:
+        A dictionary, with hash algorithm names as keys and the hexdigests as
+        values.
+
+      verified:
+        The time, taken before 'file_stat', since which the file is known to
+        have the hashes 'target_hashes'.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      The target index is updated.  It is not saved.
+
+    <Returns>
+      None.
+
+    """
+
+    entry = {'length': file_stat.st_size,
+             'mtime': file_stat.st_mtime,
+             'inode': [file_stat.st_dev, file_stat.st_ino],
+             'hashes': dict(target_hashes),
+             'verified': verified}
+
+    self._target_index_lock.acquire()
+    try:
+      target_index = self._get_target_index()
+      if verified - file_stat.st_mtime < _MTIME_RESOLUTION:
+        target_index.pop(target_filepath, None)
+      else:
+        target_index[target_filepath] = entry
+    finally:
+      self._target_index_lock.release()
+
+
+
+
+
+  def _save_target_index(self):
+    """
+    <Purpose>
+      Save the target index, if it has been loaded, to the target index file
+      in JSON, along with its format version.  The index is written to a temporary file and renamed into place, so a
+      partially written index is never loaded.  Failures are logged and
+      otherwise ignored.
+
+    <Arguments>
+      None.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      The target index file is written.
+
+    <Returns>
+      None.
+
+    """
+
+    index_filepath = self._get_target_index_filepath()
+    temporary_filepath = index_filepath + '.tmp'
+
+    self._target_index_lock.acquire()
+    try:
+      if self._target_index is None:
+        return
+      index_contents = {'version': _TARGET_INDEX_VERSION,
+                        'targets': self._target_index}
+      try:
+        index_file = open(temporary_filepath, 'wb')
+        try:
+          json = tuf.util.import_json()
+          json.dump(index_contents, index_file, separators=(',', ':'))
+        finally:
+          index_file.close()
+        os.rename(temporary_filepath, index_filepath)
+      except (IOError, OSError, ValueError), e:
+        logger.warn('Could not save target index '+repr(index_filepath)+\
+                    ': '+str(e))
+    finally:
+      self._target_index_lock.release()
+
+
+
+
+
+  def download_target(self, target, destination_directory):
+    """
+    <Purpose>
+      Download 'target' and verify it is trusted.
+        
+      This will only store the file at 'destination_directory' if the downloaded
+      file matches the description of the file in the trusted metadata.
+    
+    <Arguments>
+      target:
+        The target to be downloaded.  Conformant to
+        'tuf.formats.TARGETFILE_SCHEMA'.
+
+      destination_directory:
+        The directory to save the downloaded target file.
+
+    <Exceptions>
+      tuf.FormatError:
+        If 'target' is not properly formatted.
+
+      tuf.DownloadError:
+        If a target could not be downloaded from any of the mirrors.
+
+    <Side Effects>
+      A target file is saved to the local system.
+
+    <Returns>
+      None.
+
+    """
+
+    # Do the arguments have the correct format? 
+    # This check ensures the arguments have the appropriate 
+    # number of objects and object types, and that all dict
+    # keys are properly named.
+    # Raise 'tuf.FormatError' if the check fail.
+    tuf.formats.TARGETFILE_SCHEMA.check_match(target)
+    tuf.formats.PATH_SCHEMA.check_match(destination_directory)
+
+    # Raise 'tuf.DownloadError' if the target could not be downloaded from
+    # any of the mirrors.
+    spool_directory = self._get_spool_directory(destination_directory)
+    try:
+      target_file_object = \
+        self._download_target_file(target, spool_directory=spool_directory)
+    finally:
+      tuf.mirrors.save_mirror_statistics()
+   
+    # We acquired a target file object from a mirror.  Move the file into
+    # place (i.e., locally to 'destination_directory').
+    try:
+      self._move_target_into_place(target_file_object, target,
+                                   destination_directory)
+    finally:
+      if tuf.conf.target_index:
+        self._save_target_index()
+
+
+
+
+
+  def download_targets(self, targets, destination_directory, max_workers=4,
+                       per_mirror_limit=None):
+    """
+    <Purpose>
+      Download and verify the targets in 'targets' concurrently.  Up to
+      'max_workers' targets are downloaded at a time.  Like download_target(),
+      each target is downloaded from one mirror after the other until a copy
+      matching its trusted length and hashes is obtained, independently of the
+      other targets.  A target is only stored at 'destination_directory' if it
+      was successfully verified.  The failure to download one target does not
+      prevent the others from being downloaded.
+
+      A target listed more than once in 'targets' (e.g., by the 'targets' role
+      and by a delegated role) is downloaded only once, using its first entry.
+
+    <Arguments>
+      targets:
+        The targets to be downloaded.  Conformant to
+        'tuf.formats.TARGETFILES_SCHEMA'.
 
       destination_directory:
-        The directory containing the target files.
+        The directory to save the downloaded target files.
+
+      max_workers:
+        The maximum number of targets downloaded concurrently.
+
+      per_mirror_limit:
+        The maximum number of concurrent downloads from a single mirror host
+        (i.e., the scheme, host name and port of a mirror url).  If None,
+        only 'max_workers' limits the number of concurrent downloads.
 
     <Exceptions>
       tuf.FormatError:
-        If the arguments are improperly formatted.
+        If any of the arguments are improperly formatted.
 
     <Side Effects>
-      The files in 'targets' are read and their hashes computed. 
+      Target files are saved to the local system.
 
     <Returns>
-      A list of targets, conformant to 'tuf.formats.TARGETFILES_SCHEMA'.
+      A dictionary reporting the result of each target download:
+      {'downloaded': ['a/b/c.txt', ...],
+       'failed': {'d/e.txt': tuf.DownloadError(...), ...}}
+      The 'downloaded' list holds the filepaths of the targets saved to
+      'destination_directory', and 'failed' maps the filepath of every other
+      target to the exception raised while downloading or saving it.
 
     """
 
@@ -1787,75 +3715,134 @@ class Updater(object):
     # Raise 'tuf.FormatError' if there is a mismatch.
     tuf.formats.TARGETFILES_SCHEMA.check_match(targets)
     tuf.formats.PATH_SCHEMA.check_match(destination_directory)
+    tuf.formats.WORKERS_SCHEMA.check_match(max_workers)
+    if per_mirror_limit is not None:
+      tuf.formats.WORKERS_SCHEMA.check_match(per_mirror_limit)
 
-    updated_targets = []
-
+    # Download each target once, even if it is listed by several roles.
+    unique_targets = []
+    target_filepaths = set()
     for target in targets:
-      # Get the target's filepath located in 'destination_directory'.
-      # We will compare targets against this file.
-      target_filepath = os.path.join(destination_directory, target['filepath'])
-      
-      # Try one of the algorithm/digest combos for a mismatch.  We break
-      # as soon as we find a mismatch.
-      for algorithm, digest in target['fileinfo']['hashes'].items():
-        digest_object = None
-        try:
-          digest_object = tuf.hash.digest_filename(target_filepath,
-                                                   algorithm=algorithm)
-        # This exception would occur if the target does not exist locally. 
-        except IOError:
-          updated_targets.append(target)
-          break
-        # The file does exist locally, check if its hash differs. 
-        if digest_object.hexdigest() != digest:
-          updated_targets.append(target)
-          break
-    
-    return updated_targets
+      if target['filepath'] not in target_filepaths:
+        target_filepaths.add(target['filepath'])
+        unique_targets.append(target)
+
+    # Create a semaphore for every mirror host that may be contacted, so that
+    # the worker threads can share them without further locking.
+    mirror_semaphores = None
+    if per_mirror_limit is not None:
+      mirror_semaphores = {}
+      for target in unique_targets:
+        for mirror_url in tuf.mirrors.get_list_of_mirrors('target',
+                                                          target['filepath'],
+                                                          self.mirrors):
+          mirror_host = urlparse.urlparse(mirror_url)[:2]
+          if mirror_host not in mirror_semaphores:
+            mirror_semaphores[mirror_host] = \
+              threading.BoundedSemaphore(per_mirror_limit)
+
+    spool_directory = self._get_spool_directory(destination_directory)
+    downloaded_targets = []
+    failed_targets = {}
+
+    # Each worker records its own target's result.  'list.append()' and
+    # dict assignment are atomic, so no additional locking is needed.
+    def download(target):
+      target_filepath = target['filepath']
+      try:
+        target_file_object = self._download_target_file(target,
+                                                        mirror_semaphores,
+                                                        spool_directory)
+        self._move_target_into_place(target_file_object, target,
+                                     destination_directory)
+      except Exception, e:
+        logger.error('Unable to download target '+repr(target_filepath)+\
+                     ': '+str(e))
+        failed_targets[target_filepath] = e
+      else:
+        downloaded_targets.append(target_filepath)
+
+    if unique_targets:
+      pool = multiprocessing.pool.ThreadPool(min(max_workers,
+                                                 len(unique_targets)))
+      try:
+        pool.map(download, unique_targets)
+      finally:
+        pool.close()
+        pool.join()
+        tuf.mirrors.save_mirror_statistics()
+        if tuf.conf.target_index:
+          self._save_target_index()
 
+    return {'downloaded': downloaded_targets, 'failed': failed_targets}
 
 
 
 
-  def download_target(self, target, destination_directory):
+
+  def _get_spool_directory(self, destination_directory):
     """
     <Purpose>
-      Download 'target' and verify it is trusted.
-        
-      This will only store the file at 'destination_directory' if the downloaded
-      file matches the description of the file in the trusted metadata.
-    
+      Return the directory in which targets destined for
+      'destination_directory' are downloaded, or None if they are downloaded
+      in the temporary directory (see 'tuf.conf.spool_targets_in_destination').
+
+    <Arguments>
+      destination_directory:
+        The directory to save the downloaded target files.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      None.
+
+    <Returns>
+      A directory path, or None.
+
+    """
+
+    if tuf.conf.spool_targets_in_destination:
+      return destination_directory
+    return None
+
+
+
+
+
+  def _download_target_file(self, target, mirror_semaphores=None,
+                            spool_directory=None):
+    """
+    <Purpose>
+      Download 'target' from the first mirror that serves a copy matching its
+      trusted length and hashes.
+
     <Arguments>
       target:
         The target to be downloaded.  Conformant to
         'tuf.formats.TARGETFILE_SCHEMA'.
 
-      destination_directory:
-        The directory to save the downloaded target file.
+      mirror_semaphores:
+        An optional dictionary mapping the (scheme, host) of each mirror url
+        to a semaphore that must be held while downloading from it.
 
-    <Exceptions>
-      tuf.FormatError:
-        If 'target' is not properly formatted.
+      spool_directory:
+        An optional directory in which to store the downloaded data, so that
+        the verified target can be renamed into place (see
+        '_get_spool_directory()').
 
+    <Exceptions>
       tuf.DownloadError:
         If a target could not be downloaded from any of the mirrors.
 
     <Side Effects>
-      A target file is saved to the local system.
+      The target file is downloaded to a temporary file.
 
     <Returns>
-      None.
+      The 'tuf.util.TempFile' object holding the verified target file.
 
     """
 
-    # Do the arguments have the correct format? 
-    # This check ensures the arguments have the appropriate 
-    # number of objects and object types, and that all dict
-    # keys are properly named.
-    # Raise 'tuf.FormatError' if the check fail.
-    tuf.formats.TARGETFILE_SCHEMA.check_match(target)
-    tuf.formats.PATH_SCHEMA.check_match(destination_directory)
-   
     # Reference to the 'get_list_of_mirrors' function.
     get_mirrors = tuf.mirrors.get_list_of_mirrors
 
@@ -1871,21 +3858,70 @@ class Updater(object):
     # Iterate through the repositority mirrors until we successfully
     # download a target.
     for mirror_url in get_mirrors('target', target_filepath, self.mirrors):
+      semaphore = None
+      if mirror_semaphores is not None:
+        semaphore = mirror_semaphores.get(urlparse.urlparse(mirror_url)[:2])
+      if semaphore is not None:
+        semaphore.acquire()
       try: 
-        target_file_object = download_file(mirror_url, trusted_hashes,
-                                           trusted_length)
+        if spool_directory is None:
+          target_file_object = download_file(mirror_url, trusted_hashes,
+                                             trusted_length)
+        else:
+          target_file_object = \
+            download_file(mirror_url, trusted_hashes, trusted_length,
+                          temporary_directory=spool_directory)
         break
       except (tuf.DownloadError, tuf.FormatError), e:
         logger.warn('Download failed from '+mirror_url+'.')
         target_file_object = None
         continue
+      finally:
+        if semaphore is not None:
+          semaphore.release()
     # We have gone through all the mirrors.  Did we get a target file object?
     if target_file_object == None: 
       raise tuf.DownloadError('No download locations known.')
-   
-    # We acquired a target file object from a mirror.  Move the file into
-    # place (i.e., locally to 'destination_directory').
-    destination = os.path.join(destination_directory, target_filepath)
+
+    return target_file_object
+
+
+
+
+
+  def _move_target_into_place(self, target_file_object, target,
+                              destination_directory):
+    """
+    <Purpose>
+      Move the verified 'target_file_object' to the filepath of 'target' under
+      'destination_directory', creating any missing parent directories.  If
+      'tuf.conf.target_index' is set, the trusted hashes of 'target' are
+      recorded for the file in the target index, so that it need not be
+      hashed by updated_targets().
+
+    <Arguments>
+      target_file_object:
+        The 'tuf.util.TempFile' object holding the verified target file.
+
+      target:
+        The target, conformant to 'tuf.formats.TARGETFILE_SCHEMA'.
+
+      destination_directory:
+        The directory to save the target file.
+
+    <Exceptions>
+      OSError, if the parent directories of the target cannot be created.
+
+    <Side Effects>
+      A target file is saved to the local system.  The target index is
+      updated.
+
+    <Returns>
+      None.
+
+    """
+
+    destination = os.path.join(destination_directory, target['filepath'])
     destination = os.path.abspath(destination)
     target_dirpath = os.path.dirname(destination)
     if target_dirpath:
@@ -1897,4 +3933,444 @@ class Updater(object):
         else:
           raise
     
+    verified = time.time()
     target_file_object.move(destination)
+
+    if tuf.conf.target_index:
+      self._record_target_index_entry(destination, os.stat(destination),
+                                      target['fileinfo']['hashes'], verified)
+
+
+
+
+
+
+class _DelegationMatcher(object):
+  """
+  <Purpose>
+    The delegations of a targets role, compiled into lookup tables so that
+    the delegated roles trusted with a target can be found without comparing
+    the target against every delegated path and path hash prefix.
+
+    A target is trusted to a delegated role if it starts with one of the
+    role's 'paths' (a delegated path may be a file or a directory), or if the
+    hash of its path starts with the role's 'path_hash_prefix'.  The paths
+    and path hash prefixes are bucketed by length, in dictionaries keyed by
+    the prefix itself.  Matching a target is then one dictionary lookup per
+    distinct prefix length, rather than one comparison per delegated path.
+
+  <Arguments>
+    child_roles:
+      The 'roles' list of the 'delegations' of a targets role, conformant to
+      'tuf.formats.ROLELIST_SCHEMA'.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    A warning is logged for every delegated role that has neither 'paths'
+    nor 'path_hash_prefix'.
+
+  """
+
+  def __init__(self, child_roles):
+    self.child_roles = child_roles
+    self._role_names = []
+
+    # The index of each delegated role in 'child_roles', keyed by role name.
+    self._role_indices = {}
+
+    # The delegated paths of each role, by role index:
+    # {role index: {path length: set of paths}}.
+    self._paths_by_role = {}
+
+    # The delegated paths and path hash prefixes of all roles:
+    # {prefix length: {prefix: [role indices, in order of appearance]}}.
+    self._path_table = {}
+    self._path_hash_prefix_table = {}
+
+    for role_index, child_role in enumerate(child_roles):
+      child_role_name = child_role['name']
+      self._role_names.append(child_role_name)
+      self._role_indices.setdefault(child_role_name, role_index)
+
+      child_role_paths = child_role.get('paths')
+      child_role_path_hash_prefix = child_role.get('path_hash_prefix')
+
+      if child_role_path_hash_prefix is not None:
+        self._add_prefix(self._path_hash_prefix_table,
+                         child_role_path_hash_prefix, role_index)
+      elif child_role_paths is not None:
+        role_paths = self._paths_by_role.setdefault(role_index, {})
+        for child_role_path in child_role_paths:
+          role_paths.setdefault(len(child_role_path), set()).add(child_role_path)
+          self._add_prefix(self._path_table, child_role_path, role_index)
+      else:
+        # The 'paths' or 'path_hash_prefix' fields should not be missing,
+        # so log a warning if this else clause is reached. 
+        message = repr(child_role)+' unexpectedly did not contain one of '+\
+          'the required fields ("paths" or "path_hash_prefix").'
+        logger.warn(message)
+
+
+
+  def _add_prefix(self, prefix_table, prefix, role_index):
+    """Add 'role_index' to the roles of 'prefix' in 'prefix_table'."""
+
+    role_indices = prefix_table.setdefault(len(prefix), {}).setdefault(prefix, [])
+    if role_index not in role_indices:
+      role_indices.append(role_index)
+
+
+
+  def get_delegated_roles(self, target_filepath, target_filepath_hash):
+    """
+    <Purpose>
+      Return the names of the delegated roles trusted with 'target_filepath',
+      in the order they are listed by the delegating role.  Every role is
+      listed once, even if several of its paths match.
+
+    <Arguments>
+      target_filepath:
+        The path to the target file, relative to the targets directory.
+
+      target_filepath_hash:
+        The hex digest of 'target_filepath' (see 'path_hash_prefix').
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      None.
+
+    <Returns>
+      A list of role names.
+
+    """
+
+    matching_role_indices = set()
+
+    for prefix_length, prefixes in self._path_hash_prefix_table.iteritems():
+      role_indices = prefixes.get(target_filepath_hash[:prefix_length])
+      if role_indices is not None:
+        matching_role_indices.update(role_indices)
+
+    for prefix_length, prefixes in self._path_table.iteritems():
+      role_indices = prefixes.get(target_filepath[:prefix_length])
+      if role_indices is not None:
+        matching_role_indices.update(role_indices)
+
+    return [self._role_names[role_index]
+            for role_index in sorted(matching_role_indices)]
+
+
+
+  def allows_path(self, rolename, target_filepath):
+    """
+    <Purpose>
+      Determine whether 'target_filepath' starts with one of the 'paths'
+      delegated to 'rolename'.
+
+    <Arguments>
+      rolename:
+        The name of a delegated role.
+
+      target_filepath:
+        The path to the target file, relative to the targets directory.
+
+    <Exceptions>
+      None.
+
+    <Side Effects>
+      None.
+
+    <Returns>
+      True if 'target_filepath' is delegated to 'rolename' by path, False
+      otherwise.
+
+    """
+
+    role_index = self._role_indices.get(rolename)
+    role_paths = self._paths_by_role.get(role_index, {})
+
+    for path_length, paths in role_paths.iteritems():
+      if target_filepath[:path_length] in paths:
+        return True
+
+    return False
+
+
+
+
+
+
+class _CompactTargets(collections.MutableMapping):
+  """
+  <Purpose>
+    The 'targets' object of trusted Targets metadata, held compactly.  It is a
+    mapping of target paths to fileinfo (see 'tuf.formats.FILEDICT_SCHEMA'),
+    but a fileinfo with only a 'length' and hex 'hashes' is not kept as a dict
+    of dicts.  Its length is stored in an array of integers and its hashes as
+    raw digests in a byte array, and the path is only mapped to its row in
+    those columns.  The fileinfo dict, with the hashes converted back to hex
+    strings, is built each time it is accessed.  Fileinfo of any other shape
+    (e.g., with 'custom' information, or with different hash algorithms than
+    the first target) is stored unchanged.  The rows of removed or replaced
+    fileinfo are reused.
+
+    ASCII target paths are stored as interned byte strings, so the paths of
+    the 'current' and 'previous' metadata of a role are not duplicated.
+    They compare and hash equal to the unicode paths of the JSON metadata.
+
+    It is not a dict, so that dict() and other functions that read a dict's
+    storage directly do not see the rows; 'tuf.schema.DictOf' schemas accept
+    it.  Use to_dict() for a plain dict (e.g., to encode it in JSON).
+
+  <Arguments>
+    targets:
+      An optional mapping of target paths to fileinfo to store.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    None.
+
+  """
+
+  # Only hex digests that convert back to the same string are stored raw.
+  _HEX_DIGEST = re.compile(r'(?:[0-9a-f]{2})+\Z')
+
+  def __init__(self, targets=None):
+    # Target paths mapped to their row, or to a 1-tuple holding fileinfo that
+    # is not stored in a row.
+    self._rows = {}
+
+    # The hash algorithms of the targets stored in rows, in sorted order,
+    # and the size of their digests.  Set by the first target stored.
+    self._algorithms = None
+    self._digest_sizes = None
+
+    self._lengths = array.array('l')
+    self._digests = bytearray()
+
+    # The rows no longer used by any target.
+    self._free_rows = []
+
+    if targets is not None:
+      self.update(targets)
+
+
+
+  def _to_row(self, fileinfo):
+    # Return the row 'fileinfo' is stored in, or None if it does not have the
+    # shape of the stored rows.
+    if type(fileinfo) is not dict or len(fileinfo) != 2:
+      return None
+    length = fileinfo.get('length')
+    hashes = fileinfo.get('hashes')
+    if type(length) not in (int, long) or length < 0 or \
+       type(hashes) is not dict or not hashes:
+      return None
+
+    algorithms = self._algorithms
+    if algorithms is None:
+      algorithms = tuple(sorted(hashes))
+    elif len(hashes) != len(algorithms):
+      return None
+
+    digests = []
+    for algorithm in algorithms:
+      hex_digest = hashes.get(algorithm)
+      if not isinstance(hex_digest, basestring) or \
+         not self._HEX_DIGEST.match(hex_digest):
+        return None
+      digests.append(binascii.unhexlify(hex_digest))
+    digest_sizes = tuple([len(digest) for digest in digests])
+    if self._digest_sizes is not None and digest_sizes != self._digest_sizes:
+      return None
+
+    # The array raises OverflowError for lengths it cannot hold.
+    try:
+      if self._free_rows:
+        row = self._free_rows[-1]
+        self._lengths[row] = length
+      else:
+        self._lengths.append(length)
+    except OverflowError:
+      return None
+    if self._free_rows:
+      self._free_rows.pop()
+      row_size = sum(digest_sizes)
+      self._digests[row*row_size:(row+1)*row_size] = ''.join(digests)
+      return row
+    self._algorithms = algorithms
+    self._digest_sizes = digest_sizes
+    self._digests.extend(''.join(digests))
+    return len(self._lengths) - 1
+
+
+
+  def _to_fileinfo(self, row):
+    # Build the fileinfo stored in 'row'.  A fileinfo that is not stored in a
+    # row is kept in a tuple instead.
+    if type(row) is tuple:
+      return row[0]
+    hashes = {}
+    offset = row * sum(self._digest_sizes)
+    for algorithm, digest_size in zip(self._algorithms, self._digest_sizes):
+      hashes[algorithm] = \
+        binascii.hexlify(self._digests[offset:offset+digest_size])
+      offset = offset + digest_size
+    return {'length': self._lengths[row], 'hashes': hashes}
+
+
+
+  def _free_row(self, row):
+    # Let a later target reuse 'row'.  Once no row is used, the columns are
+    # emptied.
+    if type(row) is tuple:
+      return
+    self._free_rows.append(row)
+    if len(self._free_rows) == len(self._lengths):
+      self._lengths = array.array('l')
+      self._digests = bytearray()
+      self._free_rows = []
+
+
+
+  def __setitem__(self, target_filepath, fileinfo):
+    if isinstance(target_filepath, unicode):
+      try:
+        target_filepath = target_filepath.encode('ascii')
+      except UnicodeError:
+        pass
+    if type(target_filepath) is str:
+      target_filepath = intern(target_filepath)
+
+    # The replaced row is only freed once the new one is taken, so that it is
+    # not overwritten before the new fileinfo is known to fit.
+    previous_row = self._rows.get(target_filepath)
+    row = self._to_row(fileinfo)
+    if row is None:
+      row = (fileinfo,)
+    self._rows[target_filepath] = row
+    if previous_row is not None:
+      self._free_row(previous_row)
+
+
+
+  def __getitem__(self, target_filepath):
+    return self._to_fileinfo(self._rows[target_filepath])
+
+
+
+  def __delitem__(self, target_filepath):
+    self._free_row(self._rows.pop(target_filepath))
+
+
+
+  def __contains__(self, target_filepath):
+    return target_filepath in self._rows
+
+
+
+  def __iter__(self):
+    return iter(self._rows)
+
+
+
+  def __len__(self):
+    return len(self._rows)
+
+
+
+  def get(self, target_filepath, default=None):
+    row = self._rows.get(target_filepath)
+    if row is None:
+      return default
+    return self._to_fileinfo(row)
+
+
+
+  def keys(self):
+    return self._rows.keys()
+
+
+
+  def iteritems(self):
+    for target_filepath, row in self._rows.iteritems():
+      yield target_filepath, self._to_fileinfo(row)
+
+
+
+  def itervalues(self):
+    for row in self._rows.itervalues():
+      yield self._to_fileinfo(row)
+
+
+
+  def items(self):
+    return list(self.iteritems())
+
+
+
+  def values(self):
+    return list(self.itervalues())
+
+
+
+  def viewkeys(self):
+    return collections.KeysView(self)
+
+
+
+  def viewitems(self):
+    return collections.ItemsView(self)
+
+
+
+  def viewvalues(self):
+    return collections.ValuesView(self)
+
+
+
+  def clear(self):
+    self.__init__()
+
+
+
+  def to_dict(self):
+    """Return the targets as a plain dict."""
+
+    return dict(self.iteritems())
+
+
+
+  def copy(self):
+    return _CompactTargets(self)
+
+
+
+  def __eq__(self, other):
+    if not isinstance(other, collections.Mapping) or len(self) != len(other):
+      return False
+    for target_filepath, fileinfo in self.iteritems():
+      if target_filepath not in other or other[target_filepath] != fileinfo:
+        return False
+    return True
+
+
+
+  def __ne__(self, other):
+    return not self == other
+
+
+
+  def __repr__(self):
+    return repr(self.to_dict())
+
+
+
+  def __reduce__(self):
+    return (_CompactTargets, (self.to_dict(),))
@@ -36,3 +36,104 @@ repository_directory = None
 # https://en.wikipedia.org/wiki/Certificate_authority
 # http://docs.python.org/2/library/ssl.html#certificates
 ssl_certificates = None
+
+# If True, the updater keeps a cache of the parsed and validated metadata it
+# loads from 'metadata/current' and 'metadata/previous' in 'metadata/cache'.
+# A cached object is only used if the length and hash recorded with it match
+# the metadata file, otherwise the file is parsed again.  The cache speeds up
+# the creation of updaters when metadata files are large.
+metadata_cache = False
+
+# If not None, the size in bytes from which the updater loads a metadata file
+# a piece at a time (see 'tuf.util.load_signable_json_file_object()') and
+# stores the fileinfo of its targets compactly, so that the raw text of large
+# targets metadata is never held whole and each loaded target takes less
+# memory.  This is slower than loading the whole file with the json module,
+# which is done for smaller files, and for all files if None.
+metadata_streaming_threshold = None
+
+# If True, the updater keeps an index of the target files it has verified or
+# downloaded, in 'metadata/target_index' under 'repository_directory'.  The
+# index records the size, modification time and inode of each file along with
+# its verified hashes, so that updated_targets() only hashes files whose stat
+# has changed since they were last verified.  A change that preserves all of
+# these is not detected until the file is hashed again; see
+# 'target_index_rehash_interval'.
+target_index = False
+
+# If not None, the number of seconds after which a target file recorded in
+# the target index is hashed again by updated_targets(), even if its stat has
+# not changed.  Set to 0 to hash every file on every call.  If None, recorded
+# files are only hashed again when their stat changes.
+target_index_rehash_interval = None
+
+# If True, the updater downloads each target file into a temporary file in
+# the destination directory given to download_target(), rather than in
+# 'temporary_directory'.  Once verified, the file is renamed into place instead
+# of being copied, which halves the disk I/O for large targets and replaces
+# the destination file atomically.
+spool_targets_in_destination = False
+
+# A directory in which 'tuf.download' keeps partial downloads of files whose
+# trusted length and hashes are known (e.g., target files), so that an
+# interrupted download is resumed, with an HTTP Range request, by the next
+# download of the same file from any mirror, even after a restart.  The hashes
+# of the whole file are verified.  If None, downloads are not resumed.
+partial_download_directory = None
+
+# If True, the updater records the ETag and Last-Modified headers sent with
+# the metadata files it downloads without knowing their trusted length and
+# hashes (i.e., 'timestamp.txt'), in 'metadata/validators' under
+# 'repository_directory'.  The next request for the file from the same mirror
+# is then conditional (If-None-Match and If-Modified-Since), and a '304 Not
+# Modified' reply keeps the current trusted file, whose expiration is still
+# checked, without downloading it again.
+conditional_metadata_requests = False
+
+# If not None, the number of seconds (an int or a float) after which the
+# updater also requests a metadata file from the next mirror, if the mirrors
+# already asked have not yet provided a valid copy.  The first copy that passes
+# the length, hash and signature checks is used and the other requests are
+# abandoned.  If None, mirrors are tried one at a time.
+metadata_hedge_delay = None
+
+# The maximum number of signature verification results that 'tuf.sig' keeps,
+# so that metadata verified again (e.g., unchanged delegated metadata checked
+# on every refresh) does not cost an RSA verification per signature.  The
+# least recently used results are discarded first, and all results are
+# discarded whenever a key is added to or removed from 'tuf.keydb'.  Set to 0
+# to disable the cache.
+signature_cache_size = 1024
+
+# The maximum number of files that 'tuf.hash.digest_filenames()' hashes
+# concurrently, e.g., when the updater checks which local targets have changed
+# or when signerlib generates file information for many files.  Set it to the
+# number of cores that may be spent hashing.  Set to 1 to hash files one at a
+# time.
+hash_workers = 1
+
+# The maximum number of delegated metadata files that the updater downloads
+# concurrently when refreshing all delegated roles (e.g., in all_targets()).
+# A delegated role is only downloaded after its parent role has been verified
+# and its delegations imported.  Set to 1 to refresh roles one at a time.
+delegated_metadata_workers = 1
+
+# A file in which 'tuf.mirrors' saves the latency, throughput and failures it
+# has measured for each mirror, so that later runs order mirrors by their past
+# performance and keep backing off from failing mirrors.  If None, mirror
+# statistics are kept in memory only.
+mirror_statistics_file = None
+
+# The maximum number of bytes that 'tuf.download' reads from a connection at
+# a time.  Larger blocks reduce per-block overhead on fast mirrors.  The
+# downloaded data is not flushed to disk after every block.
+download_block_size = 8192
+
+# The maximum number of idle keep-alive connections that 'tuf.download' keeps
+# open per (scheme, host, port) so they may be reused by later metadata and
+# target downloads from the same mirror.  Set to 0 to disable reuse.
+connection_pool_size = 4
+
+# The number of seconds an idle pooled connection may remain unused before it
+# is closed rather than reused.
+connection_idle_timeout = 30
@@ -0,0 +1,311 @@
+"""
+<Program Name>
+  delta.py
+
+<Started>
+  October 16, 2026.
+
+<Copyright>
+  See LICENSE for licensing information.
+
+<Purpose>
+  Create and apply binary deltas between two versions of a metadata file.
+  A repository may publish, next to a metadata file, deltas from its recent
+  versions (see 'tuf.repo.signerlib.build_metadata_deltas()'), so that a
+  client holding one of those versions downloads the delta instead of the
+  whole file.  A delta is identified by the hash of the version it applies to
+  (see get_delta_filename()).  The file a delta produces is checked against
+  the trusted length and hashes of the metadata file as it is written (see
+  apply_delta()).
+
+  A delta consists of a header followed by a sequence of operations, each of
+  which appends data to the new file:
+
+    'C' offset length   Copy 'length' bytes at 'offset' in the old file.
+    'I' length data     Insert the 'length' bytes of 'data'.
+
+  Offsets and lengths are unsigned 64-bit big-endian integers.  Deltas are
+  created by splitting both files into chunks that end with a comma, which
+  in (canonical) JSON metadata falls between the entries of objects and
+  lists, and copying the chunks of the new file found in the old one.
+
+"""
+
+
+import logging
+import struct
+
+import tuf
+import tuf.formats
+import tuf.hash
+
+logger = logging.getLogger('tuf.delta')
+
+# The hash algorithm of the old file that identifies a delta.
+DELTA_HASH_ALGORITHM = 'sha256'
+
+# The extension of delta filenames, which is followed by the hex digest of
+# the old file.
+DELTA_EXTENSION = '.delta.'
+
+_DELTA_HEADER = 'TUFDELTA1\n'
+_COPY = 'C'
+_INSERT = 'I'
+_COPY_ARGUMENTS = struct.Struct('>QQ')
+_INSERT_ARGUMENTS = struct.Struct('>Q')
+
+# Chunks shorter than this are only copied if they continue the previous copy.
+_MIN_CHUNK_LENGTH = 16
+
+# The number of bytes copied at a time by apply_delta().
+_BLOCK_SIZE = 65536
+
+
+
+
+
+def get_delta_filename(filename, old_file_hashes):
+  """
+  <Purpose>
+    Return the name of the delta that updates the version of the metadata file
+    'filename' with 'old_file_hashes' to the current version, e.g.,
+    'targets.txt.delta.<sha256 hex digest>'.
+
+  <Arguments>
+    filename:
+      The name of the metadata file, e.g., 'targets.txt'.
+
+    old_file_hashes:
+      The hashes of the old version of the file, conformant to
+      'tuf.formats.HASHDICT_SCHEMA'.
+
+  <Exceptions>
+    tuf.FormatError, if the arguments are improperly formatted.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    The delta filename, or None if 'old_file_hashes' does not include a
+    DELTA_HASH_ALGORITHM hash.
+
+  """
+
+  tuf.formats.PATH_SCHEMA.check_match(filename)
+  tuf.formats.HASHDICT_SCHEMA.check_match(old_file_hashes)
+
+  old_file_hash = old_file_hashes.get(DELTA_HASH_ALGORITHM)
+  if old_file_hash is None:
+    return None
+
+  return filename + DELTA_EXTENSION + old_file_hash
+
+
+
+
+
+def create_delta(old_data, new_data):
+  """
+  <Purpose>
+    Create a delta that turns 'old_data' into 'new_data'.
+
+  <Arguments>
+    old_data:
+      The contents of the old version of the file.
+
+    new_data:
+      The contents of the new version of the file.
+
+  <Exceptions>
+    tuf.FormatError, if the arguments are not strings.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    The delta, a string.
+
+  """
+
+  tuf.formats.ENCODED_CANONICAL_SCHEMA.check_match(old_data)
+  tuf.formats.ENCODED_CANONICAL_SCHEMA.check_match(new_data)
+
+  # The offset of the first occurrence of each chunk of 'old_data'.
+  old_chunk_offsets = {}
+  offset = 0
+  for chunk in _split_chunks(old_data):
+    if len(chunk) >= _MIN_CHUNK_LENGTH:
+      old_chunk_offsets.setdefault(chunk, offset)
+    offset = offset + len(chunk)
+
+  operations = [_DELTA_HEADER]
+  copy_offset = copy_length = 0
+  insert_chunks = []
+
+  for chunk in _split_chunks(new_data):
+    # Extend the current copy if the chunk follows it in 'old_data' too.
+    copy_end = copy_offset + copy_length
+    if copy_length and old_data.startswith(chunk, copy_end):
+      copy_length = copy_length + len(chunk)
+      continue
+
+    old_offset = old_chunk_offsets.get(chunk)
+    if old_offset is None:
+      if copy_length:
+        operations.append(_COPY + _COPY_ARGUMENTS.pack(copy_offset, copy_length))
+        copy_length = 0
+      insert_chunks.append(chunk)
+      continue
+
+    if copy_length:
+      operations.append(_COPY + _COPY_ARGUMENTS.pack(copy_offset, copy_length))
+    elif insert_chunks:
+      insert_data = ''.join(insert_chunks)
+      operations.append(_INSERT + _INSERT_ARGUMENTS.pack(len(insert_data)))
+      operations.append(insert_data)
+      insert_chunks = []
+    copy_offset, copy_length = old_offset, len(chunk)
+
+  if copy_length:
+    operations.append(_COPY + _COPY_ARGUMENTS.pack(copy_offset, copy_length))
+  elif insert_chunks:
+    insert_data = ''.join(insert_chunks)
+    operations.append(_INSERT + _INSERT_ARGUMENTS.pack(len(insert_data)))
+    operations.append(insert_data)
+
+  return ''.join(operations)
+
+
+
+
+
+def _split_chunks(data):
+  """Split 'data' into chunks that each end with a comma, except the last."""
+
+  chunks = data.split(',')
+  last_chunk = chunks.pop()
+  for chunk in chunks:
+    yield chunk + ','
+  if last_chunk:
+    yield last_chunk
+
+
+
+
+
+def apply_delta(old_file_object, delta_file_object, new_file_object,
+                trusted_length, trusted_hashes):
+  """
+  <Purpose>
+    Apply the delta read from 'delta_file_object' to the old version of a file
+    read from 'old_file_object', writing the new version to
+    'new_file_object'.  The delta is not trusted: it may not refer to data
+    outside of the old file, and the new version must match
+    'trusted_length' and 'trusted_hashes', which are computed as it is
+    written.
+
+  <Arguments>
+    old_file_object:
+      A file object holding the old version of the file.
+
+    delta_file_object:
+      A file object, or a 'tuf.util.TempFile', holding the delta.  It is read
+      from the beginning.
+
+    new_file_object:
+      A file object, or a 'tuf.util.TempFile', the new version is written to.
+
+    trusted_length:
+      The trusted length of the new version.
+
+    trusted_hashes:
+      The trusted hashes of the new version, conformant to
+      'tuf.formats.HASHDICT_SCHEMA'.
+
+  <Exceptions>
+    tuf.BadDeltaError, if the delta is invalid or does not produce
+    'trusted_length' bytes.
+
+    tuf.BadHashError, if the new version does not match 'trusted_hashes'.
+
+    tuf.UnsupportedAlgorithmError, if a hash algorithm is not supported.
+
+  <Side Effects>
+    The files are read, and 'new_file_object' written.
+
+  <Returns>
+    None.
+
+  """
+
+  tuf.formats.LENGTH_SCHEMA.check_match(trusted_length)
+  tuf.formats.HASHDICT_SCHEMA.check_match(trusted_hashes)
+
+  digest_objects = {}
+  for algorithm in trusted_hashes:
+    digest_objects[algorithm] = tuf.hash.digest(algorithm)
+
+  old_file_object.seek(0, 2)
+  old_length = old_file_object.tell()
+
+  delta_file_object.seek(0)
+  if _read_exactly(delta_file_object, len(_DELTA_HEADER)) != _DELTA_HEADER:
+    raise tuf.BadDeltaError('Not a delta.')
+
+  new_length = 0
+  while True:
+    operation = _read_exactly(delta_file_object, 1, allow_end=True)
+    if not operation:
+      break
+
+    if operation == _COPY:
+      offset, length = _COPY_ARGUMENTS.unpack(
+        _read_exactly(delta_file_object, _COPY_ARGUMENTS.size))
+      if offset + length > old_length:
+        raise tuf.BadDeltaError('The delta copies data past the end of the '+\
+                                'old file.')
+      source = old_file_object
+      source.seek(offset)
+    elif operation == _INSERT:
+      length, = _INSERT_ARGUMENTS.unpack(
+        _read_exactly(delta_file_object, _INSERT_ARGUMENTS.size))
+      source = delta_file_object
+    else:
+      raise tuf.BadDeltaError('Unknown delta operation: '+repr(operation))
+
+    if new_length + length > trusted_length:
+      raise tuf.BadDeltaError('The delta produces more than '+\
+                              str(trusted_length)+' bytes.')
+    new_length = new_length + length
+
+    while length:
+      data = _read_exactly(source, min(length, _BLOCK_SIZE))
+      new_file_object.write(data)
+      for digest_object in digest_objects.values():
+        digest_object.update(data)
+      length = length - len(data)
+
+  if new_length != trusted_length:
+    raise tuf.BadDeltaError('The delta produces '+str(new_length)+\
+                            ' bytes, expected '+str(trusted_length)+'.')
+
+  for algorithm, trusted_hash in trusted_hashes.items():
+    computed_hash = digest_objects[algorithm].hexdigest()
+    if computed_hash != trusted_hash:
+      raise tuf.BadHashError('Hashes do not match. Expected '+trusted_hash+\
+                             ' got '+computed_hash)
+
+
+
+
+
+def _read_exactly(file_object, size, allow_end=False):
+  """
+  Read 'size' bytes from 'file_object'.  Raise tuf.BadDeltaError if the file
+  ends before, unless 'allow_end' is set and nothing could be read.
+  """
+
+  data = file_object.read(size)
+  if len(data) != size and not (allow_end and not data):
+    raise tuf.BadDeltaError('Unexpected end of file.')
+  return data
@@ -24,12 +24,18 @@
 
 import logging
 import os.path
+import re
 import socket
+import tempfile
+import threading
+import time
 
 import tuf
+import tuf.conf
 import tuf.hash
 import tuf.util
 import tuf.formats
+import tuf.mirrors
 
 from tuf.compatibility import httplib, ssl, urllib2, urlparse
 if ssl:
@@ -41,6 +47,24 @@ else:
 # See 'log.py' to learn how logging is handled in TUF.
 logger = logging.getLogger('tuf.download')
 
+# The maximum number of HTTP redirects followed by '_open_connection()'.
+_MAX_REDIRECTS = 5
+
+# Idle keep-alive connections, keyed by (scheme, host, port).  Each value is a
+# list of (connection, time_released) tuples, most recently released last.
+# Downloads may be performed by several threads at once (see
+# 'tuf.client.updater.Updater.download_targets()'), so the pool is guarded by
+# '_connection_pool_lock'.
+_connection_pool = {}
+_connection_pool_lock = threading.Lock()
+
+# The paths of the partial download spools being written by downloads in
+# progress (see '_resume_download()').  A spool is written by one download at
+# a time: a concurrent download of the same file, e.g., of two targets with
+# the same content, is not resumable.
+_partial_downloads = set()
+_partial_downloads_lock = threading.Lock()
+
 
 class VerifiedHTTPSConnection( httplib.HTTPSConnection ):
     """
@@ -136,63 +160,444 @@ def _get_opener( scheme = None ):
     return opener
 
 
-def _open_connection(url):
+def _new_connection(pool_key):
+  """
+  <Purpose>
+    Create a new, unconnected, HTTP(S) connection for 'pool_key'.  Https
+    connections are 'VerifiedHTTPSConnection' objects, so the server's
+    certificate and hostname are verified when the connection is established.
+
+  <Arguments>
+    pool_key:
+      A (scheme, host, port) tuple.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    An 'httplib.HTTPConnection' or 'VerifiedHTTPSConnection' object.
+
+  """
+
+  scheme, host, port = pool_key
+  if scheme == 'https':
+    return VerifiedHTTPSConnection(host, port)
+  else:
+    return httplib.HTTPConnection(host, port)
+
+
+
+
+
+def _checkout_connection(pool_key):
+  """
+  <Purpose>
+    Take the most recently released idle connection for 'pool_key' out of the
+    pool, or create a new connection if none is available.  Idle connections
+    older than 'tuf.conf.connection_idle_timeout' are closed and discarded.
+
+  <Arguments>
+    pool_key:
+      A (scheme, host, port) tuple.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    Expired idle connections are closed.
+
+  <Returns>
+    A (connection, reused) tuple, where 'reused' is True if the connection was
+    taken from the pool.
+
+  """
+
+  now = time.time()
+  expired = []
+  connection = None
+
+  _connection_pool_lock.acquire()
+  try:
+    idle_connections = _connection_pool.get(pool_key, [])
+    while idle_connections:
+      idle_connection, time_released = idle_connections.pop()
+      if now - time_released < tuf.conf.connection_idle_timeout:
+        connection = idle_connection
+        break
+      expired.append(idle_connection)
+  finally:
+    _connection_pool_lock.release()
+
+  for idle_connection in expired:
+    idle_connection.close()
+
+  if connection is None:
+    return _new_connection(pool_key), False
+  return connection, True
+
+
+
+
+
+def _release_connection(pool_key, connection):
+  """
+  <Purpose>
+    Return 'connection' to the pool so that a later request to 'pool_key' may
+    reuse it.  The connection is closed instead if the pool for 'pool_key'
+    already holds 'tuf.conf.connection_pool_size' idle connections.
+
+  <Arguments>
+    pool_key:
+      A (scheme, host, port) tuple.
+
+    connection:
+      An idle connection whose last response has been read completely.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    'connection' is added to the pool or closed.
+
+  <Returns>
+    None.
+
+  """
+
+  _connection_pool_lock.acquire()
+  try:
+    idle_connections = _connection_pool.setdefault(pool_key, [])
+    if len(idle_connections) < tuf.conf.connection_pool_size:
+      idle_connections.append((connection, time.time()))
+      return
+  finally:
+    _connection_pool_lock.release()
+
+  connection.close()
+
+
+
+
+
+def clear_connection_pool():
   """
   <Purpose>
-    Helper function that opens a connection to the url. urllib2 supports http, 
-    ftp, and file. In python (2.6+) where the ssl module is available, urllib2 
-    also supports https.
+    Close and discard every idle connection held in the connection pool.
 
-    TODO: Determine whether this follows http redirects and decide if we like
-    that. For example, would we not want to allow redirection from ssl to
-     non-ssl urls?
+  <Arguments>
+    None.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    All pooled connections are closed.
+
+  <Returns>
+    None.
+
+  """
+
+  _connection_pool_lock.acquire()
+  try:
+    idle_connections = []
+    for pool_key in _connection_pool.keys():
+      idle_connections.extend(_connection_pool.pop(pool_key))
+  finally:
+    _connection_pool_lock.release()
+
+  for connection, time_released in idle_connections:
+    connection.close()
+
+
+
+
+
+class _PooledResponse(object):
+  """
+  A file-like wrapper around an 'httplib.HTTPResponse' that returns its
+  connection to the pool when closed, provided the response was read to the
+  end and the server allows the connection to be kept alive.  Otherwise, the
+  connection is closed.
+  """
+
+  def __init__(self, pool_key, connection, response):
+    self.pool_key = pool_key
+    self.connection = connection
+    self.response = response
+    self.status = response.status
+
+
+  def read(self, size=None):
+    if size is None:
+      return self.response.read()
+    return self.response.read(size)
+
+
+  def info(self):
+    return self.response.msg
+
+
+  def getheader(self, name, default=None):
+    return self.response.getheader(name, default)
+
+
+  def close(self):
+    if self.connection is None:
+      return
+    connection = self.connection
+    self.connection = None
+
+    # 'httplib.HTTPResponse' closes itself once its whole body has been read.
+    if self.response.isclosed() and not self.response.will_close:
+      _release_connection(self.pool_key, connection)
+    else:
+      self.response.close()
+      connection.close()
+
+
+  def discard(self):
+    """Close the response and its connection, which is not returned to the
+    pool even if the response was read to the end."""
+
+    if self.connection is None:
+      return
+    connection = self.connection
+    self.connection = None
+    self.response.close()
+    connection.close()
+
+
+
+
+
+def _request_over_pooled_connection(parsed_url, extra_headers):
+  """
+  <Purpose>
+    Send a GET request for 'parsed_url' over a pooled keep-alive connection.
+    A reused connection may have been closed by the server while idle, in
+    which case the request is retried once over a new connection.
+
+  <Arguments>
+    parsed_url:
+      The result of 'urlparse.urlparse()' for an http or https url.
+
+    extra_headers:
+      A dictionary of additional request headers.
+
+  <Exceptions>
+    httplib.HTTPException or socket.error, if the request fails.
+
+  <Side Effects>
+    Opens a connection to a remote server, if one is not already pooled.
+
+  <Returns>
+    A '_PooledResponse' object.
+
+  """
+
+  scheme = parsed_url.scheme
+  port = parsed_url.port
+  if port is None:
+    if scheme == 'https':
+      port = httplib.HTTPS_PORT
+    else:
+      port = httplib.HTTP_PORT
+  pool_key = (scheme, parsed_url.hostname, port)
+
+  path = parsed_url.path or '/'
+  if parsed_url.query:
+    path = path+'?'+parsed_url.query
+
+  # See '_get_request()' for the use of the 'Accept-encoding' header.
+  headers = {'Accept-encoding': 'identity'}
+  headers.update(extra_headers)
+
+  connection, reused = _checkout_connection(pool_key)
+  while True:
+    try:
+      connection.request('GET', path, headers=headers)
+      response = connection.getresponse()
+    except (httplib.HTTPException, socket.error), e:
+      connection.close()
+      if not reused:
+        raise
+      message = 'Pooled connection to '+repr(pool_key)+' failed: '+str(e)
+      logger.debug(message)
+      connection, reused = _new_connection(pool_key), False
+    else:
+      return _PooledResponse(pool_key, connection, response)
+
+
+
+
+
+def _open_connection(url, extra_headers=None):
+  """
+  <Purpose>
+    Helper function that opens a connection to the url.  Http and https urls
+    are requested over HTTP/1.1 keep-alive connections taken from a pool keyed
+    by scheme, host and port, so consecutive downloads from the same mirror
+    do not pay for a new TCP connection and TLS handshake.  The size of the
+    pool and how long idle connections are kept are set by
+    'tuf.conf.connection_pool_size' and 'tuf.conf.connection_idle_timeout'.
+    Other schemes supported by urllib2 (e.g., ftp and file) are opened with a
+    urllib2 opener.
+
+    Http redirects are followed, up to '_MAX_REDIRECTS' times, but redirection
+    from an https url to a non-https url is refused.
+
+    A connection error or a server error (5xx) response is recorded as a
+    failure of the mirror of 'url' (see 'tuf.mirrors.record_failure()').
+    Other errors, e.g., '404 Not Found' for an optional file, are not.
   
   <Arguments>
     url:
       URL string (e.g., 'http://...' or 'ftp://...' or 'file://...') 
+
+    extra_headers:
+      An optional dictionary of additional request headers.  If it holds a
+      'Range' header, a '206 Partial Content' response is also accepted.  If
+      it holds an 'If-None-Match' or 'If-Modified-Since' header, a '304 Not
+      Modified' response is also accepted.
     
   <Exceptions>
     tuf.DownloadError
     
   <Side Effects>
-    Opens a connection to a remote server.
+    Opens a connection to a remote server.  The statistics of the mirror of
+    'url' may be updated.
     
   <Returns>
     File-like object.
     
   """
   
-  try:
-    # urllib2.Request produces a Request object that allows for a finer control 
-    # of the requesting process. Request object allows to add headers or data to
-    # the HTTP request. For instance, request method add_header(key, val) can be
-    # used to change/spoof 'User-Agent' from default Python-urllib/x.y to 
-    # 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)' this can be useful if
-    # servers do not recognize connections that originates from 
-    # Python-urllib/x.y.
+  if extra_headers is None:
+    extra_headers = {}
 
+  original_url = url
+  accepted_statuses = [200]
+  if 'Range' in extra_headers:
+    accepted_statuses.append(206)
+  if 'If-None-Match' in extra_headers or 'If-Modified-Since' in extra_headers:
+    accepted_statuses.append(304)
+
+  try:
     parsed_url = urlparse.urlparse( url )
-    opener = _get_opener( scheme = parsed_url.scheme )
-    request = _get_request( url )
-    return opener.open( request )
+
+    if parsed_url.scheme not in ('http', 'https'):
+      # urllib2.Request produces a Request object that allows for a finer
+      # control of the requesting process. Request object allows to add headers
+      # or data to the request.
+      opener = _get_opener( scheme = parsed_url.scheme )
+      request = _get_request( url )
+      for header, value in extra_headers.items():
+        request.add_header(header, value)
+      return opener.open( request )
+
+    for redirect in range(_MAX_REDIRECTS + 1):
+      response = _request_over_pooled_connection(parsed_url, extra_headers)
+      if response.status in (301, 302, 303, 307):
+        location = response.getheader('location')
+        response.read()
+        response.close()
+        if location is None:
+          raise tuf.DownloadError('Redirect without a location for '+url)
+        url = urlparse.urljoin(url, location)
+        redirected_url = urlparse.urlparse(url)
+        if parsed_url.scheme == 'https' and redirected_url.scheme != 'https':
+          raise tuf.DownloadError('Refusing redirect from https to '+url)
+        if redirected_url.scheme not in ('http', 'https'):
+          raise tuf.DownloadError('Refusing redirect to '+url)
+        parsed_url = redirected_url
+        continue
+
+      if response.status not in accepted_statuses:
+        response.close()
+        if response.status >= 500:
+          tuf.mirrors.record_failure(original_url)
+        raise tuf.DownloadError('HTTP Error '+str(response.status)+' for '+url)
+      return response
+
+    raise tuf.DownloadError('Too many redirects for '+url)
+  except tuf.DownloadError:
+    raise
   except Exception, e:
+    if _is_connection_error(e):
+      tuf.mirrors.record_failure(original_url)
     raise tuf.DownloadError(e)
 
 
 
 
 
-def _check_hashes(input_file, trusted_hashes):
+def _is_connection_error(error):
+  """Return True if the exception 'error' means that the server could not be
+  connected to, or that the connection failed (e.g., was refused, reset or
+  timed out).  Errors raised by '_open_connection()' are not connection
+  errors: it records the failures itself."""
+
+  # urllib2 wraps the errors of the schemes it opens (e.g., ftp).
+  if isinstance(error, urllib2.URLError) and \
+     not isinstance(error, urllib2.HTTPError):
+    error = error.reason
+  return isinstance(error, (socket.error, httplib.HTTPException))
+
+
+
+
+
+def _get_digest_objects(trusted_hashes):
+  """
+  <Purpose>
+    Helper function that creates one digest object for each hash algorithm
+    listed in 'trusted_hashes'.  The digest objects are updated with each chunk
+    of data as it is downloaded (see '_download_fixed_amount_of_data()'), so
+    that every algorithm is computed in a single pass over the data.
+
+  <Arguments>
+    trusted_hashes: 
+      A dictionary with hash-algorithm names as keys and hashes as dict values.
+
+  <Exceptions>
+    tuf.UnsupportedAlgorithmError, if a hash algorithm is not supported.
+
+  <Side Effects>
+    Hash digest objects are created using the 'tuf.hash' module.
+
+  <Returns>
+    A dictionary with hash-algorithm names as keys and digest objects as
+    dict values.
+
+  """
+
+  digest_objects = {}
+  for algorithm in trusted_hashes:
+    digest_objects[algorithm] = tuf.hash.digest(algorithm)
+
+  return digest_objects
+
+
+
+
+
+def _check_hashes(digest_objects, trusted_hashes):
   """
   <Purpose>
     Helper function that verifies multiple secure hashes of the downloaded file.
     If any of these fail it raises an exception.  This is to conform with the 
-    TUF specs, which support clients with different hashing algorithms. The
-    'hash.py' module is used to compute the hashes of the 'input_file'. 
+    TUF specs, which support clients with different hashing algorithms.  The
+    digest objects have already been updated with the downloaded data, so the
+    file is not read back.
 
   <Arguments>
-    input_file:
-      A file or file-like object.
+    digest_objects:
+      A dictionary with hash-algorithm names as keys and digest objects, which
+      have been updated with all of the downloaded data, as dict values.
     
     trusted_hashes: 
       A dictionary with hash-algorithm names as keys and hashes as dict values.
@@ -202,7 +607,7 @@ def _check_hashes(input_file, trusted_hashes):
     tuf.BadHashError, if the hashes don't match.
     
   <Side Effects>
-    Hash digest object is created using the 'tuf.hash' module.
+    None.
     
   <Returns>
     None.
@@ -211,9 +616,7 @@ def _check_hashes(input_file, trusted_hashes):
   # Verify each trusted hash of 'trusted_hashes'.  Raise exception if
   # any of the hashes are incorrect and return if all are correct.
   for algorithm, trusted_hash in trusted_hashes.items():
-    digest_object = tuf.hash.digest(algorithm)
-    digest_object.update(input_file.read())
-    computed_hash = digest_object.hexdigest()
+    computed_hash = digest_objects[algorithm].hexdigest()
     if trusted_hash != computed_hash:
       msg = 'Hashes do not match. Expected '+trusted_hash+' got '+computed_hash
       raise tuf.BadHashError(msg)
@@ -227,12 +630,16 @@ def _check_hashes(input_file, trusted_hashes):
 
 
 def _download_fixed_amount_of_data(connection, temp_file, file_length,
-                                   required_length):
+                                   required_length, digest_objects=None,
+                                   cancel_event=None):
   """
   <Purpose>
     This is a helper function, where the download really happens. While-block
     reads data from connection a fixed chunk of data at a time, or less, until
-    'file_length' is reached.
+    'file_length' is reached.  Each chunk is also fed to 'digest_objects', so
+    the file's hashes are computed as it is downloaded.  The size of a chunk
+    is set by 'tuf.conf.download_block_size'.  If 'cancel_event' is set, the
+    download stops before the next chunk is read.
   
   <Arguments>
     connection:
@@ -241,7 +648,8 @@ def _download_fixed_amount_of_data(connection, temp_file, file_length,
 
     temp_file:
       A temporary file where the contents at the URL specified by the
-      'connection' object will be stored.
+      'connection' object will be stored, or a '_DecompressingWriter' that
+      decompresses them into one.
 
     file_length:
       The number of bytes that the server claims is the size of the file.
@@ -251,11 +659,25 @@ def _download_fixed_amount_of_data(connection, temp_file, file_length,
       always specified by the TUF metadata for the data file in question
       (except in the case of timestamp metadata, in which case we would fix a
       reasonable upper bound).
+
+    digest_objects:
+      A dictionary with hash-algorithm names as keys and digest objects as
+      dict values (see '_get_digest_objects()'), or None if the hashes of the
+      file are not needed.
+
+    cancel_event:
+      A 'threading.Event', or None.  It is checked before each chunk is read.
+      Once it is set, the connection is closed, and not returned to the
+      connection pool, since the server may still be sending the file.
   
   <Side Effects>
-    Data from the server will be written to 'temp_file'.
+    Data from the server will be written to 'temp_file'.  'digest_objects'
+    are updated with the downloaded data.
  
   <Exceptions>
+    tuf.DownloadError, if the download is cancelled or fewer bytes than
+    'file_length' are downloaded.
+
     Runtime or network exceptions will be raised without question.
  
   <Returns>
@@ -266,17 +688,29 @@ def _download_fixed_amount_of_data(connection, temp_file, file_length,
   """
 
   # The maximum chunk of data, in bytes, we would download in every round.
-  BLOCK_SIZE = 8192
+  block_size = tuf.conf.download_block_size
+  tuf.formats.BLOCK_SIZE_SCHEMA.check_match(block_size)
 
   # Keep track of total bytes downloaded.
   total_downloaded = 0
 
+  if digest_objects is None:
+    digest_objects = {}
+  digest_objects = digest_objects.values()
+
   try:
     while True:
+      if cancel_event is not None and cancel_event.is_set():
+        discard = getattr(connection, 'discard', None)
+        if discard is not None:
+          discard()
+        raise tuf.DownloadError('Download cancelled after '+\
+                                str(total_downloaded)+' bytes.')
+
       # We download a fixed chunk of data in every round. This is so that we
       # can defend against slow retrieval attacks. Furthermore, we do not wish
       # to download an extremely large file in one shot.
-      data = connection.read(min(BLOCK_SIZE, file_length-total_downloaded))
+      data = connection.read(min(block_size, file_length-total_downloaded))
 
       # We might have no more data to read. Check number of bytes downloaded. 
       if not data:
@@ -289,14 +723,19 @@ def _download_fixed_amount_of_data(connection, temp_file, file_length,
         # we just need check one of them. 
         if total_downloaded != file_length:
           message = 'Downloaded '+str(total_downloaded)+'.  Expected '+ \
-            str(file_length)+' for '+url
+            str(file_length)+' bytes.'
           raise tuf.DownloadError(message)
 
-        # Finally, we signal that the download is complete.
+        # Finally, we signal that the download is complete.  The data is
+        # flushed once, rather than after every chunk.
+        temp_file.flush()
         break
 
-      # Data successfully read from the connection.  Store it. 
-      temp_file.write(data)
+      # Data successfully read from the connection.  Store it and update the
+      # file's hashes, so the file need not be read back to verify them.
+      temp_file.write(data, auto_flush=False)
+      for digest_object in digest_objects:
+        digest_object.update(data)
       total_downloaded = total_downloaded + len(data)
   except:
     raise
@@ -309,8 +748,305 @@ def _download_fixed_amount_of_data(connection, temp_file, file_length,
 
 
 
+def _get_partial_download_filepath(required_hashes, required_length):
+  """
+  <Purpose>
+    Return the path of the partial download spool of the file described by
+    'required_hashes' and 'required_length', in the directory set by
+    'tuf.conf.partial_download_directory'.  The spool is identified by the
+    trusted length and hashes of the file, rather than by its url, so that a
+    download interrupted on one mirror may be resumed on any other.
+
+  <Arguments>
+    required_hashes:
+      A dictionary with hash-algorithm names as keys and hashes as dict values.
+
+    required_length:
+      The length of the file.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    The path of the partial download spool.
+
+  """
+
+  digest_object = tuf.hash.digest('sha256')
+  for algorithm in sorted(required_hashes):
+    digest_object.update(algorithm+':'+required_hashes[algorithm]+'\n')
+  filename = str(required_length)+'-'+digest_object.hexdigest()+'.partial'
+
+  return os.path.join(tuf.conf.partial_download_directory, filename)
+
+
+
+
+
+def _get_response_status(connection):
+  """Return the HTTP status of 'connection', or None if it has none (e.g., for
+  file urls)."""
+
+  status = getattr(connection, 'status', None)
+  if status is None:
+    status = getattr(connection, 'code', None)
+  return status
+
+
+
+
+
+def _resume_download(url, required_hashes, required_length, partial_filepath,
+                     cancel_event=None):
+  """
+  <Purpose>
+    Download the file at 'url' into its partial download spool (see
+    '_get_partial_download_filepath()'), continuing from the data already in
+    the spool, if any, with an HTTP Range request.  If the server does not
+    honour the request, the spool is restarted from the beginning.  The
+    length and hashes of the whole file, including the data downloaded by
+    earlier attempts, are verified.
+
+    If the download is interrupted, the spool is kept so that a later attempt
+    (from any mirror, in this process or another) can resume it.  If the
+    complete file fails verification, the spool is removed.  Otherwise, it is
+    renamed to a unique temporary file, so that the spool is free for the next
+    download of the same file as soon as this one returns.
+
+    The caller must have claimed the spool in '_partial_downloads'.
+
+  <Arguments>
+    url:
+      A url string that represents the location of the file. 
+
+    required_hashes:
+      A dictionary, where the keys represent the hashing algorithm used to 
+      hash the file and the dict values the hexdigest.
+
+    required_length:
+      An integer value representing the length of the file.
+
+    partial_filepath:
+      The path of the partial download spool of the file (see
+      '_get_partial_download_filepath()').
+
+    cancel_event:
+      A 'threading.Event' that cancels the download once set, or None (see
+      '_download_fixed_amount_of_data()').  A cancelled download is
+      interrupted, and its spool kept.
+
+  <Exceptions>
+    tuf.DownloadError, if the file could not be downloaded or verified.
+
+  <Side Effects>
+    The partial download spool is created, extended, renamed or removed.
+
+  <Returns>
+    'tuf.util.TempFile' instance, backed by the completed spool.
+
+  """
+
+  tuf.util.ensure_parent_dir(partial_filepath)
+  temp_file = tuf.util.TempFile(filepath=partial_filepath)
+  digest_objects = _get_digest_objects(required_hashes)
+  block_size = tuf.conf.download_block_size
+
+  # The hashes must cover the whole file, so the data downloaded by earlier
+  # attempts is hashed first.
+  downloaded_length = 0
+  temp_file.seek(0)
+  while True:
+    data = temp_file.temporary_file.read(block_size)
+    if not data:
+      break
+    for digest_object in digest_objects.values():
+      digest_object.update(data)
+    downloaded_length = downloaded_length + len(data)
+
+  # A spool longer than the file cannot be resumed.
+  if downloaded_length > required_length:
+    temp_file.temporary_file.truncate(0)
+    digest_objects = _get_digest_objects(required_hashes)
+    downloaded_length = 0
+
+  connection = None
+  try:
+    if downloaded_length < required_length:
+      extra_headers = {}
+      if downloaded_length:
+        logger.info('Resuming '+url+' at byte '+str(downloaded_length)+'.')
+        extra_headers['Range'] = 'bytes='+str(downloaded_length)+'-'
+
+      start_time = time.time()
+      connection = _open_connection(url, extra_headers)
+      latency = time.time() - start_time
+
+      # Does the response continue the spool?  Otherwise, the server ignored
+      # the Range request and sent the whole file.
+      if downloaded_length:
+        content_range = connection.info().get('Content-Range', '')
+        expected_range = re.compile('bytes '+str(downloaded_length)+'-\\d+/('+\
+                                    str(required_length)+'|\\*)$')
+        if _get_response_status(connection) != 206 or \
+           not expected_range.match(content_range.strip()):
+          logger.info('Restarting '+url+', which could not be resumed.')
+          temp_file.temporary_file.truncate(0)
+          digest_objects = _get_digest_objects(required_hashes)
+          downloaded_length = 0
+
+      # Does the server agree on the number of bytes that remain?
+      remaining_length = required_length - downloaded_length
+      content_length = connection.info().get('Content-Length')
+      if content_length is not None and \
+         int(content_length, 10) != remaining_length:
+        message = 'Incorrect length for '+url+'. Expected '+\
+          str(remaining_length)+', got '+content_length+' bytes.'
+        raise tuf.DownloadError(message)
+
+      _download_fixed_amount_of_data(connection, temp_file, remaining_length,
+                                     remaining_length, digest_objects,
+                                     cancel_event)
+      transfer_time = time.time() - start_time - latency
+      tuf.mirrors.record_download(url, latency, remaining_length,
+                                  transfer_time)
+
+    _check_hashes(digest_objects, required_hashes)
+
+    # Move the complete file off the spool path.  The caller may keep the file
+    # after the spool is released, while another download reuses the spool.
+    fd, completed_filepath = \
+      tempfile.mkstemp(prefix=os.path.basename(partial_filepath)+'.',
+                       dir=os.path.dirname(partial_filepath))
+    os.close(fd)
+    temp_file.rename_temp_file(completed_filepath)
+
+  except tuf.BadHashError, e:
+    # The complete file is invalid, so none of the spool can be trusted.
+    temp_file.close_temp_file()
+    logger.error(str(e))
+    raise tuf.DownloadError(e)
+
+  except Exception, e:
+    # Keep the spool, so that the download can be resumed.
+    if connection is not None:
+      connection.close()
+    temp_file.close_temp_file(keep_file=True)
+    if _is_connection_error(e):
+      tuf.mirrors.record_failure(url)
+    logger.error(str(e))
+    if isinstance(e, tuf.DownloadError):
+      raise
+    raise tuf.DownloadError(e)
+
+  return temp_file
+
+
+
+
+
+def _get_conditional_headers(validators):
+  """Return the request headers that make a request conditional on the
+  'validators' (see download_url_to_tempfileobj())."""
+
+  headers = {}
+  if 'etag' in validators:
+    headers['If-None-Match'] = validators['etag']
+  if 'last_modified' in validators:
+    headers['If-Modified-Since'] = validators['last_modified']
+  return headers
+
+
+
+
+
+def _get_validators(connection):
+  """Return the validators (see download_url_to_tempfileobj()) sent with the
+  response of 'connection'."""
+
+  validators = {}
+  etag = connection.info().get('ETag')
+  if etag is not None:
+    validators['etag'] = etag
+  last_modified = connection.info().get('Last-Modified')
+  if last_modified is not None:
+    validators['last_modified'] = last_modified
+  return validators
+
+
+
+
+
+class _DecompressingWriter(object):
+  """
+  Decompress the data written to it, as it is downloaded, into a
+  'tuf.util.TempFile'.  No more than 'uncompressed_length' bytes, if set, may
+  be written, so that a mirror cannot fill the disk with a small compressed
+  file before its hashes are checked.  The decompressor is asked for at most
+  one byte more than remains, so such a file is not expanded in memory
+  either.
+  """
+
+  def __init__(self, temp_file, compression, uncompressed_length):
+    self._temp_file = temp_file
+    self._decompressor = tuf.util.get_decompressor(compression)
+    self._uncompressed_length = uncompressed_length
+    self.length = 0
+
+
+
+  def _write_decompressed(self, data, auto_flush):
+    self.length = self.length + len(data)
+    if self._uncompressed_length is not None and \
+       self.length > self._uncompressed_length:
+      raise tuf.DownloadError('Decompressed more than '+\
+                              str(self._uncompressed_length)+' bytes.')
+    self._temp_file.write(data, auto_flush)
+
+
+
+  def write(self, data, auto_flush=True):
+    # The data is decompressed a block at a time, and its length checked
+    # after each block (see 'tuf.util.register_compression()').  One byte
+    # more than remains is enough to tell that the file is too long.
+    while True:
+      max_length = tuf.conf.download_block_size
+      if self._uncompressed_length is not None:
+        max_length = min(max_length,
+                         self._uncompressed_length - self.length + 1)
+      decompressed_data = self._decompressor.decompress(data, max_length)
+      data = ''
+      self._write_decompressed(decompressed_data, auto_flush)
+      if len(decompressed_data) < max_length:
+        break
+
+
+
+  def flush(self):
+    self._temp_file.flush()
+
+
+
+  def finish(self):
+    """Check the length of the decompressed data."""
+
+    self._temp_file.flush()
+    if self._uncompressed_length is not None and \
+       self.length != self._uncompressed_length:
+      raise tuf.DownloadError('Decompressed '+str(self.length)+\
+                              ' bytes.  Expected '+\
+                              str(self._uncompressed_length)+' bytes.')
+
+
+
+
+
 def download_url_to_tempfileobj(url, required_hashes=None,
-                                required_length=None):
+                                required_length=None, temporary_directory=None,
+                                compression=None, uncompressed_length=None,
+                                validators=None, cancel_event=None):
   """
   <Purpose>
     Given the url, hashes and length of the desired file, this function 
@@ -333,9 +1069,54 @@ def download_url_to_tempfileobj(url, required_hashes=None,
   
     required_length:
       An integer value representing the length of the file.
+
+    temporary_directory:
+      An optional directory in which to store the downloaded data (see
+      'tuf.util.TempFile').  If it is on the same filesystem as the file's
+      final location, the verified file can be renamed, rather than copied,
+      into place.
+
+    compression:
+      If set, the file is compressed with this compression (see
+      'tuf.util.register_compression()'), and is decompressed as it is
+      downloaded: the returned file holds the decompressed data.
+      'required_hashes' and 'required_length' are those of the compressed
+      file, and are checked against the downloaded bytes.
+
+    uncompressed_length:
+      If 'compression' is set, the trusted length of the decompressed file, or
+      None.  The download fails if the decompressed data is longer, or
+      shorter.
+
+    validators:
+      An optional dictionary conformant to 'tuf.formats.VALIDATORS_SCHEMA'.
+      If set, the request is conditional on the entity tag ('etag') and the
+      modification time ('last_modified') that the server sent with the copy
+      of the file the caller already has: they are sent in 'If-None-Match'
+      and 'If-Modified-Since' headers.  If the server replies '304 Not
+      Modified', None is returned.  Otherwise, 'validators' is replaced with
+      the validators sent with the downloaded file.  Pass an empty dictionary
+      to record the validators of an unconditional request.
+
+    cancel_event:
+      An optional 'threading.Event', which another thread may set to cancel
+      the download (e.g., a request for a file that has already been
+      downloaded from another mirror).  It is checked before each block of
+      data is read.  A cancelled download closes its connection, rather than
+      returning it to the connection pool, and raises tuf.DownloadError.  It
+      is not recorded as a failure of the mirror.
+
+    If 'tuf.conf.partial_download_directory' is set and both the hashes and
+    the length of the file are known, the download is resumable: the data is
+    stored in a partial download spool in that directory, which is kept if
+    the download is interrupted and continued by the next download of the
+    same file (see '_resume_download()').  'temporary_directory' is then
+    ignored.  Downloads that are decompressed or conditional are not
+    resumable, nor is a download of the same file as another resumable
+    download in progress.
   
   <Side Effects>
-    'tuf.util.TempFile' object is created.
+    'tuf.util.TempFile' object is created.  'validators' is updated.
  
   <Exceptions>
     tuf.DownloadError, if there was an error while downloading the file.
@@ -343,7 +1124,8 @@ def download_url_to_tempfileobj(url, required_hashes=None,
     tuf.FormatError, if any of the arguments are improperly formatted. 
  
   <Returns>
-    'tuf.util.TempFile' instance.
+    'tuf.util.TempFile' instance, or None if 'validators' is set and the file
+    has not been modified.
 
   """
 
@@ -354,14 +1136,81 @@ def download_url_to_tempfileobj(url, required_hashes=None,
     tuf.formats.HASHDICT_SCHEMA.check_match(required_hashes)
   if required_length is not None:
     tuf.formats.LENGTH_SCHEMA.check_match(required_length)
+  if temporary_directory is not None:
+    tuf.formats.PATH_SCHEMA.check_match(temporary_directory)
+  if compression is not None:
+    tuf.formats.NAME_SCHEMA.check_match(compression)
+  if uncompressed_length is not None:
+    tuf.formats.LENGTH_SCHEMA.check_match(uncompressed_length)
+  if validators is not None:
+    tuf.formats.VALIDATORS_SCHEMA.check_match(validators)
 
   # 'url.replace()' is for compatibility with Windows-based systems because they 
   # might put back-slashes in place of forward-slashes.  This converts it to the
   # common format. 
   url = url.replace('\\','/')
   logger.info('Downloading: '+url)
-  connection = _open_connection(url)
-  temp_file = tuf.util.TempFile()
+
+  if tuf.conf.partial_download_directory is not None and \
+     required_hashes is not None and required_length is not None and \
+     compression is None and validators is None:
+    partial_filepath = _get_partial_download_filepath(required_hashes,
+                                                      required_length)
+    _partial_downloads_lock.acquire()
+    try:
+      spool_in_use = partial_filepath in _partial_downloads
+      _partial_downloads.add(partial_filepath)
+    finally:
+      _partial_downloads_lock.release()
+
+    if not spool_in_use:
+      try:
+        return _resume_download(url, required_hashes, required_length,
+                                partial_filepath, cancel_event)
+      finally:
+        _partial_downloads_lock.acquire()
+        try:
+          _partial_downloads.discard(partial_filepath)
+        finally:
+          _partial_downloads_lock.release()
+
+    logger.info('The partial download spool of '+url+' is in use.  '+\
+                'Downloading it without the spool.')
+
+  # Raise 'tuf.Error' if 'compression' is not supported, before connecting.
+  if compression is not None:
+    tuf.util.get_decompressor(compression)
+
+  # The latency, throughput and failures of the download are recorded by
+  # 'tuf.mirrors', which uses them to order the mirrors of later downloads.
+  # Only connection errors and server errors count as failures (see
+  # '_open_connection()'): a missing or invalid file is not the fault of a
+  # mirror that is up.
+  extra_headers = {}
+  if validators is not None:
+    extra_headers = _get_conditional_headers(validators)
+  start_time = time.time()
+  connection = _open_connection(url, extra_headers)
+  latency = time.time() - start_time
+
+  # The copy of the file the caller has is still current.  Read the (empty)
+  # body, so that the connection may be reused.
+  if _get_response_status(connection) == 304:
+    try:
+      connection.read()
+    finally:
+      connection.close()
+    logger.info(url+' has not been modified.')
+    tuf.mirrors.record_download(url, latency, 0, 0)
+    return None
+
+  temp_file = tuf.util.TempFile(directory=temporary_directory)
+
+  # The downloaded data goes through 'writer', which decompresses it into
+  # 'temp_file' if the file is compressed.
+  writer = temp_file
+  if compression is not None:
+    writer = _DecompressingWriter(temp_file, compression, uncompressed_length)
 
 
   try:
@@ -396,24 +1245,46 @@ def download_url_to_tempfileobj(url, required_hashes=None,
                 ', got '+str(file_length)+' bytes.'
       raise tuf.DownloadError(message)
 
+    # The hashes are computed while the file is downloaded, so that the file
+    # is never read back for verification.
+    digest_objects = None
+    if required_length is not None and required_hashes is not None:
+      digest_objects = _get_digest_objects(required_hashes)
+
     # For readibility, we perform the download in a separate function, which
     # returns the total number of downloaded bytes; this number should be equal
     # to required_length. 
-    total_downloaded = _download_fixed_amount_of_data(connection, temp_file,
+    total_downloaded = _download_fixed_amount_of_data(connection, writer,
                                                       file_length,
-                                                      required_length)
+                                                      required_length,
+                                                      digest_objects,
+                                                      cancel_event)
+    transfer_time = time.time() - start_time - latency
  
-    # We appear to have downloaded the correct amount.  Check the hashes.
-    if required_length is not None and required_hashes is not None: 
-      _check_hashes(temp_file, required_hashes)
+    # We appear to have downloaded the correct amount.  Check the hashes of
+    # the downloaded bytes, and then the length of the decompressed data.
+    if digest_objects is not None:
+      _check_hashes(digest_objects, required_hashes)
+    if compression is not None:
+      writer.finish()
 
   # Exception is a base class for all non-exiting exceptions.
   except Exception, e:
     # Closing 'temp_file'.  The 'temp_file' data is destroyed.
     temp_file.close_temp_file()
+    # The connection may not have been closed if the download was abandoned
+    # before any data was read.
+    connection.close()
+    if _is_connection_error(e):
+      tuf.mirrors.record_failure(url)
     logger.error(str(e))
     raise tuf.DownloadError(e)
 
+  if validators is not None:
+    validators.clear()
+    validators.update(_get_validators(connection))
+
+  tuf.mirrors.record_download(url, latency, total_downloaded, transfer_time)
   return temp_file
 
 
@@ -63,7 +63,6 @@
 
 import binascii
 import calendar
-import re
 import string
 import time
 
@@ -123,6 +122,7 @@ LENGTH_SCHEMA = SCHEMA.Integer(lo=0)
 
 # A string representing a named object.
 NAME_SCHEMA = SCHEMA.AnyString()
+NAMES_SCHEMA = SCHEMA.ListOf(NAME_SCHEMA)
 
 # A value that is either True or False, on or off, etc.
 TOGGLE_SCHEMA = SCHEMA.Boolean()
@@ -132,6 +132,14 @@ TOGGLE_SCHEMA = SCHEMA.Boolean()
 # Must be 1 and greater.
 THRESHOLD_SCHEMA = SCHEMA.Integer(lo=1)
 
+# The number of bytes read or written at a time when transferring data.
+# Must be 1 and greater.
+BLOCK_SIZE_SCHEMA = SCHEMA.Integer(lo=1)
+
+# The number of worker threads or processes used to perform a task
+# concurrently.  Must be 1 and greater.
+WORKERS_SCHEMA = SCHEMA.Integer(lo=1)
+
 # A string representing a role's name. 
 ROLENAME_SCHEMA = SCHEMA.AnyString()
 
@@ -221,6 +229,10 @@ SIGNABLE_SCHEMA = SCHEMA.Object(
   signed=SCHEMA.Any(),
   signatures=SCHEMA.ListOf(SIGNATURE_SCHEMA))
 
+# The canonical JSON encoding of an object (see encode_canonical()), such as
+# the 'signed' object of a signable.
+ENCODED_CANONICAL_SCHEMA = SCHEMA.AnyString()
+
 # A dict where the dict keys hold a keyid and the dict values a key object.
 KEYDICT_SCHEMA = SCHEMA.DictOf(
   key_schema=KEYID_SCHEMA,
@@ -342,6 +354,39 @@ MIRRORDICT_SCHEMA = SCHEMA.DictOf(
   key_schema=SCHEMA.AnyString(),
   value_schema=MIRROR_SCHEMA)
 
+# The statistics 'tuf.mirrors' keeps about a mirror: the moving averages of
+# its latency (in milliseconds) and throughput (in bytes per second), if
+# measured, its number of consecutive failures, and the time (in seconds since
+# the epoch) until which it is backed off from.
+MIRRORSTATISTICS_SCHEMA = SCHEMA.Object(
+  object_name='mirror statistics',
+  latency=SCHEMA.Optional(LENGTH_SCHEMA),
+  throughput=SCHEMA.Optional(LENGTH_SCHEMA),
+  failures=LENGTH_SCHEMA,
+  retry_after=LENGTH_SCHEMA)
+
+# The statistics of every mirror, keyed by the 'scheme://host:port' of the
+# mirror.  Saved to 'tuf.conf.mirror_statistics_file'.
+MIRRORSTATISTICSDICT_SCHEMA = SCHEMA.DictOf(
+  key_schema=SCHEMA.AnyString(),
+  value_schema=MIRRORSTATISTICS_SCHEMA)
+
+# The HTTP validators of a downloaded file (see 'tuf.download'): the entity
+# tag and the modification time the server sent with it, if any.
+VALIDATORS_SCHEMA = SCHEMA.Object(
+  object_name='validators',
+  etag=SCHEMA.Optional(SCHEMA.AnyString()),
+  last_modified=SCHEMA.Optional(SCHEMA.AnyString()))
+
+# The validators of metadata files, keyed by metadata filename and then by
+# the url the file was downloaded from.  Saved by the updater to
+# 'metadata/validators' (see 'tuf.conf.conditional_metadata_requests').
+VALIDATORSDICT_SCHEMA = SCHEMA.DictOf(
+  key_schema=RELPATH_SCHEMA,
+  value_schema=SCHEMA.DictOf(
+    key_schema=URL_SCHEMA,
+    value_schema=VALIDATORS_SCHEMA))
+
 # A Mirrorlist: indicates all the live mirrors, and what documents they
 # serve.
 MIRRORLIST_SCHEMA = SCHEMA.Object(
@@ -351,6 +396,14 @@ MIRRORLIST_SCHEMA = SCHEMA.Object(
   expires=TIME_SCHEMA,
   mirrors=SCHEMA.ListOf(MIRROR_SCHEMA))
 
+# Compile the schemas above (see 'tuf.schema.compile_schema()'), as objects
+# such as role metadata, lists of targets and mirror dictionaries are checked
+# against them on the hot paths of the client.
+for _name, _schema in globals().items():
+  if _name.endswith('_SCHEMA') and isinstance(_schema, SCHEMA.Schema):
+    _schema.compile()
+del _name, _schema
+
 
 
 
@@ -1026,7 +1079,8 @@ def check_signable_object_format(object):
 def _canonical_string_encoder(string):
   """
   <Purpose>
-    Encode 'string' to canonical string format.
+    Encode 'string' to canonical string format.  Only quote and backslash
+    are escaped, so the common string that contains neither is copied as is.
     
   <Arguments>
     string:
@@ -1043,7 +1097,9 @@ def _canonical_string_encoder(string):
 
   """
 
-  string = '"%s"' % re.sub(r'(["\\])', r'\\\1', string)
+  if '\\' in string or '"' in string:
+    string = string.replace('\\', '\\\\').replace('"', '\\"')
+  string = '"' + string + '"'
   if isinstance(string, unicode):
     return string.encode('utf-8')
   else:
@@ -1053,43 +1109,22 @@ def _canonical_string_encoder(string):
 
 
 
-def _encode_canonical(object, output_function):
-  # Helper for encode_canonical.  Older versions of json.encoder don't
-  # even let us replace the separators.
+def _encode_canonical_scalar(object):
+  # Helper for _encode_canonical.  Return the canonical encoding of 'object',
+  # or None if 'object' is a list, tuple or dict.
 
   if isinstance(object, basestring):
-    output_function(_canonical_string_encoder(object))
+    return _canonical_string_encoder(object)
   elif object is True:
-    output_function("true")
+    return 'true'
   elif object is False:
-    output_function("false")
+    return 'false'
   elif object is None:
-    output_function("null")
+    return 'null'
   elif isinstance(object, (int, long)):
-    output_function(str(object))
-  elif isinstance(object, (tuple, list)):
-    output_function("[")
-    if len(object):
-      for item in object[:-1]:
-        _encode_canonical(item, output_function)
-        output_function(",")
-      _encode_canonical(object[-1], output_function)
-    output_function("]")
-  elif isinstance(object, dict):
-    output_function("{")
-    if len(object):
-      items = object.items()
-      items.sort()
-      for key, value in items[:-1]:
-        output_function(_canonical_string_encoder(key))
-        output_function(":")
-        _encode_canonical(value, output_function)
-        output_function(",")
-      key, value = items[-1]
-      output_function(_canonical_string_encoder(key))
-      output_function(":")
-      _encode_canonical(value, output_function)
-    output_function("}")
+    return str(object)
+  elif isinstance(object, (tuple, list, dict)):
+    return None
   else:
     raise tuf.FormatError('I cannot encode '+repr(object))
 
@@ -1097,6 +1132,103 @@ def _encode_canonical(object, output_function):
 
 
 
+def _encode_canonical_container(object):
+  # Helper for _encode_canonical.  Return an iterator over the items of the
+  # non-empty list, tuple or dict 'object', as (prefix, value) pairs where
+  # 'prefix' is the encoded text that precedes 'value', and the closing text.
+
+  if isinstance(object, dict):
+    keys = object.keys()
+    keys.sort()
+    prefixes = []
+    append = prefixes.append
+    for key in keys:
+      key_type = type(key)
+      if key_type is str and '\\' not in key and '"' not in key:
+        append(',"' + key + '":')
+      elif key_type is unicode and u'\\' not in key and u'"' not in key:
+        append((u',"' + key + u'":').encode('utf-8'))
+      # Dictionary keys must be strings.
+      elif isinstance(key, basestring):
+        append(',' + _canonical_string_encoder(key) + ':')
+      else:
+        raise TypeError('expected string or buffer')
+    prefixes[0] = '{' + prefixes[0][1:]
+    return iter(zip(prefixes, map(object.__getitem__, keys))), '}'
+
+  else:
+    prefixes = [','] * len(object)
+    prefixes[0] = '['
+    return iter(zip(prefixes, object)), ']'
+
+
+
+
+
+def _encode_canonical(object):
+  # Helper for encode_canonical.  Older versions of json.encoder don't
+  # even let us replace the separators.
+  #
+  # Return the list of encoded parts of 'object'.  Nested lists and dicts are
+  # encoded iteratively, with an explicit stack of the items that remain to
+  # be encoded in each enclosing container.  Strings and integers, the bulk
+  # of TUF metadata, are encoded inline.
+
+  parts = []
+  append = parts.append
+
+  encoded = _encode_canonical_scalar(object)
+  if encoded is not None:
+    return [encoded]
+
+  stack = []
+  if object:
+    stack.append(_encode_canonical_container(object))
+  else:
+    append('{}' if isinstance(object, dict) else '[]')
+
+  while stack:
+    items, closing = stack[-1]
+    for prefix, value in items:
+      append(prefix)
+      value_type = type(value)
+      if value_type is str:
+        if '\\' in value or '"' in value:
+          value = value.replace('\\', '\\\\').replace('"', '\\"')
+        append('"' + value + '"')
+      elif value_type is unicode:
+        # Metadata loaded from JSON holds unicode strings.
+        if u'\\' in value or u'"' in value:
+          value = value.replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+        append((u'"' + value + u'"').encode('utf-8'))
+      elif value_type is int:
+        append(str(value))
+      elif value_type is dict or value_type is list:
+        if value:
+          # Encode the nested container before the remaining items.
+          stack.append(_encode_canonical_container(value))
+          break
+        append('{}' if value_type is dict else '[]')
+      else:
+        encoded = _encode_canonical_scalar(value)
+        if encoded is not None:
+          append(encoded)
+        elif not value:
+          append('{}' if isinstance(value, dict) else '[]')
+        else:
+          # Encode the nested container before the remaining items.
+          stack.append(_encode_canonical_container(value))
+          break
+    else:
+      append(closing)
+      stack.pop()
+
+  return parts
+
+
+
+
+
 def encode_canonical(object, output_function=None):
   """
   <Purpose>
@@ -1104,9 +1236,9 @@ def encode_canonical(object, output_function=None):
     http://wiki.laptop.org/go/Canonical_JSON .  It's a restricted
     dialect of JSON in which keys are always lexically sorted,
     there is no whitespace, floats aren't allowed, and only quote
-    and backslash get escaped.  The result is encoded in UTF-8,
-    and the resulting bits are passed to output_function (if provided),
-    or joined into a string and returned.
+    and backslash get escaped.  The result is encoded in UTF-8, built
+    in a single string, and passed to output_function (if provided) or
+    returned.
 
     Note: This function should be called prior to computing the hash or
     signature of a JSON object in TUF.  For example, generating a signature
@@ -1148,15 +1280,12 @@ def encode_canonical(object, output_function=None):
 
   """
 
-  result = None
-  # If 'output_function' is unset, treat it as
-  # appending to a list.
-  if output_function is None:
-    result = []
-    output_function = result.append
-
+  # The encoded parts of 'object' are joined into a single string, which is
+  # returned or, if 'output_function' is set, passed to it at once.
   try:
-    _encode_canonical(object, output_function)
+    result = ''.join(_encode_canonical(object))
+    if output_function is not None:
+      output_function(result)
   except TypeError, e:
     message = 'Could not encode '+repr(object)+': '+str(e)
     raise tuf.FormatError(message)
@@ -1164,8 +1293,8 @@ def encode_canonical(object, output_function=None):
   # Return the encoded 'object' as a string.
   # Note: Implies 'output_function' is None,
   # otherwise results are sent to 'output_function'.
-  if result is not None:
-    return ''.join(result)
+  if output_function is None:
+    return result
 
 
 
@@ -18,16 +18,20 @@
   available to TUF, simplifying the creation of digest objects, and
   providing a central location for hash routines are the main goals
   of this module.  Support routines implemented include functions to 
-  create digest objects given a filename or file object.
+  create digest objects given a filename or file object, and to hash many
+  files concurrently.
   Hashlib and pycrypto hash algorithms currently supported.
 
 """
 
 
 import logging
+import multiprocessing.pool
 
 # Import tuf Exceptions.
 import tuf
+import tuf.conf
+import tuf.formats
 import tuf.log
 
 # Import tuf logger to log warning messages.
@@ -76,6 +80,11 @@ if not _supported_libraries:
 _DEFAULT_HASH_ALGORITHM = 'sha256'
 _DEFAULT_HASH_LIBRARY = 'hashlib'
 
+# The number of bytes read from a file at a time by digest_filenames().
+# Hashlib releases the global interpreter lock while it hashes blocks of this
+# size, so that files can be hashed concurrently by threads.
+_FILE_BLOCK_SIZE = 65536
+
 
 
 
@@ -270,6 +279,118 @@ def digest_filename(filename, algorithm=_DEFAULT_HASH_ALGORITHM,
 
 
 
+def _digest_filename_with_algorithms(filename, algorithms, hash_library):
+  """
+  <Purpose>
+    Hash 'filename' with each algorithm in 'algorithms', reading the file
+    once.  A helper of digest_filenames().
+
+  <Arguments>
+    filename:
+      The path of the file.
+
+    algorithms:
+      A list of hash algorithms (e.g., md5, sha1, sha256).
+
+    hash_library:
+      The library providing the hash algorithms.
+
+  <Exceptions>
+    tuf.UnsupportedAlgorithmError
+    tuf.Error
+
+  <Side Effects>
+    The file is read.
+
+  <Returns>
+    A dictionary with the algorithms as keys and the hexdigests as values, or
+    None if the file could not be read.
+
+  """
+
+  digest_objects = {}
+  for algorithm in algorithms:
+    digest_objects[algorithm] = digest(algorithm, hash_library)
+
+  try:
+    file_object = open(filename, 'rb')
+    try:
+      while True:
+        data = file_object.read(_FILE_BLOCK_SIZE)
+        if not data:
+          break
+        for digest_object in digest_objects.values():
+          digest_object.update(data)
+    finally:
+      file_object.close()
+  except IOError, e:
+    logger.debug('Could not hash '+repr(filename)+': '+str(e))
+    return None
+
+  hexdigests = {}
+  for algorithm, digest_object in digest_objects.items():
+    hexdigests[algorithm] = digest_object.hexdigest()
+  return hexdigests
+
+
+
+
+
+def digest_filenames(jobs, hash_library=_DEFAULT_HASH_LIBRARY):
+  """
+  <Purpose>
+    Hash many files, each with its own list of hash algorithms.  Each file is
+    read once, for all of its algorithms.  Up to 'tuf.conf.hash_workers'
+    files are hashed concurrently, by a pool of threads; the hash libraries
+    release the global interpreter lock while hashing, so the work is spread
+    across cores.
+
+  <Arguments>
+    jobs:
+      A list of (filename, algorithms) tuples, where 'algorithms' is a list
+      of hash algorithms (e.g., md5, sha1, sha256).
+
+    hash_library:
+      The library providing the hash algorithms 
+      (e.g., pycrypto, hashlib).
+
+  <Exceptions>
+    tuf.FormatError, if 'tuf.conf.hash_workers' is not a positive integer.
+
+    tuf.UnsupportedAlgorithmError
+    tuf.Error
+
+  <Side Effects>
+    The files are read.
+
+  <Returns>
+    A list with an item for each job, in order: a dictionary with the job's
+    algorithms as keys and the hexdigests as values, or None if the file
+    could not be read (e.g., it does not exist).
+
+  """
+
+  max_workers = tuf.conf.hash_workers
+  tuf.formats.WORKERS_SCHEMA.check_match(max_workers)
+
+  def hash_file(job):
+    filename, algorithms = job
+    return _digest_filename_with_algorithms(filename, algorithms, hash_library)
+
+  if max_workers == 1 or len(jobs) < 2:
+    return [hash_file(job) for job in jobs]
+
+  pool = multiprocessing.pool.ThreadPool(min(max_workers, len(jobs)))
+  try:
+    return pool.map(hash_file, jobs, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+
+
+
+
 def data_to_string(data):
   """
   <Purpose>
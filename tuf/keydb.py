@@ -41,6 +41,15 @@ logger = logging.getLogger('tuf.keydb')
 # The key database.
 _keydb_dict = {}
 
+# The parsed public keys of the keys in the key database, keyed by keyid.  See
+# get_verification_key().
+_verification_key_dict = {}
+
+# Incremented whenever the key database is modified, so that results derived
+# from its keys (e.g., the signature verification results cached by 'tuf.sig')
+# can be discarded.  See get_keydb_generation().
+_keydb_generation = 0
+
 
 def create_keydb_from_root_metadata(root_metadata):
   """
@@ -78,7 +87,7 @@ def create_keydb_from_root_metadata(root_metadata):
   tuf.formats.ROOT_SCHEMA.check_match(root_metadata)
 
   # Clear the key database.
-  _keydb_dict.clear()
+  clear_keydb()
 
   # Iterate through the keys found in 'root_metadata' by converting
   # them to 'RSAKEY_SCHEMA' if their type is 'rsa', and then
@@ -134,7 +143,8 @@ def add_rsakey(rsakey_dict, keyid=None):
     tuf.KeyAlreadyExistsError, if 'rsakey_dict' is found in the key database.
 
   <Side Effects>
-    The keydb key database is modified.
+    The keydb key database is modified.  The generation of the key database
+    changes.  The public key is parsed.
 
   <Returns>
     None.
@@ -164,6 +174,16 @@ def add_rsakey(rsakey_dict, keyid=None):
     raise tuf.KeyAlreadyExistsError('Key: '+keyid)
  
   _keydb_dict[keyid] = rsakey_dict
+  _increment_keydb_generation()
+
+  # Parse the public key once, rather than for every signature verified with
+  # it.  A key that cannot be parsed is still added; verifying a signature
+  # with it reports the error.
+  try:
+    _verification_key_dict[keyid] = \
+      tuf.rsa_key.create_verification_key(rsakey_dict)
+  except tuf.CryptoError, e:
+    logger.warn(e)
 
 
 
@@ -225,7 +245,8 @@ def remove_key(keyid):
     tuf.UnknownKeyError, if 'keyid' is not found in key database.
 
   <Side Effects>
-    The key, identified by 'keyid', is deleted from the key database.
+    The key, identified by 'keyid', is deleted from the key database and its
+    parsed public key freed.  The generation of the key database changes.
 
   <Returns>
     None.
@@ -241,6 +262,10 @@ def remove_key(keyid):
   # Remove the key belonging to 'keyid' if found in the key database.
   if keyid in _keydb_dict: 
     del _keydb_dict[keyid]
+    # The parsed public key is freed once it is no longer referenced, i.e.,
+    # at once unless a signature is being verified with it.
+    _verification_key_dict.pop(keyid, None)
+    _increment_keydb_generation()
   else:
     raise tuf.UnknownKeyError('Key: '+keyid)
 
@@ -260,7 +285,8 @@ def clear_keydb():
     None.
 
   <Side Effects>
-    The keydb key database is reset.
+    The keydb key database is reset and the parsed public keys freed.  The
+    generation of the key database changes.
 
   <Returns>
     None.
@@ -268,3 +294,72 @@ def clear_keydb():
   """
   
   _keydb_dict.clear()
+  _verification_key_dict.clear()
+  _increment_keydb_generation()
+
+
+
+
+
+def get_verification_key(keyid):
+  """
+  <Purpose>
+    Return the parsed public key of the key belonging to 'keyid', created by
+    'tuf.rsa_key.create_verification_key()' when the key was added, so that
+    signatures can be verified without parsing the PEM-formatted key again.
+
+  <Arguments>
+    keyid:
+      An object conformant to 'tuf.formats.KEYID_SCHEMA'.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    An 'evpy.signature.VerificationKey' object, or None if there is no
+    parsed public key for 'keyid'.
+
+  """
+
+  return _verification_key_dict.get(keyid)
+
+
+
+
+
+def get_keydb_generation():
+  """
+  <Purpose>
+    Return the generation of the key database, a number that changes whenever
+    a key is added or removed or the database is cleared.  A result computed
+    with the keys of one generation (e.g., a signature verification result)
+    may not be valid for another.
+
+  <Arguments>
+    None.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    An integer.
+
+  """
+
+  return _keydb_generation
+
+
+
+
+
+def _increment_keydb_generation():
+  """Mark the key database as modified.  See get_keydb_generation()."""
+
+  global _keydb_generation
+  _keydb_generation = _keydb_generation + 1
@@ -16,19 +16,60 @@
   To extract a list of mirror urls corresponding to the file type and
   the location of the file with respect to the base url.
 
+  The list is ordered by how well each mirror has performed so far.  The
+  download module records the latency and throughput of every download with
+  record_download(), and downloads that failed because the mirror could not
+  be connected to or reported a server error with record_failure().  Mirrors
+  that recently failed are backed off from for an increasing period of time.
+  The statistics may be saved to, and loaded from, the file set by
+  'tuf.conf.mirror_statistics_file'.
+
 """
 
 import os
+import time
 import urllib
+import logging
+import threading
 
 import tuf
+import tuf.conf
 import tuf.util
 import tuf.formats
 
+from tuf.compatibility import urlparse
+
+# See 'log.py' to learn how logging is handled in TUF.
+logger = logging.getLogger('tuf.mirrors')
+
 # The type of file to be downloaded from a repository.  The
 # 'get_list_of_mirrors' function supports these file types.
 _SUPPORTED_FILE_TYPES = ['meta', 'target']
 
+# The weight given to a new latency or throughput measurement in the
+# exponentially weighted moving averages kept for each mirror.
+_EWMA_WEIGHT = 0.3
+
+# The number of seconds a mirror is backed off from after its first failure.
+# The period doubles with every consecutive failure, up to _MAX_BACKOFF.
+_INITIAL_BACKOFF = 30
+_MAX_BACKOFF = 3600
+
+# Mirrors are ranked by the estimated time to download a file of this many
+# bytes, i.e., their average latency plus the time to transfer the file at
+# their average throughput.
+_REFERENCE_LENGTH = 65536
+
+# The statistics of each mirror host, keyed by 'scheme://host:port'.  Each
+# value is a dictionary conformant to 'tuf.formats.MIRRORSTATISTICS_SCHEMA'.
+# Downloads may be performed by several threads at once, so the statistics are
+# guarded by '_mirror_statistics_lock'.
+_mirror_statistics = {}
+_mirror_statistics_lock = threading.Lock()
+
+# The file the statistics in '_mirror_statistics' were loaded from, if any.
+_mirror_statistics_file = None
+
 
 def get_list_of_mirrors(file_type, file_path, mirrors_dict):
   """
@@ -113,4 +154,323 @@ def get_list_of_mirrors(file_type, file_path, mirrors_dict):
     url = base+'/'+file_path
     list_of_mirrors.append(url)
 
-  return list_of_mirrors
+  return order_mirrors(list_of_mirrors)
+
+
+
+
+
+def _get_mirror_key(url):
+  """Return the 'scheme://host:port' of 'url', which identifies its mirror."""
+
+  parsed_url = urlparse.urlparse(url)
+  return parsed_url.scheme+'://'+parsed_url.netloc
+
+
+
+
+
+def _load_mirror_statistics():
+  """
+  <Purpose>
+    Load the mirror statistics saved to 'tuf.conf.mirror_statistics_file', if
+    it is set and they have not been loaded already.  The caller must hold
+    '_mirror_statistics_lock'.
+
+  <Arguments>
+    None.
+
+  <Exceptions>
+    None.  An invalid statistics file is logged and ignored.
+
+  <Side Effects>
+    '_mirror_statistics' is updated.
+
+  <Returns>
+    None.
+
+  """
+
+  global _mirror_statistics_file
+
+  statistics_file = tuf.conf.mirror_statistics_file
+  if statistics_file is None or statistics_file == _mirror_statistics_file:
+    return
+  _mirror_statistics_file = statistics_file
+
+  if not os.path.exists(statistics_file):
+    return
+
+  try:
+    saved_statistics = tuf.util.load_json_file(statistics_file)
+    tuf.formats.MIRRORSTATISTICSDICT_SCHEMA.check_match(saved_statistics)
+  except (tuf.Error, ValueError, IOError), e:
+    logger.warn('Ignoring mirror statistics '+repr(statistics_file)+': '+\
+                str(e))
+    return
+
+  # Statistics measured during this run take precedence.  Averages that were
+  # not measured are not saved.
+  for mirror_key, statistics in saved_statistics.items():
+    statistics.setdefault('latency', None)
+    statistics.setdefault('throughput', None)
+    _mirror_statistics.setdefault(mirror_key, statistics)
+
+
+
+
+
+def _get_statistics(mirror_key):
+  """Return the statistics of 'mirror_key', which the caller may update.
+  The caller must hold '_mirror_statistics_lock'."""
+
+  _load_mirror_statistics()
+  return _mirror_statistics.setdefault(mirror_key, {'latency': None,
+                                                    'throughput': None,
+                                                    'failures': 0,
+                                                    'retry_after': 0})
+
+
+
+
+
+def _moving_average(average, measurement):
+  """Return the new (integer) moving average after 'measurement'."""
+
+  if average is not None:
+    measurement = _EWMA_WEIGHT * measurement + (1 - _EWMA_WEIGHT) * average
+  return int(round(measurement))
+
+
+
+
+
+def record_download(url, latency, length, transfer_time):
+  """
+  <Purpose>
+    Record a successful download from 'url' in the statistics of its mirror.
+    The mirror's failures, if any, are forgiven.
+
+  <Arguments>
+    url:
+      The url of the downloaded file.
+
+    latency:
+      The number of seconds it took for the server to start responding.
+
+    length:
+      The number of bytes downloaded.
+
+    transfer_time:
+      The number of seconds it took to download 'length' bytes.
+
+  <Exceptions>
+    tuf.FormatError, if 'url' is improperly formatted.
+
+  <Side Effects>
+    The statistics of the mirror of 'url' are updated.
+
+  <Returns>
+    None.
+
+  """
+
+  tuf.formats.URL_SCHEMA.check_match(url)
+
+  mirror_key = _get_mirror_key(url)
+  _mirror_statistics_lock.acquire()
+  try:
+    statistics = _get_statistics(mirror_key)
+    statistics['latency'] = _moving_average(statistics['latency'],
+                                            latency * 1000)
+    if length and transfer_time > 0:
+      statistics['throughput'] = _moving_average(statistics['throughput'],
+                                                 length / transfer_time)
+    statistics['failures'] = 0
+    statistics['retry_after'] = 0
+  finally:
+    _mirror_statistics_lock.release()
+
+
+
+
+
+def record_failure(url):
+  """
+  <Purpose>
+    Record a failed download from 'url' in the statistics of its mirror.  The
+    mirror is moved to the end of the lists returned by order_mirrors() for
+    a back-off period that doubles with every consecutive failure.  When the
+    period expires, the mirror is ranked as before and so probed again.
+
+  <Arguments>
+    url:
+      The url of the file that could not be downloaded.
+
+  <Exceptions>
+    tuf.FormatError, if 'url' is improperly formatted.
+
+  <Side Effects>
+    The statistics of the mirror of 'url' are updated.
+
+  <Returns>
+    None.
+
+  """
+
+  tuf.formats.URL_SCHEMA.check_match(url)
+
+  mirror_key = _get_mirror_key(url)
+  _mirror_statistics_lock.acquire()
+  try:
+    statistics = _get_statistics(mirror_key)
+    statistics['failures'] = statistics['failures'] + 1
+    backoff = min(_INITIAL_BACKOFF * 2 ** (statistics['failures'] - 1),
+                  _MAX_BACKOFF)
+    statistics['retry_after'] = int(time.time()) + backoff
+  finally:
+    _mirror_statistics_lock.release()
+
+  logger.info('Backing off from '+mirror_key+' for '+str(backoff)+' seconds.')
+
+
+
+
+
+def order_mirrors(urls):
+  """
+  <Purpose>
+    Order 'urls' so that the mirrors expected to serve them fastest come
+    first.  Mirrors are ranked by their average latency plus the time to
+    transfer '_REFERENCE_LENGTH' bytes at their average throughput.  Mirrors
+    without statistics are ranked first, so that they are measured, and
+    mirrors that are being backed off from are ranked last.  Ties keep the
+    order of 'urls'.
+
+  <Arguments>
+    urls:
+      A list of urls, one per mirror, for the same file.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    Saved mirror statistics may be loaded.
+
+  <Returns>
+    A new list containing the urls in 'urls'.
+
+  """
+
+  now = time.time()
+  ranked_urls = []
+
+  _mirror_statistics_lock.acquire()
+  try:
+    _load_mirror_statistics()
+    for index, url in enumerate(urls):
+      statistics = _mirror_statistics.get(_get_mirror_key(url))
+      backed_off = False
+      estimated_time = 0
+      if statistics is not None:
+        backed_off = statistics['retry_after'] > now
+        if statistics['latency'] is not None:
+          estimated_time = statistics['latency'] / 1000.0
+        if statistics['throughput']:
+          estimated_time = estimated_time + \
+            _REFERENCE_LENGTH / float(statistics['throughput'])
+      ranked_urls.append((backed_off, estimated_time, index, url))
+  finally:
+    _mirror_statistics_lock.release()
+
+  ranked_urls.sort()
+  return [url for backed_off, estimated_time, index, url in ranked_urls]
+
+
+
+
+
+def save_mirror_statistics():
+  """
+  <Purpose>
+    Save the statistics of all mirrors to 'tuf.conf.mirror_statistics_file',
+    so that later runs may order mirrors without measuring them again.  Does
+    nothing if 'tuf.conf.mirror_statistics_file' is not set.
+
+  <Arguments>
+    None.
+
+  <Exceptions>
+    None.  Failures to write the file are logged.
+
+  <Side Effects>
+    The mirror statistics file is written.
+
+  <Returns>
+    None.
+
+  """
+
+  statistics_file = tuf.conf.mirror_statistics_file
+  if statistics_file is None:
+    return
+
+  _mirror_statistics_lock.acquire()
+  try:
+    _load_mirror_statistics()
+    saved_statistics = {}
+    for mirror_key, statistics in _mirror_statistics.items():
+      saved_statistics[mirror_key] = dict([(name, value) for name, value in
+                                           statistics.items()
+                                           if value is not None])
+  finally:
+    _mirror_statistics_lock.release()
+
+  # Write to a temporary file and rename it, so that a concurrent reader
+  # never sees a partially written file.
+  temporary_file = statistics_file+'.tmp.'+str(os.getpid())
+  try:
+    tuf.util.ensure_parent_dir(statistics_file)
+    file_object = open(temporary_file, 'w')
+    try:
+      json = tuf.util.import_json()
+      json.dump(saved_statistics, file_object, indent=1, sort_keys=True)
+    finally:
+      file_object.close()
+    os.rename(temporary_file, statistics_file)
+  except (IOError, OSError), e:
+    logger.warn('Could not save mirror statistics to '+\
+                repr(statistics_file)+': '+str(e))
+
+
+
+
+
+def clear_mirror_statistics():
+  """
+  <Purpose>
+    Forget the statistics of all mirrors.  Saved statistics are loaded again
+    the next time they are needed.
+
+  <Arguments>
+    None.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    The mirror statistics are cleared.
+
+  <Returns>
+    None.
+
+  """
+
+  global _mirror_statistics_file
+
+  _mirror_statistics_lock.acquire()
+  try:
+    _mirror_statistics.clear()
+    _mirror_statistics_file = None
+  finally:
+    _mirror_statistics_lock.release()
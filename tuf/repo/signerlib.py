@@ -24,6 +24,7 @@ import ConfigParser
 import logging
 
 import tuf
+import tuf.delta
 import tuf.formats
 import tuf.rsa_key
 import tuf.repo.keystore
@@ -155,19 +156,58 @@ def get_metadata_file_info(filename):
   # Raise 'tuf.FormatError' if there is a mismatch.
   tuf.formats.PATH_SCHEMA.check_match(filename)
 
-  if not os.path.isfile(filename):
-    message = repr(filename)+' is not a file.'
-    raise tuf.Error(message)
+  return get_metadata_files_info([filename])[0]
+
+
+
+
+
+def get_metadata_files_info(filenames):
+  """
+  <Purpose>
+    Retrieve the file information, as returned by get_metadata_file_info(),
+    of each file in 'filenames'.  The files are hashed concurrently (see
+    'tuf.conf.hash_workers').
+
+  <Arguments>
+    filenames:
+      The list of files whose file information is needed.
+
+  <Exceptions>
+    tuf.FormatError, if 'filenames' is improperly formatted.
+
+    tuf.Error, if one of 'filenames' doesn't exist.
+
+  <Side Effects>
+    The files are opened and information about them is generated,
+    such as file size and hash.
+
+  <Returns>
+    A list of dictionaries conformant to 'tuf.formats.FILEINFO_SCHEMA', one
+    for each of 'filenames', in order.
+
+  """
+
+  # Does 'filenames' have the correct format?
+  # Raise 'tuf.FormatError' if there is a mismatch.
+  tuf.formats.PATHS_SCHEMA.check_match(filenames)
+
+  for filename in filenames:
+    if not os.path.isfile(filename):
+      message = repr(filename)+' is not a file.'
+      raise tuf.Error(message)
   
   # Note: 'filehashes' is a dictionary of the form
   # {'sha256': 1233dfba312, ...}.  'custom' is an optional
   # dictionary that a client might define to include additional
   # file information, such as the file's author, version/revision
   # numbers, etc.
-  filesize, filehashes = tuf.util.get_file_details(filename)
-  custom = None
+  fileinfos = []
+  for filesize, filehashes in tuf.util.get_files_details(filenames):
+    custom = None
+    fileinfos.append(tuf.formats.make_fileinfo(filesize, filehashes, custom))
 
-  return tuf.formats.make_fileinfo(filesize, filehashes, custom)
+  return fileinfos
 
 
 
@@ -371,21 +411,25 @@ def generate_targets_metadata(repository_directory, target_files, version,
   tuf.formats.METADATAVERSION_SCHEMA.check_match(version)
   tuf.formats.TIME_SCHEMA.check_match(expiration_date)
 
-  filedict = {}
-
   repository_directory = check_directory(repository_directory)
 
   # Generate the file info for all the target files listed in 'target_files'.
+  relative_targetpaths = []
+  target_paths = []
   for target in target_files:
     # Strip 'targets/' from from 'target' and keep the rest (e.g.,
     # 'targets/more_targets/somefile.txt' -> 'more_targets/somefile.txt'
-    relative_targetpath = os.path.sep.join(target.split(os.path.sep)[1:])
+    relative_targetpaths.append(os.path.sep.join(target.split(os.path.sep)[1:]))
     target_path = os.path.join(repository_directory, target)
     if not os.path.exists(target_path):
       message = repr(target_path)+' could not be read.  Unable to generate '+\
         'targets metadata.'
       raise tuf.Error(message)
-    filedict[relative_targetpath] = get_metadata_file_info(target_path)
+    target_paths.append(target_path)
+
+  # The target files are hashed concurrently.
+  fileinfos = get_metadata_files_info(target_paths)
+  filedict = dict(zip(relative_targetpaths, fileinfos))
 
   # Generate the targets metadata object.
   targets_metadata = tuf.formats.TargetsFile.make_metadata(version,
@@ -398,13 +442,17 @@ def generate_targets_metadata(repository_directory, target_files, version,
 
 
 
-def generate_release_metadata(metadata_directory, version, expiration_date):
+def generate_release_metadata(metadata_directory, version, expiration_date,
+                              compressions=()):
   """
   <Purpose>
     Create the release metadata.  The minimum metadata must exist
     (i.e., 'root.txt' and 'targets.txt'). This will also look through
     the 'targets/' directory in 'metadata_directory' and the resulting
-    release file will list all the delegated roles.
+    release file will list all the delegated roles, and the deltas of the
+    Targets metadata built by build_metadata_deltas().  Compressed versions
+    of the Targets metadata are listed too, so that clients may download the
+    smallest one they support.
 
   <Arguments>
     metadata_directory:
@@ -419,11 +467,17 @@ def generate_release_metadata(metadata_directory, version, expiration_date):
       The expiration date, in UTC, of the metadata file.
       Conformant to 'tuf.formats.TIME_SCHEMA'.
 
+    compressions:
+      The names of the compressions (e.g., 'gzip' and 'bz2', see
+      'tuf.util.register_compression()') 'targets.txt' is also saved in (see
+      write_compressed_metadata_files()).  Compressed versions of delegated
+      metadata in the 'targets/' directory are always listed.
+
   <Exceptions>
     tuf.FormatError, if 'metadata_directory' is improperly formatted.
 
     tuf.Error, if an error occurred trying to generate the release metadata
-    object.
+    object, or a compressed version of 'targets.txt' is missing.
 
   <Side Effects>
     The 'root.txt' and 'targets.txt' files are read.
@@ -438,6 +492,7 @@ def generate_release_metadata(metadata_directory, version, expiration_date):
   tuf.formats.PATH_SCHEMA.check_match(metadata_directory)
   tuf.formats.METADATAVERSION_SCHEMA.check_match(version)
   tuf.formats.TIME_SCHEMA.check_match(expiration_date)
+  tuf.formats.NAMES_SCHEMA.check_match(compressions)
 
   metadata_directory = check_directory(metadata_directory)
 
@@ -447,9 +502,21 @@ def generate_release_metadata(metadata_directory, version, expiration_date):
 
   # Retrieve the file info of 'root.txt' and 'targets.txt'.  This file
   # information includes data such as file length, hashes of the file, etc.
-  filedict = {}
-  filedict['root.txt'] = get_metadata_file_info(root_filename)
-  filedict['targets.txt'] = get_metadata_file_info(targets_filename)
+  metadata_names = ['root.txt', 'targets.txt']
+  metadata_paths = [root_filename, targets_filename]
+
+  # Compressed versions of 'targets.txt'.
+  for compression in compressions:
+    metadata_name = tuf.util.get_compressed_filename('targets.txt', compression)
+    metadata_names.append(metadata_name)
+    metadata_paths.append(os.path.join(metadata_directory, metadata_name))
+
+  # Deltas of 'targets.txt' (see build_metadata_deltas()) are listed too.
+  delta_prefix = 'targets.txt' + tuf.delta.DELTA_EXTENSION
+  for basename in sorted(os.listdir(metadata_directory)):
+    if basename.startswith(delta_prefix):
+      metadata_names.append(basename)
+      metadata_paths.append(os.path.join(metadata_directory, basename))
 
   # Walk the 'targets/' directory and generate the file info for all
   # the files listed there.  This information is stored in the 'meta'
@@ -461,7 +528,12 @@ def generate_release_metadata(metadata_directory, version, expiration_date):
       for basename in files:
         metadata_path = os.path.join(directory_path, basename)
         metadata_name = metadata_path[len(metadata_directory):].lstrip(os.path.sep)
-        filedict[metadata_name] = get_metadata_file_info(metadata_path)
+        metadata_names.append(metadata_name)
+        metadata_paths.append(metadata_path)
+
+  # The metadata files are hashed concurrently.
+  fileinfos = get_metadata_files_info(metadata_paths)
+  filedict = dict(zip(metadata_names, fileinfos))
 
   # Generate the release metadata object.
   release_metadata = tuf.formats.ReleaseFile.make_metadata(version,
@@ -493,15 +565,19 @@ def generate_timestamp_metadata(release_filename, version,
       Conformant to 'tuf.formats.TIME_SCHEMA'.
 
     compressions:
-      Compression extensions (e.g., 'gz' and 'tgz').  If 'release.txt' is also
-      saved in compressed form, these compression extensions should be stored
-      in 'compressions' so the compressed timestamp files can be added to the
-      timestamp metadata object.
+      The names of the compressions (e.g., 'gzip' and 'bz2', see
+      'tuf.util.register_compression()').  If 'release.txt' is also saved in
+      compressed form (see write_compressed_metadata_files()), these
+      compressions should be stored in 'compressions' so the compressed
+      release files can be added to the timestamp metadata object.
 
   <Exceptions>
     tuf.FormatError, if the generated timestamp metadata object could
     not be formatted correctly.
 
+    tuf.Error, if a compression is not supported, or a compressed version of
+    'release.txt' is missing.
+
   <Side Effects>
     None.
 
@@ -515,17 +591,21 @@ def generate_timestamp_metadata(release_filename, version,
   tuf.formats.PATH_SCHEMA.check_match(release_filename)
   tuf.formats.METADATAVERSION_SCHEMA.check_match(version)
   tuf.formats.TIME_SCHEMA.check_match(expiration_date)
+  tuf.formats.NAMES_SCHEMA.check_match(compressions)
 
   # Retrieve the file info for the release metadata file.
   # This file information contains hashes, file length, custom data, etc.
   fileinfo = {}
   fileinfo['release.txt'] = get_metadata_file_info(release_filename)
 
-  # Save the file info of the compressed versions of 'timestamp.txt'.
-  for file_extension in compressions:
-    compressed_filename = release_filename + '.' + file_extension
+  # Save the file info of the compressed versions of 'release.txt'.
+  for compression in compressions:
+    compressed_filename = tuf.util.get_compressed_filename(release_filename,
+                                                           compression)
     compressed_fileinfo = get_metadata_file_info(compressed_filename)
-    fileinfo['release.txt.' + file_extension] = compressed_fileinfo
+    compressed_name = tuf.util.get_compressed_filename('release.txt',
+                                                       compression)
+    fileinfo[compressed_name] = compressed_fileinfo
 
   # Generate the timestamp metadata object.
   timestamp_metadata = tuf.formats.TimestampFile.make_metadata(version,
@@ -538,6 +618,153 @@ def generate_timestamp_metadata(release_filename, version,
 
 
 
+def write_compressed_metadata_files(filename, compressions):
+  """
+  <Purpose>
+    Save the metadata file 'filename' compressed with each of 'compressions',
+    next to it (see 'tuf.util.get_compressed_filename()').  Clients download
+    the smallest version they support of the files listed in the release and
+    timestamp metadata (see generate_release_metadata() and
+    generate_timestamp_metadata()).
+
+  <Arguments>
+    filename:
+      The path of the metadata file, e.g., 'metadata/release.txt'.
+
+    compressions:
+      The names of the compressions, e.g., ['gzip', 'bz2'].
+
+  <Exceptions>
+    tuf.FormatError, if the arguments are improperly formatted.
+
+    tuf.Error, if a compression is not supported, or 'filename' cannot be
+    read.
+
+  <Side Effects>
+    The compressed files are written.
+
+  <Returns>
+    The list of paths of the compressed files.
+
+  """
+
+  # Do the arguments have the correct format?
+  # Raise 'tuf.FormatError' if there is a mismatch.
+  tuf.formats.PATH_SCHEMA.check_match(filename)
+  tuf.formats.NAMES_SCHEMA.check_match(compressions)
+
+  data = _read_file(filename)
+
+  compressed_filenames = []
+  for compression in compressions:
+    compressed_filename = tuf.util.get_compressed_filename(filename,
+                                                           compression)
+    logger.info('Writing to '+repr(compressed_filename))
+    compressed_file = open(compressed_filename, 'wb')
+    try:
+      compressed_file.write(tuf.util.compress(data, compression))
+    finally:
+      compressed_file.close()
+    compressed_filenames.append(compressed_filename)
+
+  return compressed_filenames
+
+
+
+
+
+def build_metadata_deltas(filename, previous_filenames):
+  """
+  <Purpose>
+    Build the deltas that update each of 'previous_filenames', the recent
+    versions of the metadata file 'filename', to its current version.  The
+    deltas are saved next to 'filename' (see 'tuf.delta.get_delta_filename()')
+    and replace any deltas built for an earlier version of it.  Clients holding
+    one of the previous versions may download its delta instead of the whole
+    file, once the deltas are listed in the release metadata (see
+    generate_release_metadata()).  A delta that is not smaller than the
+    current version is not saved.
+
+  <Arguments>
+    filename:
+      The path of the current version of the metadata file, e.g.,
+      'metadata/targets.txt' or 'metadata/targets/unclaimed.txt'.
+
+    previous_filenames:
+      The paths of the previous versions of the metadata file.
+
+  <Exceptions>
+    tuf.FormatError, if the arguments are improperly formatted.
+
+    tuf.Error, if one of the files cannot be read.
+
+  <Side Effects>
+    The deltas of 'filename' are removed and written again.
+
+  <Returns>
+    The list of paths of the written deltas.
+
+  """
+
+  # Do the arguments have the correct format?
+  # Raise 'tuf.FormatError' if there is a mismatch.
+  tuf.formats.PATH_SCHEMA.check_match(filename)
+  tuf.formats.PATHS_SCHEMA.check_match(previous_filenames)
+
+  # Remove the deltas built for earlier versions of 'filename'.
+  directory, basename = os.path.split(filename)
+  delta_prefix = basename + tuf.delta.DELTA_EXTENSION
+  for delta_basename in os.listdir(directory or '.'):
+    if delta_basename.startswith(delta_prefix):
+      os.remove(os.path.join(directory, delta_basename))
+
+  new_data = _read_file(filename)
+
+  delta_filenames = []
+  previous_files_details = tuf.util.get_files_details(previous_filenames)
+  for previous_filename, (previous_length, previous_hashes) in \
+      zip(previous_filenames, previous_files_details):
+    previous_data = _read_file(previous_filename)
+    if previous_data == new_data:
+      continue
+
+    delta = tuf.delta.create_delta(previous_data, new_data)
+    if len(delta) >= len(new_data):
+      logger.info('Skipping the delta from '+repr(previous_filename)+\
+                  ', which is not smaller than '+repr(filename)+'.')
+      continue
+
+    delta_filename = tuf.delta.get_delta_filename(filename, previous_hashes)
+    logger.info('Writing to '+repr(delta_filename))
+    delta_file = open(delta_filename, 'wb')
+    try:
+      delta_file.write(delta)
+    finally:
+      delta_file.close()
+    delta_filenames.append(delta_filename)
+
+  return delta_filenames
+
+
+
+
+
+def _read_file(filename):
+  """Return the contents of 'filename'.  Raise tuf.Error if it can't be read."""
+
+  try:
+    file_object = open(filename, 'rb')
+    try:
+      return file_object.read()
+    finally:
+      file_object.close()
+  except IOError, e:
+    raise tuf.Error('Cannot read '+repr(filename)+': '+str(e))
+
+
+
+
+
 def write_metadata_file(metadata, filename):
   """
   <Purpose>
@@ -575,9 +802,11 @@ def write_metadata_file(metadata, filename):
   logger.info('Writing to '+repr(filename))
   file_object = open(filename, 'w')
 
-  # The metadata object is saved to 'file_object'.  The keys
-  # of the objects are sorted and indentation is used.
-  json.dump(metadata, file_object, indent=1, sort_keys=True)
+  # The metadata object is saved to 'file_object' in canonical JSON, with its
+  # control characters escaped, so that the file is valid JSON and clients
+  # can recover the bytes its signatures were generated over without
+  # encoding the object again (see 'tuf.util.load_signable_json_string()').
+  file_object.write(tuf.util.encode_signable_json_string(metadata))
 
   file_object.write('\n')
   file_object.close()
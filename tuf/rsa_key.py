@@ -354,7 +354,80 @@ def create_signature(rsakey_dict, data):
 
 
 
-def verify_signature(rsakey_dict, signature, data):
+def create_verification_key(rsakey_dict):
+  """
+  <Purpose>
+    Parse the public key of 'rsakey_dict' into a native key handle that
+    verify_signature() can use, so that the PEM-formatted key need not be
+    parsed again for every signature.  The native key is freed when the
+    returned object is garbage collected.
+
+  <Arguments>
+    rsakey_dict:
+      A dictionary containing the RSA keys and other identifying information,
+      conformant to 'tuf.formats.RSAKEY_SCHEMA'.
+
+  <Exceptions>
+    tuf.FormatError, if 'rsakey_dict' does not have the correct format.
+
+    tuf.CryptoError, if the public key cannot be parsed.
+
+  <Side Effects>
+    evpy.signature.VerificationKey() parses the public key.
+
+  <Returns>
+    An 'evpy.signature.VerificationKey' object.
+
+  """
+
+  # Does 'rsakey_dict' have the correct format?
+  # Raise 'tuf.FormatError' if the check fails.
+  tuf.formats.RSAKEY_SCHEMA.check_match(rsakey_dict)
+
+  try:
+    return evpy.signature.VerificationKey(rsakey_dict['keyval']['public'])
+  except evpy.signature.SignatureError, e:
+    raise tuf.CryptoError('Could not parse the public key of '+\
+                          repr(rsakey_dict['keyid'])+': '+str(e))
+
+
+
+
+
+def create_data_verifier():
+  """
+  <Purpose>
+    Create an object that digests data given in pieces, so that signatures
+    over large data can be checked by verify_signature() without the data
+    being held in memory all at once.  The data is passed to the 'update()'
+    method of the returned object, which is then given to verify_signature()
+    in place of the data.  The native context is freed when the returned object
+    is garbage collected.
+
+  <Arguments>
+    None.
+
+  <Exceptions>
+    tuf.CryptoError, if the verifier cannot be created.
+
+  <Side Effects>
+    evpy.signature.Verifier() creates a native digest context.
+
+  <Returns>
+    An 'evpy.signature.Verifier' object.
+
+  """
+
+  try:
+    return evpy.signature.Verifier()
+  except evpy.signature.SignatureError, e:
+    raise tuf.CryptoError('Could not create a data verifier: '+str(e))
+
+
+
+
+
+def verify_signature(rsakey_dict, signature, data, verification_key=None):
   """
   <Purpose>
     Determine whether the private key belonging to 'rsakey_dict' produced
@@ -384,6 +457,13 @@ def verify_signature(rsakey_dict, signature, data):
     data:
       Data object used by tuf.rsa_key.create_signature() to generate
       'signature'.  'data' is needed here to verify the signature.
+      'data' may also be an object returned by create_data_verifier() that
+      has been given the data.
+
+    verification_key:
+      An optional 'evpy.signature.VerificationKey' object for the public key
+      of 'rsakey_dict', as returned by create_verification_key().  If given,
+      the public key is not parsed again.
 
   <Exceptions>
     tuf.UnknownMethodError.  Raised if the signing method used by
@@ -424,4 +504,11 @@ def verify_signature(rsakey_dict, signature, data):
 
   if method != 'evp':
     raise tuf.UnknownMethodError(method)
+  if isinstance(data, evpy.signature.Verifier):
+    if verification_key is not None:
+      return data.verify(binascii.unhexlify(sig), vkey=verification_key)
+    return data.verify(binascii.unhexlify(sig), key=public_key)
+  if verification_key is not None:
+    return evpy.signature.verify(data, binascii.unhexlify(sig),
+                                 vkey=verification_key)
   return evpy.signature.verify(data, binascii.unhexlify(sig), key=public_key)
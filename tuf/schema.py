@@ -39,9 +39,15 @@
   examples.  Anything related to the checking of TUF objects and their formats
   can be found in 'formats.py'.
 
+  A schema may also be compiled into a validator function specialized for it
+  (see compile_schema() and Schema.compile()).  The validator accepts and
+  rejects the same objects as the schema's check_match(), with the same error
+  messages, but does not walk the schema objects to do so.
+
 """
 
 
+import collections
 import re
 import sys
 
@@ -88,6 +94,19 @@ class Schema:
     raise NotImplementedError()
 
 
+  def compile(self):
+    """
+    <Purpose>
+      Compile this schema into a validator function (see compile_schema()),
+      which check_match() and matches() use from now on.  The schema must not
+      be modified afterwards.  Return the validator.
+
+    """
+
+    self.check_match = compile_schema(self)
+    return self.check_match
+
+
 
 
 
@@ -480,7 +499,8 @@ class DictOf(Schema):
   <Purpose>
     Matches a mapping from items matching a particular key-schema
     to items matching a value-schema (i.e., the object being checked
-    must be a dict).  Note that in JSON, keys must be strings.  In the
+    must be a dict, or another 'collections.Mapping').  Note that in JSON,
+    keys must be strings.  In the
     example below, the keys of the dict must be one of the letters
     contained in 'aeiou' and the value must be a structure containing
     any two strings.
@@ -527,10 +547,10 @@ class DictOf(Schema):
 
 
   def check_match(self, object):
-    if not isinstance(object, dict): 
+    if not isinstance(object, collections.Mapping): 
       raise tuf.FormatError('Expected a dict but got '+repr(object))
 
-    for key, value in object.items():
+    for key, value in object.iteritems():
       self._key_schema.check_match(key)
       self._value_schema.check_match(value)
 
@@ -836,6 +856,278 @@ class RegularExpression(Schema):
 
 
 
+class _SchemaCompiler(object):
+  """
+  <Purpose>
+    Generate the Python source of a predicate that returns True if an object
+    matches a schema, for compile_schema().  The predicate only accepts
+    objects that the schema's check_match() accepts.  It may reject others
+    that check_match() would accept (for instance, mappings other than dicts,
+    or containers of types derived from dict, list or tuple), and it does not
+    report why an object is rejected: compile_schema() leaves that to
+    check_match().
+
+    The checks of a schema and of its sub-schemas are generated as the
+    statements of one function, except where they would be nested too
+    deeply; those sub-schemas, and the alternatives of a OneOf schema, get a
+    function of their own.  The generated functions are defined in a factory
+    function, whose local variables hold the values the generated code needs
+    (strings, bounds, regular expressions, built-in functions, and so on).
+
+  """
+
+  # The schemas whose checks contain other checks.
+  _CONTAINER_SCHEMAS = (Object, DictOf, ListOf, Struct, OneOf)
+
+  # Python limits the number of nested blocks of a function to 20, so the
+  # checks of a sub-schema nested deeper than this number of indentation
+  # levels are generated as a function.
+  _MAX_INLINE_DEPTH = 14
+
+  def __init__(self):
+    self.namespace = {'FormatError': tuf.FormatError}
+    for builtin in [basestring, bool, dict, int, isinstance, len, list, long,
+                    tuple, type, KeyError]:
+      self.namespace[builtin.__name__] = builtin
+    self.sources = []
+    self._function_names = {}
+    self._counter = 0
+
+
+  def _name(self, prefix):
+    self._counter = self._counter + 1
+    return prefix+str(self._counter)
+
+
+  def constant(self, value):
+    """Return the name of a variable of the generated code holding 'value'."""
+
+    name = self._name('c')
+    self.namespace[name] = value
+    return name
+
+
+  def function(self, schema):
+    """Return the name of the generated predicate for 'schema'."""
+
+    if id(schema) in self._function_names:
+      return self._function_names[id(schema)]
+    function_name = self._name('matches_')
+    self._function_names[id(schema)] = function_name
+
+    lines = ['  def '+function_name+'(v0):']
+    self._emit(schema, 'v0', lines, '    ')
+    lines.append('    return True')
+    self.sources.append('\n'.join(lines))
+    return function_name
+
+
+  def factory_source(self, lines):
+    """
+    Return the source of the factory function, which defines the generated
+    functions and then runs 'lines'.
+    """
+
+    source = ['def make_validator(namespace):']
+    for name in sorted(self.namespace):
+      source.append('  '+name+' = namespace['+repr(name)+']')
+    return '\n'.join(source+self.sources+lines)+'\n'
+
+
+  def _emit_item(self, schema, variable, lines, indent):
+    # Check an item of a container, inline or by a call.
+    if schema.__class__ in self._CONTAINER_SCHEMAS and \
+        len(indent) >= 2 * self._MAX_INLINE_DEPTH:
+      lines.append(indent+'if not '+self.function(schema)+'('+variable+'):')
+      lines.append(indent+'  return False')
+    else:
+      self._emit(schema, variable, lines, indent)
+
+
+  def _emit(self, schema, v, lines, indent):
+    # Append the statements that return False unless the object named 'v'
+    # matches 'schema' to 'lines'.
+    schema_class = schema.__class__
+    I = indent
+    mismatch = None
+
+    if schema_class is Any:
+      pass
+
+    elif schema_class is String:
+      mismatch = self.constant(schema._string)+' != '+v
+
+    elif schema_class is AnyString:
+      mismatch = 'not isinstance('+v+', basestring)'
+
+    elif schema_class is Boolean:
+      mismatch = 'not isinstance('+v+', bool)'
+
+    elif schema_class is Integer:
+      mismatch = 'isinstance('+v+', bool) or not isinstance('+v+', (int, long))'+\
+        ' or not ('+self.constant(schema._lo)+' <= '+v+' <= '+\
+        self.constant(schema._hi)+')'
+
+    elif schema_class is RegularExpression:
+      mismatch = 'not isinstance('+v+', basestring) or not '+\
+        self.constant(schema._re_object.match)+'('+v+')'
+
+    elif schema_class is Optional:
+      self._emit_item(schema._schema, v, lines, I)
+
+    elif schema_class is AllOf:
+      for required_schema in schema._required_schemas:
+        self._emit_item(required_schema, v, lines, I)
+
+    elif schema_class is OneOf:
+      mismatch = 'not ('+' or '.join([self.function(alternative)+'('+v+')'
+                                      for alternative in schema._alternatives])+')'
+
+    elif schema_class is ListOf:
+      lines.extend([I+'if type('+v+') is not list and type('+v+') is not tuple or \\',
+                    I+'    not ('+self.constant(schema._min_count)+' <= len('+v+') <= '+
+                      self.constant(schema._max_count)+'):',
+                    I+'  return False'])
+      item = self._name('v')
+      body = []
+      self._emit_item(schema._schema, item, body, I+'  ')
+      if body:
+        lines.append(I+'for '+item+' in '+v+':')
+        lines.extend(body)
+
+    elif schema_class is DictOf:
+      lines.extend([I+'if type('+v+') is not dict:',
+                    I+'  return False'])
+      key = self._name('v')
+      value = self._name('v')
+      body = []
+      self._emit_item(schema._key_schema, key, body, I+'  ')
+      self._emit_item(schema._value_schema, value, body, I+'  ')
+      if body:
+        lines.append(I+'for '+key+', '+value+' in '+v+'.iteritems():')
+        lines.extend(body)
+
+    elif schema_class is Object:
+      lines.extend([I+'if type('+v+') is not dict:',
+                    I+'  return False'])
+      for key, key_schema in schema._required:
+        key = self.constant(key)
+        item = self._name('v')
+        body = []
+        self._emit_item(key_schema, item, body, I+'  ')
+        if isinstance(key_schema, Optional):
+          if body:
+            lines.append(I+'if '+key+' in '+v+':')
+            lines.append(I+'  '+item+' = '+v+'['+key+']')
+            lines.extend(body)
+        elif body:
+          lines.extend([I+'try:',
+                        I+'  '+item+' = '+v+'['+key+']',
+                        I+'except KeyError:',
+                        I+'  return False'])
+          lines.extend([line[2:] for line in body])
+        else:
+          lines.extend([I+'if '+key+' not in '+v+':',
+                        I+'  return False'])
+
+    elif schema_class is Struct:
+      mismatch = 'type('+v+') is not list and type('+v+') is not tuple or '+\
+        'len('+v+') < '+str(schema._min)
+      if not schema._allow_more:
+        mismatch = mismatch+' or len('+v+') > '+str(len(schema._sub_schemas))
+      lines.extend([I+'if '+mismatch+':',
+                    I+'  return False'])
+      mismatch = None
+      for index, sub_schema in enumerate(schema._sub_schemas):
+        item = self._name('v')
+        body = []
+        self._emit_item(sub_schema, item, body, I+'  ')
+        if not body:
+          continue
+        if index < schema._min:
+          lines.append(I+item+' = '+v+'['+str(index)+']')
+          lines.extend([line[2:] for line in body])
+        else:
+          lines.extend([I+'if len('+v+') > '+str(index)+':',
+                        I+'  '+item+' = '+v+'['+str(index)+']'])
+          lines.extend(body)
+
+    else:
+      # Schemas of other classes, including subclasses of the classes above,
+      # are checked by their own check_match() method.
+      lines.extend([I+'try:',
+                    I+'  '+self.constant(schema_class.check_match)+'('+
+                      self.constant(schema)+', '+v+')',
+                    I+'except FormatError:',
+                    I+'  return False'])
+
+    if mismatch is not None:
+      lines.extend([I+'if '+mismatch+':',
+                    I+'  return False'])
+
+
+
+
+
+def compile_schema(schema):
+  """
+  <Purpose>
+    Compile 'schema' into a validator function specialized for it.  Like
+    schema.check_match(), the validator takes the object to check as its only
+    argument, returns None if the object matches 'schema' and raises
+    'tuf.FormatError' otherwise.
+
+    The checks of the schema and of its sub-schemas are generated as Python
+    code, so the schema objects are not walked for every object checked and
+    no error messages are built for matching objects.  Objects the generated
+    code rejects are checked again by the check_match() method of the
+    schema's class, which reports the error exactly as it would have without
+    compiling.  Mappings other than dicts, containers of types derived from
+    dict, list or tuple, and schemas of classes not defined in this module,
+    are also left to their check_match() methods.
+
+  <Arguments>
+    schema:
+      The schema to compile.  It must not be modified afterwards.
+
+  <Exceptions>
+    tuf.FormatError, if 'schema' is not a schema.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    The validator function.
+
+  """
+
+  if not isinstance(schema, Schema):
+    raise tuf.FormatError('Expected Schema but got '+repr(schema))
+
+  compiler = _SchemaCompiler()
+  matches = compiler.function(schema)
+  schema_name = compiler.constant(schema)
+  check_match = compiler.constant(schema.__class__.check_match)
+
+  source = compiler.factory_source([
+    '  def validator(object):',
+    '    try:',
+    '      if '+matches+'(object):',
+    '        return',
+    '    except Exception:',
+    '      pass',
+    '    '+check_match+'('+schema_name+', object)',
+    '  return validator'])
+  code = compile(source, '<compiled schema>', 'exec')
+  factory_namespace = {}
+  exec code in factory_namespace
+
+  return factory_namespace['make_validator'](compiler.namespace)
+
+
+
+
+
 if __name__ == '__main__':
   # The interactive sessions of the documentation strings can
   # be tested by running schema.py as a standalone module.
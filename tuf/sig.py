@@ -36,13 +36,76 @@
 
 """
 
+import collections
+import threading
+
 import tuf
+import tuf.conf
 import tuf.formats
+import tuf.hash
 import tuf.keydb
 import tuf.roledb
+import tuf.rsa_key
+
+# The cache of signature verification results used by _verify_signature().
+# Its keys are (data digest, keyid, method, sig) tuples, its values the
+# Boolean results, ordered from the least to the most recently used.  The
+# cache is only valid for '_signature_cache_generation' of the key database.
+_signature_cache = collections.OrderedDict()
+_signature_cache_generation = None
+_signature_cache_lock = threading.Lock()
 
 
-def get_signature_status(signable, role=None):
+class SignedData(object):
+  """
+  <Purpose>
+    The canonical JSON encoding of the 'signed' object of a signable, given in
+    pieces to 'update()' as it is read (see
+    'tuf.util.load_signable_json_file_object()').  Only the digests needed
+    to verify signatures over the encoding are kept, so that the encoding of
+    large metadata need not be held in memory all at once.  A SignedData
+    object may be passed as the 'signed_data' of get_signature_status() and
+    verify() once all of the encoding has been given.
+
+  """
+
+  def __init__(self):
+    # The sha256 digest identifies the data in the signature cache.
+    self._digest = tuf.hash.digest('sha256')
+    self._verifier = tuf.rsa_key.create_data_verifier()
+
+
+
+  def update(self, data):
+    """
+    <Purpose>
+      Add 'data', the next piece of the canonical JSON encoding.
+
+    <Arguments>
+      data:
+        A string.
+
+    <Exceptions>
+      tuf.FormatError, if 'data' is not a string.
+
+    <Side Effects>
+      The digests are updated.
+
+    <Returns>
+      None.
+
+    """
+
+    tuf.formats.ENCODED_CANONICAL_SCHEMA.check_match(data)
+
+    self._digest.update(data)
+    self._verifier.update(data)
+
+
+
+
+
+def get_signature_status(signable, role=None, signed_data=None):
   """
   <Purpose>
     Return a dictionary representing the status of the signatures listed
@@ -65,13 +128,20 @@ def get_signature_status(signable, role=None):
     role:
       TUF role (e.g., 'root', 'targets', 'release').
 
+    signed_data:
+      The canonical JSON encoding of signable['signed'], if the caller
+      already has it (see 'tuf.util.load_signable_json_string()'), or a
+      'SignedData' object that has been given the encoding.  If None,
+      signable['signed'] is encoded.
+
   <Exceptions>
     tuf.FormatError, if 'signable' does not have the correct format.
 
     tuf.UnknownRoleError, if 'role' is not recognized.
 
   <Side Effects>
-    None.
+    Signature verification results are cached (see
+    'tuf.conf.signature_cache_size').
 
   <Returns>
     A dictionary representing the status of the signatures in 'signable'.
@@ -107,7 +177,23 @@ def get_signature_status(signable, role=None):
   signatures = signable['signatures']
 
   # 'signed' needed in canonical JSON format.
-  data = tuf.formats.encode_canonical(signed)
+  if isinstance(signed_data, SignedData):
+    data = signed_data._verifier
+  elif signed_data is None:
+    data = tuf.formats.encode_canonical(signed)
+  else:
+    tuf.formats.ENCODED_CANONICAL_SCHEMA.check_match(signed_data)
+    data = signed_data
+
+  # The digest of 'data' identifies it in the signature cache.
+  if tuf.conf.signature_cache_size and isinstance(signed_data, SignedData):
+    data_digest = signed_data._digest.digest()
+  elif tuf.conf.signature_cache_size:
+    data_digest = tuf.hash.digest('sha256')
+    data_digest.update(data)
+    data_digest = data_digest.digest()
+  else:
+    data_digest = None
 
   # Iterate through the signatures and enumerate the signature_status fields.
   # (i.e., good_sigs, bad_sigs, etc.).
@@ -125,7 +211,7 @@ def get_signature_status(signable, role=None):
 
     # Identify key using an unknown key signing method.
     try:
-      valid_sig = tuf.rsa_key.verify_signature(key, signature, data)
+      valid_sig = _verify_signature(key, signature, data, data_digest)
     except tuf.UnknownMethodError:
       unknown_method_sigs.append(keyid)
       continue
@@ -171,7 +257,120 @@ def get_signature_status(signable, role=None):
 
 
 
-def verify(signable, role):
+def _verify_signature(key, signature, data, data_digest):
+  """
+  <Purpose>
+    Verify 'signature' over 'data' with 'key', as 'tuf.rsa_key.verify_signature'
+    does, with the public key parsed by 'tuf.keydb' and using the signature
+    cache.  A result found in the cache is
+    returned without verifying the signature again.  The cache holds up to
+    'tuf.conf.signature_cache_size' results, discarding the least recently
+    used first, and is cleared whenever the key database changes.
+
+  <Arguments>
+    key:
+      The key, from 'tuf.keydb', identified by the keyid of 'signature'.
+
+    signature:
+      A signature, conformant to 'tuf.formats.SIGNATURE_SCHEMA'.
+
+    data:
+      The data that was signed.
+
+    data_digest:
+      The sha256 digest of 'data', or None if the cache is disabled.
+
+  <Exceptions>
+    tuf.UnknownMethodError, if the signing method of 'signature' is not
+    supported.
+
+  <Side Effects>
+    The signature cache is updated.
+
+  <Returns>
+    Boolean.
+
+  """
+
+  global _signature_cache_generation
+
+  # The public key parsed when the key was added to the key database.
+  verification_key = tuf.keydb.get_verification_key(signature['keyid'])
+
+  cache_size = tuf.conf.signature_cache_size
+  if not cache_size or data_digest is None:
+    return tuf.rsa_key.verify_signature(key, signature, data,
+                                        verification_key=verification_key)
+
+  cache_key = (data_digest, signature['keyid'], signature['method'],
+               signature['sig'])
+  keydb_generation = tuf.keydb.get_keydb_generation()
+
+  _signature_cache_lock.acquire()
+  try:
+    if _signature_cache_generation != keydb_generation:
+      _signature_cache.clear()
+      _signature_cache_generation = keydb_generation
+    valid_sig = _signature_cache.pop(cache_key, None)
+    if valid_sig is not None:
+      # Mark the result as the most recently used.
+      _signature_cache[cache_key] = valid_sig
+      return valid_sig
+  finally:
+    _signature_cache_lock.release()
+
+  valid_sig = tuf.rsa_key.verify_signature(key, signature, data,
+                                           verification_key=verification_key)
+
+  _signature_cache_lock.acquire()
+  try:
+    # The key database may have changed during the verification, in which
+    # case the result is not cached.
+    if _signature_cache_generation == keydb_generation and \
+       tuf.keydb.get_keydb_generation() == keydb_generation:
+      _signature_cache[cache_key] = valid_sig
+      while len(_signature_cache) > cache_size:
+        _signature_cache.popitem(last=False)
+  finally:
+    _signature_cache_lock.release()
+
+  return valid_sig
+
+
+
+
+
+def clear_signature_cache():
+  """
+  <Purpose>
+    Discard all the signature verification results cached by
+    get_signature_status().
+
+  <Arguments>
+    None.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    The signature cache is cleared.
+
+  <Returns>
+    None.
+
+  """
+
+  _signature_cache_lock.acquire()
+  try:
+    _signature_cache.clear()
+  finally:
+    _signature_cache_lock.release()
+
+
+
+
+
+def verify(signable, role, signed_data=None):
   """
   <Purpose> 
     Verify whether the authorized signatures of 'signable' meet the minimum
@@ -187,6 +386,10 @@ def verify(signable, role):
     role:
       TUF role (e.g., 'root', 'targets', 'release').
 
+    signed_data:
+      The canonical JSON encoding of signable['signed'], or None (see
+      get_signature_status()).
+
   <Exceptions>
     tuf.UnknownRoleError, if 'role' is not recognized.
 
@@ -207,7 +410,7 @@ def verify(signable, role):
   # Retrieve the signature status.  tuf.sig.get_signature_status() raises
   # tuf.UnknownRoleError
   # tuf.FormatError
-  status = get_signature_status(signable, role)
+  status = get_signature_status(signable, role, signed_data)
   
   # Retrieve the role's threshold and the authorized keys of 'status'
   threshold = status['threshold']
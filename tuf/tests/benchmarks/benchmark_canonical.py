@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+<Program Name>
+  benchmark_canonical.py
+
+<Started>
+  October 2026.
+
+<Copyright>
+  See LICENSE for licensing information.
+
+<Purpose>
+  Measure how long 'tuf.formats.encode_canonical()' takes to encode a large
+  targets metadata object, and compare it against the previous recursive
+  encoder, which made several output calls per value, ran a regular
+  expression substitution for every string and sorted the items of every
+  dictionary.  Both encoders must produce identical output.
+
+  The metadata is encoded as created (with byte strings) and as loaded from
+  a JSON file (with unicode strings).
+
+  Usage:
+    $ python benchmark_canonical.py [number_of_targets]
+
+"""
+
+import re
+import sys
+import time
+import hashlib
+
+import tuf.formats
+import tuf.util
+
+json = tuf.util.import_json()
+
+
+def _previous_canonical_string_encoder(string):
+  string = '"%s"' % re.sub(r'(["\\])', r'\\\1', string)
+  if isinstance(string, unicode):
+    return string.encode('utf-8')
+  else:
+    return string
+
+
+
+
+
+def _previous_encode_canonical(object, output_function):
+  if isinstance(object, basestring):
+    output_function(_previous_canonical_string_encoder(object))
+  elif object is True:
+    output_function("true")
+  elif object is False:
+    output_function("false")
+  elif object is None:
+    output_function("null")
+  elif isinstance(object, (int, long)):
+    output_function(str(object))
+  elif isinstance(object, (tuple, list)):
+    output_function("[")
+    if len(object):
+      for item in object[:-1]:
+        _previous_encode_canonical(item, output_function)
+        output_function(",")
+      _previous_encode_canonical(object[-1], output_function)
+    output_function("]")
+  elif isinstance(object, dict):
+    output_function("{")
+    if len(object):
+      items = object.items()
+      items.sort()
+      for key, value in items[:-1]:
+        output_function(_previous_canonical_string_encoder(key))
+        output_function(":")
+        _previous_encode_canonical(value, output_function)
+        output_function(",")
+      key, value = items[-1]
+      output_function(_previous_canonical_string_encoder(key))
+      output_function(":")
+      _previous_encode_canonical(value, output_function)
+    output_function("}")
+  else:
+    raise tuf.FormatError('I cannot encode '+repr(object))
+
+
+
+
+
+def _previous_encode(object):
+  result = []
+  _previous_encode_canonical(object, result.append)
+  return ''.join(result)
+
+
+
+
+
+def _build_targets_metadata(number_of_targets):
+  targets = {}
+  for index in range(number_of_targets):
+    filepath = 'packages/'+str(index % 1000)+'/package-'+str(index)+'.tar.gz'
+    targets[filepath] = {'length': index * 37,
+                         'hashes': {'sha256': hashlib.sha256(filepath).hexdigest()},
+                         'custom': {'type': 'tarball'}}
+  return {'_type': 'Targets', 'version': 1,
+          'expires': '2030-01-01 00:00:00 UTC', 'targets': targets}
+
+
+
+
+
+def _measure(label, encode_function, object):
+  start_time = time.time()
+  encoded = encode_function(object)
+  elapsed_time = time.time() - start_time
+  megabytes = len(encoded) / float(1024 * 1024)
+  print '%-45s %8.3f s %10.1f MiB/s' % (label, elapsed_time,
+                                        megabytes / elapsed_time)
+  return encoded
+
+
+
+
+
+def main(number_of_targets=100000):
+  metadata = _build_targets_metadata(number_of_targets)
+  loaded_metadata = json.loads(json.dumps(metadata))
+
+  print 'Encoding the metadata of '+str(number_of_targets)+' targets.'
+  for label, object in [('byte strings', metadata),
+                        ('unicode strings', loaded_metadata)]:
+    previous = _measure('previous encoder, '+label, _previous_encode, object)
+    current = _measure('encode_canonical(), '+label,
+                       tuf.formats.encode_canonical, object)
+    assert previous == current
+
+
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1:
+    main(int(sys.argv[1]))
+  else:
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+<Program Name>
+  benchmark_delegations.py
+
+<Started>
+  October 2026.
+
+<Copyright>
+  See LICENSE for licensing information.
+
+<Purpose>
+  Measure how long it takes to match 100,000 targets against delegations,
+  using the compiled delegation matcher of 'tuf.client.updater', and compare
+  it against the previous approach, which compared every target against
+  every delegated path with 'os.path.commonprefix()'.
+
+  Two cases are measured:
+    1. Checking that the targets of a delegated role are allowed by the
+       hundreds of paths its parent delegated to it, as done by
+       'Updater._ensure_all_targets_allowed()'.
+    2. Finding the delegated roles trusted with each target, among roles
+       delegated by path and hashed bins delegated by path hash prefix, as
+       done by 'Updater.target()'.
+
+  Usage:
+    $ python benchmark_delegations.py [number_of_targets]
+
+"""
+
+import os
+import sys
+import time
+import hashlib
+
+import tuf.client.updater
+
+
+NUMBER_OF_PATHS = 500
+NUMBER_OF_BINS = 256
+
+
+def _build_child_roles():
+  paths = ['packages/project'+str(index)+'/' for index in range(NUMBER_OF_PATHS)]
+  child_roles = [{'name': 'targets/packages', 'keyids': [], 'threshold': 1,
+                  'paths': paths}]
+  for index in range(NUMBER_OF_BINS):
+    child_roles.append({'name': 'targets/bin-%02x' % index, 'keyids': [],
+                        'threshold': 1, 'path_hash_prefix': '%02x' % index})
+  return child_roles
+
+
+
+
+
+def _build_targets(number_of_targets):
+  targets = []
+  for index in range(number_of_targets):
+    project = index % NUMBER_OF_PATHS
+    targets.append('packages/project'+str(project)+'/file'+str(index)+'.tgz')
+  return targets
+
+
+
+
+
+def _previous_allows_path(child_role, target_filepath):
+  for allowed_child_path in child_role['paths']:
+    prefix = os.path.commonprefix([target_filepath, allowed_child_path])
+    if prefix == allowed_child_path:
+      return True
+  return False
+
+
+
+
+
+def _previous_get_delegated_roles(child_roles, target_filepath,
+                                  target_filepath_hash):
+  role_names = []
+  for child_role in child_roles:
+    if 'path_hash_prefix' in child_role:
+      if target_filepath_hash.startswith(child_role['path_hash_prefix']):
+        role_names.append(child_role['name'])
+    else:
+      for child_role_path in child_role['paths']:
+        prefix = os.path.commonprefix([target_filepath, child_role_path])
+        if prefix == child_role_path:
+          role_names.append(child_role['name'])
+  return role_names
+
+
+
+
+
+def _measure(label, function):
+  start_time = time.time()
+  function()
+  print '%-50s %8.3f s' % (label, time.time() - start_time)
+
+
+
+
+
+def main(number_of_targets=100000):
+  child_roles = _build_child_roles()
+  targets = _build_targets(number_of_targets)
+  target_hashes = [hashlib.sha256(target).hexdigest() for target in targets]
+  packages_role = child_roles[0]
+
+  print str(number_of_targets)+' targets, '+str(NUMBER_OF_PATHS)+ \
+    ' delegated paths, '+str(NUMBER_OF_BINS)+' hashed bins.'
+
+  def previous_allowed():
+    for target in targets:
+      assert _previous_allows_path(packages_role, target)
+
+  def compiled_allowed():
+    delegation_matcher = tuf.client.updater._DelegationMatcher(child_roles)
+    for target in targets:
+      assert delegation_matcher.allows_path('targets/packages', target)
+
+  def previous_lookup():
+    for target, target_hash in zip(targets, target_hashes):
+      _previous_get_delegated_roles(child_roles, target, target_hash)
+
+  def compiled_lookup():
+    delegation_matcher = tuf.client.updater._DelegationMatcher(child_roles)
+    for target, target_hash in zip(targets, target_hashes):
+      delegation_matcher.get_delegated_roles(target, target_hash)
+
+  _measure('allowed targets check, commonprefix()', previous_allowed)
+  _measure('allowed targets check, compiled matcher', compiled_allowed)
+  _measure('delegated role lookup, commonprefix()', previous_lookup)
+  _measure('delegated role lookup, compiled matcher', compiled_lookup)
+
+
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1:
+    main(int(sys.argv[1]))
+  else:
+    main()
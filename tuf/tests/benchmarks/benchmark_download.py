@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+<Program Name>
+  benchmark_download.py
+
+<Started>
+  October 2026.
+
+<Copyright>
+  See LICENSE for licensing information.
+
+<Purpose>
+  Measure the throughput of 'tuf.download.download_url_to_tempfileobj()' at
+  several block sizes (see 'tuf.conf.download_block_size'), and compare it
+  against the previous download path, which read 8192-byte blocks, flushed
+  the temporary file after every block and read the file back to verify its
+  hashes.
+
+  The file is served over a real socket by 'simple_server.py', on the local
+  host, so that the measurements include the reads from the response but
+  not the speed of a network.
+
+  Usage:
+    $ python benchmark_download.py [size_in_megabytes]
+
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import urllib2
+import hashlib
+import tempfile
+import subprocess
+
+import tuf.conf
+import tuf.download
+import tuf.util
+
+# The server started by main() serves the files of the current directory.
+_SIMPLE_SERVER_FILEPATH = \
+  os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+               'simple_server.py')
+
+
+def _previous_download(url, trusted_length, trusted_hashes):
+  """The download and verification path prior to the tunable download loop."""
+
+  connection = urllib2.urlopen(url)
+  temp_file = tuf.util.TempFile()
+  total_downloaded = 0
+  while True:
+    data = connection.read(min(8192, trusted_length-total_downloaded))
+    if not data:
+      break
+    temp_file.write(data)
+    total_downloaded = total_downloaded + len(data)
+  connection.close()
+
+  for algorithm, trusted_hash in trusted_hashes.items():
+    digest_object = hashlib.new(algorithm)
+    digest_object.update(temp_file.read())
+    assert digest_object.hexdigest() == trusted_hash
+  return temp_file
+
+
+
+
+
+def _current_download(url, trusted_length, trusted_hashes):
+  """The current download and verification path of 'tuf.download'."""
+
+  return tuf.download.download_url_to_tempfileobj(url, trusted_hashes,
+                                                  trusted_length)
+
+
+
+
+
+def _measure(label, download_function, url, trusted_length, trusted_hashes):
+  start_time = time.time()
+  temp_file = download_function(url, trusted_length, trusted_hashes)
+  elapsed_time = time.time() - start_time
+
+  temp_file.close_temp_file()
+  megabytes = trusted_length / float(1024 * 1024)
+  print '%-40s %8.3f s %10.1f MiB/s' % (label, elapsed_time,
+                                        megabytes / elapsed_time)
+
+
+
+
+
+def main(size_in_megabytes=64):
+  data = b'\x5a' * (size_in_megabytes * 1024 * 1024)
+  trusted_hashes = {'sha256': hashlib.sha256(data).hexdigest(),
+                    'sha512': hashlib.sha512(data).hexdigest()}
+
+  server_directory = tempfile.mkdtemp()
+  data_file = open(os.path.join(server_directory, 'data'), 'wb')
+  data_file.write(data)
+  data_file.close()
+
+  port = random.randint(30000, 45000)
+  url = 'http://localhost:'+str(port)+'/data'
+  server_process = subprocess.Popen([sys.executable, _SIMPLE_SERVER_FILEPATH,
+                                     str(port)], cwd=server_directory,
+                                    stderr=subprocess.PIPE)
+  original_block_size = tuf.conf.download_block_size
+  try:
+    # Give the server time to listen.
+    time.sleep(.5)
+
+    print 'Downloading '+str(size_in_megabytes)+' MiB with sha256 and sha512.'
+    _measure('previous path (8192 bytes)', _previous_download, url,
+             len(data), trusted_hashes)
+    for block_size in (8192, 65536, 1048576):
+      tuf.conf.download_block_size = block_size
+      _measure('current path ('+str(block_size)+' bytes)', _current_download,
+               url, len(data), trusted_hashes)
+
+  finally:
+    tuf.conf.download_block_size = original_block_size
+    tuf.download.clear_connection_pool()
+    server_process.kill()
+    shutil.rmtree(server_directory)
+
+
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1:
+    main(int(sys.argv[1]))
+  else:
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+<Program Name>
+  benchmark_metadata_loading.py
+
+<Started>
+  October 2026.
+
+<Copyright>
+  See LICENSE for licensing information.
+
+<Purpose>
+  Measure how long the updater takes to load a large targets metadata file
+  from its metadata directory (see 'Updater._load_metadata_from_file()'),
+  with the json module (the default), with the streaming loader and compact
+  targets (see 'tuf.conf.metadata_streaming_threshold'), and from the
+  metadata cache (see 'tuf.conf.metadata_cache').
+
+  The file is written in canonical JSON, as 'tuf.repo.signerlib' writes it,
+  and loaded as 'previous' metadata, so that no delegations are imported.
+
+  Usage:
+    $ python benchmark_metadata_loading.py [number_of_targets]
+
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+
+import tuf.conf
+import tuf.util
+import tuf.client.updater
+
+
+def _build_targets_signable(number_of_targets):
+  targets = {}
+  for index in range(number_of_targets):
+    filepath = 'packages/'+str(index % 1000)+'/package-'+str(index)+'.tar.gz'
+    targets[filepath] = {'length': index * 37,
+                         'hashes': {'sha256': hashlib.sha256(filepath).hexdigest()}}
+  signed = {'_type': 'Targets', 'version': 1,
+            'expires': '2030-01-01 00:00:00 UTC', 'targets': targets}
+  signature = {'keyid': '0' * 64, 'method': 'evp', 'sig': '0' * 512}
+  return {'signed': signed, 'signatures': [signature]}
+
+
+
+
+
+def _measure(label, updater, repetitions=3):
+  # The best of 'repetitions' loads.
+  elapsed_times = []
+  for repetition in range(repetitions):
+    start_time = time.time()
+    updater._load_metadata_from_file('previous', 'targets')
+    elapsed_times.append(time.time() - start_time)
+  print '%-45s %8.3f s' % (label, min(elapsed_times))
+
+
+
+
+
+def main(number_of_targets=50000):
+  repository_directory = tempfile.mkdtemp()
+  original_threshold = tuf.conf.metadata_streaming_threshold
+  original_metadata_cache = tuf.conf.metadata_cache
+  try:
+    metadata_directory = os.path.join(repository_directory, 'metadata')
+    previous_directory = os.path.join(metadata_directory, 'previous')
+    os.makedirs(previous_directory)
+    signable = _build_targets_signable(number_of_targets)
+    metadata_file = open(os.path.join(previous_directory, 'targets.txt'), 'wb')
+    metadata_file.write(tuf.util.encode_signable_json_string(signable))
+    metadata_file.close()
+
+    # A bare updater, so that no root metadata or mirrors are needed.
+    updater = tuf.client.updater.Updater.__new__(tuf.client.updater.Updater)
+    updater.metadata_directory = {'previous': previous_directory}
+    updater.metadata = {'previous': {}}
+
+    print 'Loading the metadata of '+str(number_of_targets)+' targets.'
+    tuf.conf.metadata_cache = False
+    tuf.conf.metadata_streaming_threshold = None
+    _measure('json module', updater)
+    tuf.conf.metadata_streaming_threshold = 0
+    _measure('streaming loader, compact targets', updater)
+
+    # The cache is filled by the first load.
+    tuf.conf.metadata_cache = True
+    for threshold, label in [(None, 'cache hit'),
+                             (0, 'cache hit, compact targets')]:
+      tuf.conf.metadata_streaming_threshold = threshold
+      shutil.rmtree(os.path.join(metadata_directory, 'cache'),
+                    ignore_errors=True)
+      updater._load_metadata_from_file('previous', 'targets')
+      _measure(label, updater)
+
+  finally:
+    tuf.conf.metadata_streaming_threshold = original_threshold
+    tuf.conf.metadata_cache = original_metadata_cache
+    shutil.rmtree(repository_directory)
+
+
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1:
+    main(int(sys.argv[1]))
+  else:
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+<Program Name>
+  benchmark_verify.py
+
+<Started>
+  October 2026.
+
+<Copyright>
+  See LICENSE for licensing information.
+
+<Purpose>
+  Measure the signature verification throughput of 'tuf.rsa_key' when the
+  PEM-formatted public key is parsed for every signature, as it was before
+  'tuf.keydb' kept parsed keys, and when the key parsed once by
+  'tuf.rsa_key.create_verification_key()' is reused.  The time taken by
+  'tuf.sig.get_signature_status()' to check metadata signed by a threshold
+  set of keys is also measured, with the signature cache disabled so that
+  every signature is verified.
+
+  Usage:
+    $ python benchmark_verify.py [number_of_signatures]
+
+"""
+
+import sys
+import time
+
+import tuf.conf
+import tuf.formats
+import tuf.keydb
+import tuf.rsa_key
+import tuf.sig
+
+
+NUMBER_OF_KEYS = 5
+
+def _measure(label, function, number_of_signatures):
+  start_time = time.time()
+  function()
+  elapsed_time = time.time() - start_time
+  print '%-45s %8.3f s %10.1f signatures/s' % (label, elapsed_time,
+                                               number_of_signatures /
+                                               elapsed_time)
+
+
+
+
+
+def main(number_of_signatures=2000):
+  rsakey_dicts = [tuf.rsa_key.generate(2048) for _ in range(NUMBER_OF_KEYS)]
+  signed = {'_type': 'Targets', 'targets': {'file.txt': 'x' * 1024}}
+  data = tuf.formats.encode_canonical(signed)
+  signatures = [tuf.rsa_key.create_signature(rsakey_dict, data)
+                for rsakey_dict in rsakey_dicts]
+  signable = {'signed': signed, 'signatures': signatures}
+  verification_keys = [tuf.rsa_key.create_verification_key(rsakey_dict)
+                       for rsakey_dict in rsakey_dicts]
+  rounds = max(1, number_of_signatures // NUMBER_OF_KEYS)
+
+  print str(rounds * NUMBER_OF_KEYS)+' signatures by '+str(NUMBER_OF_KEYS)+\
+    ' 2048-bit keys.'
+
+  def pem_verify():
+    for _ in range(rounds):
+      for rsakey_dict, signature in zip(rsakey_dicts, signatures):
+        assert tuf.rsa_key.verify_signature(rsakey_dict, signature, data)
+
+  def parsed_verify():
+    for _ in range(rounds):
+      for rsakey_dict, signature, verification_key in \
+          zip(rsakey_dicts, signatures, verification_keys):
+        assert tuf.rsa_key.verify_signature(rsakey_dict, signature, data,
+                                            verification_key)
+
+  def signature_status():
+    for _ in range(rounds):
+      status = tuf.sig.get_signature_status(signable)
+      assert len(status['good_sigs']) == NUMBER_OF_KEYS
+
+  _measure('verify_signature(), PEM parsed per signature', pem_verify,
+           rounds * NUMBER_OF_KEYS)
+  _measure('verify_signature(), parsed key', parsed_verify,
+           rounds * NUMBER_OF_KEYS)
+
+  original_cache_size = tuf.conf.signature_cache_size
+  tuf.conf.signature_cache_size = 0
+  try:
+    for rsakey_dict in rsakey_dicts:
+      tuf.keydb.add_rsakey(rsakey_dict)
+    _measure('get_signature_status(), keys from keydb', signature_status,
+             rounds * NUMBER_OF_KEYS)
+  finally:
+    tuf.conf.signature_cache_size = original_cache_size
+    tuf.keydb.clear_keydb()
+
+
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1:
+    main(int(sys.argv[1]))
+  else:
+    main()
@@ -21,8 +21,11 @@
 
 """
 
+import os
+import re
 import sys
 import random
+import email.utils
 import SimpleHTTPServer
 import SocketServer
 
@@ -41,8 +44,70 @@ if len(sys.argv) > 1:
 else:
   PORT = _port_gen()
 
-Handler = SimpleHTTPServer.SimpleHTTPRequestHandler
-httpd = SocketServer.TCPServer(("", PORT), Handler)
+
+class RangeRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+  """Serve files, honouring 'Range: bytes=N-' requests so that resumed
+  downloads can be tested, and 'If-None-Match' and 'If-Modified-Since'
+  requests so that conditional downloads can be tested."""
+
+  def _get_etag(self, path):
+    file_stat = os.stat(path)
+    return '"%x-%x"' % (int(file_stat.st_mtime), file_stat.st_size)
+
+
+  def _is_not_modified(self, path):
+    etag = self.headers.get('If-None-Match')
+    if etag is not None:
+      return etag == self._get_etag(path)
+    modified_since = self.headers.get('If-Modified-Since')
+    if modified_since is not None:
+      modified_since = email.utils.parsedate_tz(modified_since)
+      return modified_since is not None and \
+        int(os.stat(path).st_mtime) <= email.utils.mktime_tz(modified_since)
+    return False
+
+
+  def end_headers(self):
+    path = self.translate_path(self.path)
+    if os.path.isfile(path):
+      self.send_header('ETag', self._get_etag(path))
+    SimpleHTTPServer.SimpleHTTPRequestHandler.end_headers(self)
+
+
+  def send_head(self):
+    match = re.match('bytes=(\d+)-$', self.headers.get('Range', ''))
+    path = self.translate_path(self.path)
+    if os.path.isfile(path) and self._is_not_modified(path):
+      self.send_response(304)
+      self.end_headers()
+      return None
+    if match is None or not os.path.isfile(path):
+      return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+
+    fileobj = open(path, 'rb')
+    length = os.fstat(fileobj.fileno()).st_size
+    start = int(match.group(1))
+    if start >= length:
+      fileobj.close()
+      self.send_error(416, 'Requested range not satisfiable')
+      return None
+    fileobj.seek(start)
+    self.send_response(206)
+    self.send_header('Content-type', self.guess_type(path))
+    self.send_header('Content-Range',
+                     'bytes '+str(start)+'-'+str(length-1)+'/'+str(length))
+    self.send_header('Content-Length', str(length-start))
+    self.end_headers()
+    return fileobj
+
+
+# Speak HTTP/1.1 so that clients may keep connections alive between requests.
+# A threading server is used so that a connection held open (idle) by a client
+# does not prevent other connections from being served.
+Handler = RangeRequestHandler
+Handler.protocol_version = 'HTTP/1.1'
+SocketServer.ThreadingTCPServer.daemon_threads = True
+httpd = SocketServer.ThreadingTCPServer(("", PORT), Handler)
 
 #print "PORT: ", PORT
 httpd.serve_forever()
@@ -0,0 +1,110 @@
+"""
+<Program Name>
+  test_delta.py
+
+<Started>
+  October 16, 2026.
+
+<Copyright>
+  See LICENSE for licensing information.
+
+<Purpose>
+  Unit tests for delta.py.
+
+"""
+
+import StringIO
+import logging
+import unittest
+
+import tuf
+import tuf.log
+import tuf.delta
+import tuf.formats
+import tuf.hash
+
+logger = logging.getLogger('tuf.test_delta')
+
+
+def _make_metadata(number_of_targets, changed_target=None):
+  targets = {}
+  for index in range(number_of_targets):
+    targets['file'+str(index)] = {'length': index,
+                                  'hashes': {'sha256': '%064x' % index}}
+  if changed_target is not None:
+    targets[changed_target] = {'length': 1, 'hashes': {}}
+  return tuf.formats.encode_canonical({'targets': targets})
+
+
+def _get_hashes(data):
+  digest_object = tuf.hash.digest('sha256')
+  digest_object.update(data)
+  return {'sha256': digest_object.hexdigest()}
+
+
+class TestDelta(unittest.TestCase):
+
+  def _apply_delta(self, old_data, delta, new_data):
+    new_file_object = StringIO.StringIO()
+    tuf.delta.apply_delta(StringIO.StringIO(old_data),
+                          StringIO.StringIO(delta), new_file_object,
+                          len(new_data), _get_hashes(new_data))
+    return new_file_object.getvalue()
+
+
+  def test_create_and_apply_delta(self):
+    old_data = _make_metadata(1000)
+    new_data = _make_metadata(1000, changed_target='file500')
+    delta = tuf.delta.create_delta(old_data, new_data)
+    self.assertTrue(len(delta) < len(new_data) / 10)
+    self.assertEqual(new_data, self._apply_delta(old_data, delta, new_data))
+
+    # Arbitrary data may be turned into any other.
+    for old_data, new_data in [('', 'abc'), ('abc', ''), ('a,b,c', 'c,b,a'),
+                               ('', ''), (old_data, 'x'+old_data[1:])]:
+      delta = tuf.delta.create_delta(old_data, new_data)
+      self.assertEqual(new_data, self._apply_delta(old_data, delta, new_data))
+
+    self.assertRaises(tuf.FormatError, tuf.delta.create_delta, None, '')
+
+
+  def test_apply_bad_delta(self):
+    old_data = _make_metadata(100)
+    new_data = _make_metadata(100, changed_target='new')
+    delta = tuf.delta.create_delta(old_data, new_data)
+
+    # Truncated, unknown, or corrupted deltas are rejected.
+    copy_past_end = 'TUFDELTA1\nC' + '\x00'*15 + '\x01' + '\x00'*7 + '\x01'
+    for bad_delta in [delta[:-3], 'x'+delta, delta[:10]+'Z', copy_past_end]:
+      self.assertRaises(tuf.BadDeltaError, self._apply_delta, old_data,
+                        bad_delta, new_data)
+
+    # The new version must match the trusted length and hashes.
+    new_file_object = StringIO.StringIO()
+    self.assertRaises(tuf.BadDeltaError, tuf.delta.apply_delta,
+                      StringIO.StringIO(old_data), StringIO.StringIO(delta),
+                      new_file_object, len(new_data) - 1,
+                      _get_hashes(new_data))
+    self.assertRaises(tuf.BadDeltaError, tuf.delta.apply_delta,
+                      StringIO.StringIO(old_data), StringIO.StringIO(delta),
+                      new_file_object, len(new_data) + 1,
+                      _get_hashes(new_data))
+    self.assertRaises(tuf.BadHashError, tuf.delta.apply_delta,
+                      StringIO.StringIO(old_data), StringIO.StringIO(delta),
+                      new_file_object, len(new_data), _get_hashes(old_data))
+
+
+  def test_get_delta_filename(self):
+    self.assertEqual('targets/role.txt.delta.abcd',
+                     tuf.delta.get_delta_filename('targets/role.txt',
+                                                  {'sha256': 'abcd'}))
+    self.assertEqual(None, tuf.delta.get_delta_filename('targets.txt',
+                                                        {'md5': 'abcd'}))
+    self.assertRaises(tuf.FormatError, tuf.delta.get_delta_filename,
+                      'targets.txt', 'abcd')
+
+
+
+# Run unit test.
+if __name__ == '__main__':
+  unittest.main()
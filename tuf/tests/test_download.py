@@ -26,9 +26,11 @@ Otherwise, module that launches simple server would not be found.
 import os
 import sys
 import time
+import shutil
 import random
 import hashlib
 import logging
+import threading
 import unittest
 import subprocess
 import SocketServer
@@ -36,6 +38,8 @@ import SimpleHTTPServer
 
 import tuf
 import tuf.log
+import tuf.util
+import tuf.mirrors
 import tuf.download as download
 import tuf.tests.unittest_toolbox as unittest_toolbox
 
@@ -83,6 +87,7 @@ class TestDownload(unittest_toolbox.Modified_TestCase):
   # Stop server process and perform clean up.
   def tearDown(self):
     unittest_toolbox.Modified_TestCase.tearDown(self)
+    download.clear_connection_pool()
     if self.server_proc.returncode is None:
       logger.info('\tServer process '+str(self.server_proc.pid)+' terminated.')
       self.server_proc.kill()
@@ -117,6 +122,22 @@ class TestDownload(unittest_toolbox.Modified_TestCase):
     self.assertEquals(self.target_data_length, len(temp_fileobj.read()))
     temp_fileobj.close_temp_file()
 
+    # Test: Normal case with several hash algorithms.
+    hashes = {'md5': self.target_hash['md5'],
+              'sha256': hashlib.sha256(self.target_data).hexdigest()}
+    temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                      required_hashes=hashes,
+                      required_length=self.target_data_length)
+    self.assertEquals(self.target_data, temp_fileobj.read())
+    temp_fileobj.close_temp_file()
+
+    # Test: One incorrect hash among several hash algorithms.
+    hashes['sha256'] = hashlib.sha256(self.random_string()).hexdigest()
+    self.assertRaises(tuf.DownloadError, 
+                      download.download_url_to_tempfileobj, self.url,
+                      required_hashes=hashes,
+                      required_length=self.target_data_length)
+
     # Test: Incorrect length.
     self.assertRaises(tuf.DownloadError, 
                       download.download_url_to_tempfileobj, self.url,
@@ -158,6 +179,7 @@ class TestDownload(unittest_toolbox.Modified_TestCase):
                       required_hashes=self.target_hash, 
                       required_length=self.target_data_length)
 
+
     """
     # Measuring performance of 'auto_flush = False' vs. 'auto_flush = True'
     # in download_url_to_tempfileobj() during write. No change was observed.
@@ -183,6 +205,345 @@ class TestDownload(unittest_toolbox.Modified_TestCase):
 
 
 
+  def test_connection_pool(self):
+    pool_key = ('http', 'localhost', self.PORT)
+
+    # Test: the connection is returned to the pool and reused.
+    temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                      required_hashes=self.target_hash, 
+                      required_length=self.target_data_length)
+    temp_fileobj.close_temp_file()
+    self.assertEquals(1, len(download._connection_pool[pool_key]))
+    connection = download._connection_pool[pool_key][0][0]
+
+    temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                      required_hashes=self.target_hash, 
+                      required_length=self.target_data_length)
+    self.assertEquals(self.target_data, temp_fileobj.read())
+    temp_fileobj.close_temp_file()
+    self.assertEquals(1, len(download._connection_pool[pool_key]))
+    self.assertTrue(connection is download._connection_pool[pool_key][0][0])
+
+    # Test: a failed download does not return its connection to the pool.
+    self.assertRaises(tuf.DownloadError,
+                      download.download_url_to_tempfileobj, self.url,
+                      required_length=self.target_data_length - 1)
+    self.assertEquals(0, len(download._connection_pool[pool_key]))
+
+    # Test: a cancelled download stops, and does not return its connection
+    # to the pool.
+    temp_fileobj = download.download_url_to_tempfileobj(self.url)
+    temp_fileobj.close_temp_file()
+    self.assertEquals(1, len(download._connection_pool[pool_key]))
+    cancel_event = threading.Event()
+    cancel_event.set()
+    self.assertRaises(tuf.DownloadError,
+                      download.download_url_to_tempfileobj, self.url,
+                      required_length=self.target_data_length,
+                      cancel_event=cancel_event)
+    self.assertEquals(0, len(download._connection_pool[pool_key]))
+
+    # Test: a pooled connection closed by the server is replaced.
+    temp_fileobj = download.download_url_to_tempfileobj(self.url)
+    temp_fileobj.close_temp_file()
+    download._connection_pool[pool_key][0][0].sock.close()
+    temp_fileobj = download.download_url_to_tempfileobj(self.url)
+    self.assertEquals(self.target_data, temp_fileobj.read())
+    temp_fileobj.close_temp_file()
+
+    # Test: idle connections expire.
+    original_idle_timeout = tuf.conf.connection_idle_timeout
+    tuf.conf.connection_idle_timeout = 0
+    try:
+      connection = download._connection_pool[pool_key][0][0]
+      temp_fileobj = download.download_url_to_tempfileobj(self.url)
+      temp_fileobj.close_temp_file()
+      self.assertFalse(connection is download._connection_pool[pool_key][0][0])
+    finally:
+      tuf.conf.connection_idle_timeout = original_idle_timeout
+
+    # Test: no connections are kept if the pool size is 0.
+    download.clear_connection_pool()
+    original_pool_size = tuf.conf.connection_pool_size
+    tuf.conf.connection_pool_size = 0
+    try:
+      temp_fileobj = download.download_url_to_tempfileobj(self.url)
+      temp_fileobj.close_temp_file()
+      self.assertEquals(0, len(download._connection_pool[pool_key]))
+    finally:
+      tuf.conf.connection_pool_size = original_pool_size
+
+
+
+
+  def test_mirror_failures(self):
+    local_url = 'http://localhost:'+str(self.PORT)+'/'
+    unreachable_url = 'http://localhost:'+str(self.PORT+1)+'/'
+    original_request = download._request_over_pooled_connection
+
+    def _get_failures(url):
+      mirror_key = tuf.mirrors._get_mirror_key(url)
+      return tuf.mirrors._mirror_statistics.get(mirror_key,
+                                                {'failures': 0})['failures']
+
+    tuf.mirrors.clear_mirror_statistics()
+    try:
+      # Test: a missing file and an invalid file are not mirror failures.
+      self.assertRaises(tuf.DownloadError,
+                        download.download_url_to_tempfileobj,
+                        local_url+self.random_string())
+      self.assertRaises(tuf.DownloadError,
+                        download.download_url_to_tempfileobj, self.url,
+                        required_hashes={'md5': self.random_string()},
+                        required_length=self.target_data_length)
+      self.assertEquals(0, _get_failures(local_url))
+
+      # Test: a connection error is a mirror failure.
+      self.assertRaises(tuf.DownloadError,
+                        download.download_url_to_tempfileobj,
+                        unreachable_url+self.random_string())
+      self.assertEquals(1, _get_failures(unreachable_url))
+
+      # Test: a server error is a mirror failure.
+      class _ServerErrorResponse(object):
+        status = 503
+        def close(self):
+          pass
+      download._request_over_pooled_connection = \
+        lambda parsed_url, extra_headers: _ServerErrorResponse()
+      self.assertRaises(tuf.DownloadError,
+                        download.download_url_to_tempfileobj, self.url)
+      self.assertEquals(1, _get_failures(local_url))
+
+    finally:
+      download._request_over_pooled_connection = original_request
+      tuf.mirrors.clear_mirror_statistics()
+
+
+
+
+  def test_resumed_download(self):
+    original_partial_directory = tuf.conf.partial_download_directory
+    tuf.conf.partial_download_directory = self.make_temp_directory()
+    partial_filepath = download._get_partial_download_filepath(
+                         self.target_hash, self.target_data_length)
+    half_length = self.target_data_length // 2
+
+    try:
+      # Test: the download continues the partial spool with a Range request.
+      partial_file = open(partial_filepath, 'wb')
+      partial_file.write(self.target_data[:half_length])
+      partial_file.close()
+      temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                        required_hashes=self.target_hash, 
+                        required_length=self.target_data_length)
+      self.assertEquals(self.target_data, temp_fileobj.read())
+      temp_fileobj.close_temp_file()
+      self.assertFalse(os.path.exists(partial_filepath))
+
+      # Test: a complete spool is not downloaded again.
+      shutil.copy(self.target_fileobj.name, partial_filepath)
+      temp_fileobj = download.download_url_to_tempfileobj(
+                        'http://localhost:'+str(self.PORT+1)+'/',
+                        required_hashes=self.target_hash, 
+                        required_length=self.target_data_length)
+      self.assertEquals(self.target_data, temp_fileobj.read())
+
+      # Test: the complete file is moved off the spool, which the next
+      # download of the same file may use while the first is still open.
+      self.assertFalse(os.path.exists(partial_filepath))
+      partial_file = open(partial_filepath, 'wb')
+      partial_file.write(self.target_data[:half_length])
+      partial_file.close()
+      other_temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                        required_hashes=self.target_hash, 
+                        required_length=self.target_data_length)
+      temp_fileobj.seek(0)
+      self.assertEquals(self.target_data, temp_fileobj.read())
+      self.assertEquals(self.target_data, other_temp_fileobj.read())
+      temp_fileobj.close_temp_file()
+      other_temp_fileobj.close_temp_file()
+
+      # Test: a spool in use by another download is not written to.
+      partial_file = open(partial_filepath, 'wb')
+      partial_file.write(self.target_data[:half_length])
+      partial_file.close()
+      download._partial_downloads.add(partial_filepath)
+      try:
+        temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                          required_hashes=self.target_hash, 
+                          required_length=self.target_data_length)
+      finally:
+        download._partial_downloads.discard(partial_filepath)
+      self.assertEquals(self.target_data, temp_fileobj.read())
+      temp_fileobj.close_temp_file()
+      self.assertEquals(half_length, os.path.getsize(partial_filepath))
+
+      # Test: the spool is kept when the download fails.
+      partial_file = open(partial_filepath, 'wb')
+      partial_file.write(self.target_data[:half_length])
+      partial_file.close()
+      self.assertRaises(tuf.DownloadError,
+                        download.download_url_to_tempfileobj,
+                        'http://localhost:'+str(self.PORT+1)+'/',
+                        required_hashes=self.target_hash, 
+                        required_length=self.target_data_length)
+      self.assertEquals(half_length, os.path.getsize(partial_filepath))
+
+      # Test: the hashes cover the data in the spool.  An invalid spool is
+      # removed, so that the next download starts over.
+      partial_file = open(partial_filepath, 'wb')
+      partial_file.write(self.random_string(half_length))
+      partial_file.close()
+      self.assertRaises(tuf.DownloadError,
+                        download.download_url_to_tempfileobj, self.url,
+                        required_hashes=self.target_hash, 
+                        required_length=self.target_data_length)
+      self.assertFalse(os.path.exists(partial_filepath))
+      temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                        required_hashes=self.target_hash, 
+                        required_length=self.target_data_length)
+      self.assertEquals(self.target_data, temp_fileobj.read())
+      temp_fileobj.close_temp_file()
+
+      # Test: a spool longer than the file is started over.
+      partial_file = open(partial_filepath, 'wb')
+      partial_file.write(self.target_data+self.random_string())
+      partial_file.close()
+      temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                        required_hashes=self.target_hash, 
+                        required_length=self.target_data_length)
+      self.assertEquals(self.target_data, temp_fileobj.read())
+      temp_fileobj.close_temp_file()
+
+    finally:
+      tuf.conf.partial_download_directory = original_partial_directory
+
+
+
+
+  def test_compressed_download(self):
+    # Serve a gzipped copy of the target file.
+    compressed_data = tuf.util.compress(self.target_data, 'gzip')
+    compressed_filepath = self.target_fileobj.name+'.gz'
+    compressed_file = open(compressed_filepath, 'wb')
+    compressed_file.write(compressed_data)
+    compressed_file.close()
+    self._cleanup.append(lambda: os.remove(compressed_filepath))
+    compressed_url = self.url+'.gz'
+    compressed_hashes = {'md5': hashlib.md5(compressed_data).hexdigest()}
+
+    # Test: the file is decompressed as it is downloaded, and the hashes and
+    # length cover the compressed bytes.
+    temp_fileobj = download.download_url_to_tempfileobj(compressed_url,
+                      required_hashes=compressed_hashes,
+                      required_length=len(compressed_data),
+                      compression='gzip',
+                      uncompressed_length=self.target_data_length)
+    self.assertEquals(self.target_data, temp_fileobj.read())
+    temp_fileobj.close_temp_file()
+
+    # Test: the decompressed file must have the trusted length.
+    for uncompressed_length in [self.target_data_length - 1,
+                                self.target_data_length + 1]:
+      self.assertRaises(tuf.DownloadError,
+                        download.download_url_to_tempfileobj, compressed_url,
+                        required_hashes=compressed_hashes,
+                        required_length=len(compressed_data),
+                        compression='gzip',
+                        uncompressed_length=uncompressed_length)
+
+    # Test: a small file that decompresses to a much larger one (a
+    # "decompression bomb") is rejected without decompressing it all.
+    decompressed_lengths = []
+    writer_class = download._DecompressingWriter
+    original_write_decompressed = writer_class._write_decompressed
+    def _write_decompressed(writer, data, auto_flush):
+      decompressed_lengths.append(len(data))
+      original_write_decompressed(writer, data, auto_flush)
+    writer_class._write_decompressed = _write_decompressed
+    try:
+      for compression in tuf.util.get_compressions():
+        bomb_data = tuf.util.compress('\0' * (10 * 1024 * 1024), compression)
+        bomb_filepath = self.target_fileobj.name+'.bomb'
+        bomb_file = open(bomb_filepath, 'wb')
+        bomb_file.write(bomb_data)
+        bomb_file.close()
+        del decompressed_lengths[:]
+        try:
+          self.assertRaises(tuf.DownloadError,
+                            download.download_url_to_tempfileobj,
+                            self.url+'.bomb', required_length=len(bomb_data),
+                            compression=compression,
+                            uncompressed_length=self.target_data_length)
+        finally:
+          os.remove(bomb_filepath)
+        self.assertEquals(self.target_data_length + 1,
+                          sum(decompressed_lengths))
+    finally:
+      writer_class._write_decompressed = original_write_decompressed
+
+    # Test: hashes of the uncompressed file do not match the download.
+    self.assertRaises(tuf.DownloadError,
+                      download.download_url_to_tempfileobj, compressed_url,
+                      required_hashes=self.target_hash,
+                      required_length=len(compressed_data),
+                      compression='gzip')
+
+    # Test: invalid arguments.
+    self.assertRaises(tuf.Error, download.download_url_to_tempfileobj,
+                      compressed_url, compression='unknown')
+    self.assertRaises(tuf.FormatError, download.download_url_to_tempfileobj,
+                      compressed_url, compression='gzip',
+                      uncompressed_length='1')
+
+
+
+
+  def test_conditional_download(self):
+    # Test: the validators of an unconditional download are recorded.
+    validators = {}
+    temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                      required_length=self.target_data_length,
+                      validators=validators)
+    self.assertEquals(self.target_data, temp_fileobj.read())
+    temp_fileobj.close_temp_file()
+    self.assertEquals(['etag', 'last_modified'], sorted(validators))
+
+    # Test: the file is not downloaded again while it is not modified, with
+    # either validator.
+    for name in validators:
+      conditional_validators = {name: validators[name]}
+      self.assertEquals(None, download.download_url_to_tempfileobj(self.url,
+                                validators=conditional_validators))
+      self.assertEquals({name: validators[name]}, conditional_validators)
+
+    # Test: a modified file is downloaded, and its validators replace the
+    # previous ones.
+    new_data = self.random_string()
+    target_file = open(self.target_fileobj.name, 'wb')
+    target_file.write(new_data)
+    target_file.close()
+    modified_time = time.time() + 10
+    os.utime(self.target_fileobj.name, (modified_time, modified_time))
+    new_validators = dict(validators)
+    temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                      validators=new_validators)
+    self.assertEquals(new_data, temp_fileobj.read())
+    temp_fileobj.close_temp_file()
+    self.assertNotEquals(validators['etag'], new_validators['etag'])
+    temp_fileobj = download.download_url_to_tempfileobj(self.url,
+                      validators={'last_modified':
+                                  validators['last_modified']})
+    self.assertEquals(new_data, temp_fileobj.read())
+    temp_fileobj.close_temp_file()
+
+    # Test: invalid validators.
+    self.assertRaises(tuf.FormatError, download.download_url_to_tempfileobj,
+                      self.url, validators={'etag': 1})
+
+
+
 # Run unit test.
 if __name__ == '__main__':
   unittest.main()
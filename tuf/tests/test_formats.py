@@ -18,6 +18,8 @@
 
 """
 
+import re
+import random
 import unittest
 
 import tuf
@@ -26,6 +28,156 @@ import tuf.schema
 
 
 
+# The canonical JSON encoder that preceded the iterative encoder of
+# 'tuf.formats.encode_canonical()'.  The encodings of the differential test
+# corpus must be identical to its encodings.
+def _reference_canonical_string_encoder(string):
+  string = '"%s"' % re.sub(r'(["\\])', r'\\\1', string)
+  if isinstance(string, unicode):
+    return string.encode('utf-8')
+  else:
+    return string
+
+
+
+def _reference_encode_canonical(object, output_function):
+  if isinstance(object, basestring):
+    output_function(_reference_canonical_string_encoder(object))
+  elif object is True:
+    output_function("true")
+  elif object is False:
+    output_function("false")
+  elif object is None:
+    output_function("null")
+  elif isinstance(object, (int, long)):
+    output_function(str(object))
+  elif isinstance(object, (tuple, list)):
+    output_function("[")
+    if len(object):
+      for item in object[:-1]:
+        _reference_encode_canonical(item, output_function)
+        output_function(",")
+      _reference_encode_canonical(object[-1], output_function)
+    output_function("]")
+  elif isinstance(object, dict):
+    output_function("{")
+    if len(object):
+      items = object.items()
+      items.sort()
+      for key, value in items[:-1]:
+        output_function(_reference_canonical_string_encoder(key))
+        output_function(":")
+        _reference_encode_canonical(value, output_function)
+        output_function(",")
+      key, value = items[-1]
+      output_function(_reference_canonical_string_encoder(key))
+      output_function(":")
+      _reference_encode_canonical(value, output_function)
+    output_function("}")
+  else:
+    raise tuf.FormatError('I cannot encode '+repr(object))
+
+
+
+def _reference_encode(object):
+  result = []
+  try:
+    _reference_encode_canonical(object, result.append)
+  except TypeError, e:
+    raise tuf.FormatError(str(e))
+  return ''.join(result)
+
+
+
+class _String(str):
+  pass
+
+
+
+class _Unicode(unicode):
+  pass
+
+
+
+class _Integer(int):
+  pass
+
+
+
+class _List(list):
+  pass
+
+
+
+class _Dict(dict):
+  pass
+
+
+
+# Strings with characters that are escaped, non-ASCII bytes and characters,
+# and control characters, which canonical JSON leaves unescaped.
+_CORPUS_STRINGS = ['', 'a', '"', '\\', '\\"', '"\\', 'a"b\\c', '\x00\n\t\x7f',
+                   '\xff\xfe', 'caf\xc3\xa9', u'', u'caf\xe9', u'"\u4e2d\\"',
+                   u'\U0001f600', u'\x00\n', 'targets/a/b.txt', u'targets/a/b.txt']
+
+_CORPUS = [
+  '', u'', 0, -1, 2**64, -2**64, 10L, True, False, None, [], {}, (),
+  [[]], [{}], {'a': {}}, {'a': []}, [[[[[]]]]], [1, [2, [3, [4]]], 5],
+  [True, 1, False, 0, None], (1, (2, 3)), {'a': (1, [])},
+  {'b': 1, 'a': 2, 'c': 3}, {u'b': 1, 'a': 2}, {'a': {'b': {'c': {}}}},
+  {'"': 1, '\\': 2, 'A': 3, 'a': 4, '': 5, u'\xe9': 6},
+  _String('a"'), _Unicode(u'\xe9'), _Integer(7), _List([1, _List([])]),
+  _Dict({'z': 1, 'y': _Dict()}), [_String(''), _Dict({_String('k'): 1})],
+  {'signed': {'_type': 'Targets', 'version': 1,
+              'expires': '2030-01-01 00:00:00 UTC',
+              'targets': {'a.txt': {'length': 10,
+                                    'hashes': {'sha256': 'ab12'}},
+                          u'b/\u4e2d.txt': {'length': 0, 'hashes': {},
+                                             'custom': {'x': [None]}}}},
+   'signatures': [{'keyid': 'ab', 'method': 'evp', 'sig': 'cd'}]}]
+# Keys of the same dictionary must be comparable, so non-ASCII byte strings
+# and unicode strings are not mixed.
+_CORPUS_KEYS = [string for string in _CORPUS_STRINGS
+                if isinstance(string, unicode) or max(string or 'a') < '\x80']
+_CORPUS.extend(_CORPUS_STRINGS)
+_CORPUS.append(_CORPUS_STRINGS)
+_CORPUS.append(dict(zip(_CORPUS_KEYS, range(len(_CORPUS_KEYS)))))
+_CORPUS.append(dict.fromkeys(['\xff\xfe', 'caf\xc3\xa9', 'a'], 1))
+
+# Objects that cannot be encoded.
+_BAD_CORPUS = [8.0, {'x': 8.0}, [1, [2, [3.0]]], {1: 'a'}, {None: 1},
+               {'a': {(1, 2): 'b'}}, object(), [set()], {'a': [1, 1j]}]
+
+
+
+def _random_object(random_generator, depth=0):
+  # Generate a random object for the differential test of encode_canonical().
+  choice = random_generator.random()
+  if depth > 5 or choice < 0.5:
+    return random_generator.choice([
+      random_generator.randint(-2**70, 2**70),
+      random_generator.randint(0, 1000),
+      random_generator.choice([True, False, None]),
+      random_generator.choice(_CORPUS_STRINGS),
+      ''.join([random_generator.choice('ab"\\\x00\xff/')
+               for _ in range(random_generator.randint(0, 8))]),
+      u''.join([random_generator.choice(u'ab"\\\xe9\u4e2d')
+                for _ in range(random_generator.randint(0, 8))])])
+  elif choice < 0.7:
+    return [_random_object(random_generator, depth+1)
+            for _ in range(random_generator.randint(0, 5))]
+  elif choice < 0.75:
+    return tuple([_random_object(random_generator, depth+1)
+                  for _ in range(random_generator.randint(0, 3))])
+  else:
+    object = {}
+    for _ in range(random_generator.randint(0, 5)):
+      key = random_generator.choice(_CORPUS_KEYS+['key', u'key2'])
+      object[key] = _random_object(random_generator, depth+1)
+    return object
+
+
+
 class TestFormats(unittest.TestCase):
   def setUp(self):
     pass
@@ -675,6 +827,35 @@ class TestFormats(unittest.TestCase):
 
 
 
+
+  def test_encode_canonical_differential(self):
+    # The encodings of the corpus must be byte-identical to those of the
+    # previous encoder.
+    encode = tuf.formats.encode_canonical
+    for object in _CORPUS:
+      self.assertEqual(_reference_encode(object), encode(object))
+
+      result = []
+      self.assertEqual(None, encode(object, result.append))
+      self.assertEqual(_reference_encode(object), ''.join(result))
+
+    random_generator = random.Random(20121014)
+    for _ in range(2000):
+      object = _random_object(random_generator)
+      self.assertEqual(_reference_encode(object), encode(object))
+
+    for object in _BAD_CORPUS:
+      self.assertRaises(tuf.FormatError, _reference_encode, object)
+      self.assertRaises(tuf.FormatError, encode, object)
+
+    # Deeply nested objects are encoded without recursion.
+    object = []
+    for _ in range(10000):
+      object = [object]
+    self.assertEqual('['*10001 + ']'*10001, encode(object))
+
+
+
 # Run unit test.
 if __name__ == '__main__':
   unittest.main()
@@ -24,6 +24,7 @@ import tempfile
 import unittest
 
 import tuf
+import tuf.conf
 import tuf.log
 import tuf.hash
 
@@ -227,6 +228,44 @@ class TestHash(unittest.TestCase):
 
 
 
+
+  def test_digest_filenames(self):
+    data = 'abcdefgh' * 4096
+    filenames = []
+    try:
+      for index in range(4):
+        fd, filename = tempfile.mkstemp()
+        os.write(fd, data * index)
+        os.close(fd)
+        filenames.append(filename)
+      jobs = [(filename, ['md5', 'sha256']) for filename in filenames]
+      jobs.append((filenames[0]+'.missing', ['sha256']))
+
+      original_hash_workers = tuf.conf.hash_workers
+      try:
+        for hash_workers in [1, 4]:
+          tuf.conf.hash_workers = hash_workers
+          hashes_list = tuf.hash.digest_filenames(jobs)
+          self.assertEqual(len(jobs), len(hashes_list))
+          for index in range(4):
+            for algorithm in ['md5', 'sha256']:
+              digest_object_truth = tuf.hash.digest(algorithm)
+              digest_object_truth.update(data * index)
+              self.assertEqual(digest_object_truth.hexdigest(),
+                               hashes_list[index][algorithm])
+          # A file that cannot be read has no hashes.
+          self.assertEqual(None, hashes_list[-1])
+
+        self.assertRaises(tuf.UnsupportedAlgorithmError,
+                          tuf.hash.digest_filenames, [(filenames[0], ['bogus'])])
+        tuf.conf.hash_workers = 0
+        self.assertRaises(tuf.FormatError, tuf.hash.digest_filenames, jobs)
+      finally:
+        tuf.conf.hash_workers = original_hash_workers
+    finally:
+      for filename in filenames:
+        os.remove(filename)
+
 # Run unit test.
 if __name__ == '__main__':
   unittest.main()
@@ -144,11 +144,14 @@ class TestKeydb(unittest.TestCase):
     tuf.keydb.add_rsakey(rsakey2, keyid2)
     tuf.keydb.add_rsakey(rsakey3, keyid3)
 
+    self.assertNotEqual(None, tuf.keydb.get_verification_key(keyid))
     self.assertEqual(None, tuf.keydb.remove_key(keyid))
     self.assertEqual(None, tuf.keydb.remove_key(keyid2))
     # Ensure the keys were actually removed.
     self.assertRaises(tuf.UnknownKeyError, tuf.keydb.get_key, keyid)
     self.assertRaises(tuf.UnknownKeyError, tuf.keydb.get_key, keyid2)
+    self.assertEqual(None, tuf.keydb.get_verification_key(keyid))
+    self.assertEqual(None, tuf.keydb.get_verification_key(keyid2))
 
     # Test conditions for arguments with invalid formats.
     self.assertRaises(tuf.FormatError, tuf.keydb.remove_key, None)
@@ -16,9 +16,12 @@
 
 """
 
+import os
+import time
 import unittest
 
 import tuf
+import tuf.conf
 import tuf.formats as formats
 import tuf.mirrors as mirrors
 import tuf.tests.unittest_toolbox
@@ -30,6 +33,7 @@ class TestMirrors(tuf.tests.unittest_toolbox.Modified_TestCase):
   def setUp(self):
     
     tuf.tests.unittest_toolbox.Modified_TestCase.setUp(self)
+    mirrors.clear_mirror_statistics()
 
     self.mirrors = \
     {'mirror1': {'url_prefix' : 'http://mirror1.com',
@@ -96,6 +100,65 @@ class TestMirrors(tuf.tests.unittest_toolbox.Modified_TestCase):
 
 
 
+  def test_order_mirrors(self):
+    urls = ['http://mirror1.com/metadata/release.txt',
+            'http://mirror2.com/metadata/release.txt',
+            'http://mirror3.com/metadata/release.txt']
+
+    # Test: mirrors without statistics keep their order.
+    self.assertEquals(urls, mirrors.order_mirrors(urls))
+
+    # Test: faster mirrors come first, unmeasured mirrors are tried first.
+    mirrors.record_download(urls[0], 0.5, 1000, 0.1)
+    mirrors.record_download(urls[1], 0.1, 1000, 0.1)
+    self.assertEquals([urls[2], urls[1], urls[0]],
+                      mirrors.order_mirrors(urls))
+    self.assertEquals([urls[2], urls[1], urls[0]],
+                      mirrors.get_list_of_mirrors('meta', 'release.txt',
+                                                  self.mirrors))
+
+    # Test: a failing mirror is backed off from, with an increasing period.
+    mirrors.record_failure(urls[2])
+    self.assertEquals([urls[1], urls[0], urls[2]],
+                      mirrors.order_mirrors(urls))
+    statistics = mirrors._mirror_statistics['http://mirror3.com']
+    first_retry_after = statistics['retry_after']
+    self.assertTrue(first_retry_after > time.time())
+    mirrors.record_failure(urls[2])
+    self.assertTrue(statistics['retry_after'] > first_retry_after)
+    self.assertEquals(2, statistics['failures'])
+
+    # Test: a backed off mirror is probed again once the period expires, and
+    # a success forgives its failures.
+    statistics['retry_after'] = int(time.time()) - 1
+    self.assertEquals(urls[2], mirrors.order_mirrors(urls)[0])
+    mirrors.record_download(urls[2], 1.0, 1000, 0.1)
+    self.assertEquals(0, statistics['failures'])
+    self.assertEquals([urls[1], urls[0], urls[2]],
+                      mirrors.order_mirrors(urls))
+
+    # Test: statistics are saved and loaded again.
+    original_statistics_file = tuf.conf.mirror_statistics_file
+    tuf.conf.mirror_statistics_file = \
+      os.path.join(self.make_temp_directory(), 'mirrors.json')
+    try:
+      mirrors.save_mirror_statistics()
+      self.assertTrue(os.path.exists(tuf.conf.mirror_statistics_file))
+      mirrors.clear_mirror_statistics()
+      self.assertEquals([urls[1], urls[0], urls[2]],
+                        mirrors.order_mirrors(urls))
+
+      # Test: an invalid statistics file is ignored.
+      statistics_file = open(tuf.conf.mirror_statistics_file, 'w')
+      statistics_file.write('{"http://mirror1.com": {"failures": "x"}}')
+      statistics_file.close()
+      mirrors.clear_mirror_statistics()
+      self.assertEquals(urls, mirrors.order_mirrors(urls))
+    finally:
+      tuf.conf.mirror_statistics_file = original_statistics_file
+
+
+
 # Run the unittests
 if __name__ == '__main__':
   unittest.main()
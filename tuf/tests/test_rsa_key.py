@@ -183,6 +183,28 @@ class TestRsa_key(unittest.TestCase):
 
 
 
+  def test_create_verification_key(self):
+    signature = RSA_KEY.create_signature(rsakey_dict, DATA)
+
+    # Verifying with the parsed public key gives the same results.
+    verification_key = RSA_KEY.create_verification_key(rsakey_dict)
+    verified = RSA_KEY.verify_signature(rsakey_dict, signature, DATA,
+                                        verification_key=verification_key)
+    self.assertTrue(verified, "Incorrect signature.")
+    verified = RSA_KEY.verify_signature(rsakey_dict, signature, '1111'+DATA,
+                                        verification_key=verification_key)
+    self.assertFalse(verified, 
+                     'Returned \'True\' on an incorrect signature.')
+
+    # An unparsable public key.
+    bad_rsakey_dict = rsakey_dict.copy()
+    bad_rsakey_dict['keyval'] = {'public': 'bad', 'private': ''}
+    self.assertRaises(tuf.CryptoError, RSA_KEY.create_verification_key,
+                      bad_rsakey_dict)
+    self.assertRaises(tuf.FormatError, RSA_KEY.create_verification_key, None)
+
+
+
 # Run the unit tests.
 if __name__ == '__main__':
   unittest.main()
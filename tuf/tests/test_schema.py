@@ -330,6 +330,90 @@ class TestSchema(unittest.TestCase):
 
 
 
+  def test_compile_schema(self):
+    class UpperCaseString(tuf.schema.AnyString):
+      def check_match(self, object):
+        tuf.schema.AnyString.check_match(self, object)
+        if object.upper() != object:
+          raise tuf.FormatError(repr(object)+' is not upper case')
+
+    class Mapping(dict):
+      pass
+
+    hash_schema = tuf.schema.DictOf(tuf.schema.RegularExpression('sha[0-9]+'),
+                                    tuf.schema.RegularExpression('[a-f0-9]+'))
+    file_schema = tuf.schema.Object(object_name='file',
+                                    length=tuf.schema.Integer(lo=0, hi=99),
+                                    hashes=hash_schema,
+                                    custom=tuf.schema.Optional(
+                                      tuf.schema.Object()))
+    schema = tuf.schema.Struct(
+      [tuf.schema.String('files'),
+       tuf.schema.ListOf(file_schema, min_count=1, max_count=2,
+                         list_name='files')],
+      [tuf.schema.OneOf([tuf.schema.Boolean(), UpperCaseString()]),
+       tuf.schema.AllOf([tuf.schema.Any(), tuf.schema.AnyString()])],
+      struct_name='manifest')
+
+    good_file = {'length': 3, 'hashes': {'sha256': 'ab12'}}
+    objects = [['files', [good_file]],
+               ('files', [good_file, good_file], True, u'x'),
+               ['files', [good_file], 'UPPER'],
+               ['files', [Mapping(good_file)], False],
+               ['files', []],
+               ['files', [good_file]*3],
+               ['files', [{'length': True, 'hashes': {}}]],
+               ['files', [{'length': 100, 'hashes': {}}]],
+               ['files', [{'hashes': {}}]],
+               ['files', [{'length': 1, 'hashes': {'md5': 'ab'}}]],
+               ['files', [{'length': 1, 'hashes': {'sha1': 'AB'}}]],
+               ['files', [{'length': 1, 'hashes': [], 'custom': {}}]],
+               ['files', [{'length': 1, 'hashes': {}, 'custom': []}]],
+               ['files', [good_file], 'lower'],
+               ['files', [good_file], None],
+               ['files', [good_file], True, 3],
+               ['files', [good_file], True, 'a', 'more'],
+               ['files', 'not a list'],
+               ['dirs', [good_file]],
+               ['files'],
+               {'files': []}, 'files', None]
+
+    # The compiled validator accepts and rejects the same objects as
+    # check_match(), with the same messages.
+    validator = tuf.schema.compile_schema(schema)
+    for object in objects:
+      try:
+        schema.check_match(object)
+      except tuf.FormatError, e:
+        self.assertTrue(str(e))
+        self.assertRaises(tuf.FormatError, validator, object)
+        try:
+          validator(object)
+        except tuf.FormatError, compiled_error:
+          self.assertEqual(str(e), str(compiled_error))
+      else:
+        self.assertEqual(None, validator(object))
+
+    # Deeply nested schemas are compiled too.
+    deep_schema = tuf.schema.Integer()
+    deep_object = 1
+    for depth in range(40):
+      deep_schema = tuf.schema.ListOf(tuf.schema.Object(a=deep_schema))
+      deep_object = [{'a': deep_object}]
+    deep_validator = tuf.schema.compile_schema(deep_schema)
+    deep_validator(deep_object)
+    self.assertRaises(tuf.FormatError, deep_validator, [{'a': [{'a': 'x'}]}])
+
+    # A compiled schema checks objects with its compiled validator.
+    schema.compile()
+    self.assertTrue(schema.matches(objects[0]))
+    self.assertFalse(schema.matches(objects[-1]))
+
+    # Test conditions for invalid arguments.
+    self.assertRaises(tuf.FormatError, tuf.schema.compile_schema, 'schema')
+
+
+
 # Run the unit tests.
 if __name__ == '__main__':
   unittest.main()
@@ -22,6 +22,7 @@ import unittest
 import logging
 
 import tuf
+import tuf.conf
 import tuf.log
 import tuf.formats
 import tuf.keydb
@@ -312,6 +313,59 @@ class TestSig(unittest.TestCase):
     tuf.roledb.remove_role('Root')
 
 
+  def test_verify_signed_data(self):
+    signable = {'signed' : {'b': 1, 'a': 'test'}, 'signatures' : []}
+    signable['signatures'].append(tuf.sig.generate_rsa_signature(
+                                  signable['signed'], KEYS[0]))
+
+    tuf.keydb.add_rsakey(KEYS[0])
+    roleinfo = tuf.formats.make_role_metadata([KEYS[0]['keyid']], 1)
+    tuf.roledb.add_role('Root', roleinfo)
+
+    # The signatures are checked over 'signed_data', when it is given,
+    # instead of over the encoding of signable['signed'].
+    signed_data = tuf.formats.encode_canonical(signable['signed'])
+    self.assertTrue(tuf.sig.verify(signable, 'Root', signed_data))
+    self.assertFalse(tuf.sig.verify(signable, 'Root', signed_data+' '))
+    self.assertRaises(tuf.FormatError, tuf.sig.verify, signable, 'Root',
+                      ['test'])
+
+    # Done.  Let's remove the added key(s) from the key database.
+    tuf.keydb.remove_key(KEYS[0]['keyid'])
+
+    # Remove the roles.
+    tuf.roledb.remove_role('Root')
+
+
+  def test_verify_streamed_signed_data(self):
+    signable = {'signed' : {'b': 1, 'a': 'test'}, 'signatures' : []}
+    signable['signatures'].append(tuf.sig.generate_rsa_signature(
+                                  signable['signed'], KEYS[0]))
+
+    tuf.keydb.add_rsakey(KEYS[0])
+    roleinfo = tuf.formats.make_role_metadata([KEYS[0]['keyid']], 1)
+    tuf.roledb.add_role('Root', roleinfo)
+
+    # The signatures are checked over the data given to a SignedData object
+    # in pieces.
+    encoded_data = tuf.formats.encode_canonical(signable['signed'])
+    signed_data = tuf.sig.SignedData()
+    signed_data.update(encoded_data[:5])
+    signed_data.update(encoded_data[5:])
+    self.assertTrue(tuf.sig.verify(signable, 'Root', signed_data))
+
+    signed_data = tuf.sig.SignedData()
+    signed_data.update(encoded_data+' ')
+    self.assertFalse(tuf.sig.verify(signable, 'Root', signed_data))
+    self.assertRaises(tuf.FormatError, signed_data.update, ['test'])
+
+    # Done.  Let's remove the added key(s) from the key database.
+    tuf.keydb.remove_key(KEYS[0]['keyid'])
+
+    # Remove the roles.
+    tuf.roledb.remove_role('Root')
+
+
   def test_verify_unrecognized_sig(self):
     signable = {'signed' : 'test', 'signatures' : []}
 
@@ -395,6 +449,61 @@ class TestSig(unittest.TestCase):
     self.assertRaises(tuf.FormatError, tuf.sig.get_signature_status, *args)
 
 
+  def test_signature_cache(self):
+    signable = {'signed' : 'test', 'signatures' : []}
+    signable['signatures'].append(tuf.sig.generate_rsa_signature(
+                                  signable['signed'], KEYS[0]))
+    tuf.keydb.add_rsakey(KEYS[0])
+    tuf.sig.clear_signature_cache()
+
+    verified_signatures = []
+    original_verify_signature = tuf.rsa_key.verify_signature
+    def _verify_signature(rsakey_dict, signature, data, verification_key=None):
+      verified_signatures.append(signature['keyid'])
+      return original_verify_signature(rsakey_dict, signature, data,
+                                       verification_key)
+    tuf.rsa_key.verify_signature = _verify_signature
+    original_cache_size = tuf.conf.signature_cache_size
+
+    try:
+      # The result is cached for the same data and signature.
+      for _ in range(2):
+        sig_status = tuf.sig.get_signature_status(signable, None)
+        self.assertEqual([KEYS[0]['keyid']], sig_status['good_sigs'])
+      self.assertEqual(1, len(verified_signatures))
+
+      # Different data is verified again, and a bad signature is cached too.
+      bad_signable = {'signed' : 'test2',
+                      'signatures' : signable['signatures']}
+      for _ in range(2):
+        sig_status = tuf.sig.get_signature_status(bad_signable, None)
+        self.assertEqual([KEYS[0]['keyid']], sig_status['bad_sigs'])
+      self.assertEqual(2, len(verified_signatures))
+
+      # A change of the key database invalidates the cache.
+      tuf.keydb.remove_key(KEYS[0]['keyid'])
+      tuf.keydb.add_rsakey(KEYS[0])
+      tuf.sig.get_signature_status(signable, None)
+      self.assertEqual(3, len(verified_signatures))
+
+      # The least recently used result is discarded.
+      tuf.conf.signature_cache_size = 1
+      tuf.sig.get_signature_status(bad_signable, None)
+      tuf.sig.get_signature_status(signable, None)
+      self.assertEqual(5, len(verified_signatures))
+
+      # The cache may be disabled.
+      tuf.conf.signature_cache_size = 0
+      tuf.sig.get_signature_status(signable, None)
+      self.assertEqual(6, len(verified_signatures))
+
+    finally:
+      tuf.conf.signature_cache_size = original_cache_size
+      tuf.rsa_key.verify_signature = original_verify_signature
+      tuf.sig.clear_signature_cache()
+      tuf.keydb.remove_key(KEYS[0]['keyid'])
+
+
 
 # Run unit test.
 if __name__ == '__main__':
@@ -721,6 +721,23 @@ class TestSignerlib(unit_tbox):
     self.assertTrue(formats.SIGNABLE_SCHEMA.matches(timestamp_meta))
     self.assertTrue(formats.TIMESTAMP_SCHEMA.matches(timestamp_meta['signed']))
 
+    #  Test: normal case (with compressed versions of 'release.txt').
+    compressions = sorted(tuf.util.get_compressions())
+    compressed_filepaths = \
+      signerlib.write_compressed_metadata_files(release_filepath, compressions)
+    timestamp_meta = generate_timestamp_meta(release_filepath, version,
+                                             expiration_date, compressions)
+    meta = timestamp_meta['signed']['meta']
+    for compression, compressed_filepath in \
+        zip(compressions, compressed_filepaths):
+      compressed_name = tuf.util.get_compressed_filename('release.txt',
+                                                         compression)
+      self.assertEqual(signerlib.get_metadata_file_info(compressed_filepath),
+                       meta[compressed_name])
+      os.remove(compressed_filepath)
+    self.assertRaises(tuf.Error, generate_timestamp_meta, release_filepath,
+                      version, expiration_date, ['zip'])
+
     #  Test: invalid path.
     self.assertRaises(tuf.Error, generate_timestamp_meta, self.random_path(),
                                  version, expiration_date)
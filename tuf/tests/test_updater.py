@@ -37,6 +37,7 @@
 
 import os
 import gzip
+import hashlib
 import time
 import shutil
 import tempfile
@@ -48,6 +49,7 @@ import tuf
 import tuf.log
 import tuf.util
 import tuf.formats
+import tuf.hash
 import tuf.repo.keystore as keystore
 import tuf.repo.signerlib as signerlib
 import tuf.client.updater as updater
@@ -200,7 +202,8 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
 
     """
 
-    def _mock_download(url, hashes=None, length=None):
+    def _mock_download(url, hashes=None, length=None, compression=None,
+                       uncompressed_length=None):
       if isinstance(output, (str, unicode)):
         file_path = output
       elif isinstance(output, list):
@@ -208,6 +211,8 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
       file_obj = open(file_path, 'rb')
       temp_fileobj = tuf.util.TempFile()
       temp_fileobj.write(file_obj.read())
+      if compression is not None:
+        temp_fileobj.decompress_temp_file_object(compression)
       return temp_fileobj
 
     # Patch tuf.download.download_url_to_tempfileobj().
@@ -364,6 +369,121 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
     self.assertEqual(self.Repository.metadata['current']['root'],
                      root_meta['signed'])
 
+    #  Verify that the targets are loaded into a plain dict by default.
+    targets_metadata = self.Repository.metadata['current']['targets']
+    self.assertEqual(dict, type(targets_metadata['targets']))
+
+    # Test: files from the streaming threshold on are loaded a piece at a
+    # time, and their targets stored compactly.
+    original_threshold = tuf.conf.metadata_streaming_threshold
+    targets_filepath = os.path.join(self.client_current_dir, 'targets.txt')
+    try:
+      tuf.conf.metadata_streaming_threshold = \
+        os.path.getsize(targets_filepath) + 1
+      self.Repository._load_metadata_from_file('current', 'targets')
+      self.assertEqual(dict, type(self.Repository.metadata['current']\
+                                                   ['targets']['targets']))
+      tuf.conf.metadata_streaming_threshold = \
+        os.path.getsize(targets_filepath)
+      self.Repository._load_metadata_from_file('current', 'targets')
+      streamed_metadata = self.Repository.metadata['current']['targets']
+      self.assertTrue(isinstance(streamed_metadata['targets'],
+                                 updater._CompactTargets))
+      self.assertEqual(targets_metadata, streamed_metadata)
+    finally:
+      tuf.conf.metadata_streaming_threshold = original_threshold
+
+
+
+
+
+  def test_1__metadata_cache(self):
+    # Setup
+    targets_filepath = os.path.join(self.client_current_dir, 'targets.txt')
+    targets_meta = tuf.util.load_json_file(targets_filepath)
+    cache_filepath = \
+      self.Repository._get_metadata_cache_filepath('current', 'targets')
+    original_metadata_cache = tuf.conf.metadata_cache
+    original_load_signable_json_file_object = \
+      tuf.util.load_signable_json_file_object
+    original_load_json_file = tuf.util.load_json_file
+    original_threshold = tuf.conf.metadata_streaming_threshold
+    tuf.conf.metadata_cache = True
+
+    try:
+      # Test: the metadata file is parsed and saved to the cache.  No
+      # temporary file is left in the cache directory.
+      self.Repository._load_metadata_from_file('current', 'targets')
+      self.assertTrue(os.path.exists(cache_filepath))
+      self.assertEqual([os.path.basename(cache_filepath)],
+                       os.listdir(os.path.dirname(cache_filepath)))
+      self.assertEqual(self.Repository.metadata['current']['targets'],
+                       targets_meta['signed'])
+
+      # Test: the cached metadata is loaded without parsing the file, whether
+      # it would be loaded whole or a piece at a time.
+      def _fail_load_signable_json_file_object(file_object, *args, **kwargs):
+        self.fail('Unexpected parse of '+repr(file_object.name))
+      def _fail_load_json_file(filepath):
+        self.fail('Unexpected parse of '+repr(filepath))
+      tuf.util.load_signable_json_file_object = \
+        _fail_load_signable_json_file_object
+      tuf.util.load_json_file = _fail_load_json_file
+      for threshold in [None, 0]:
+        tuf.conf.metadata_streaming_threshold = threshold
+        del self.Repository.metadata['current']['targets']
+        self.Repository._load_metadata_from_file('current', 'targets')
+        self.assertEqual(self.Repository.metadata['current']['targets'],
+                         targets_meta['signed'])
+      tuf.util.load_signable_json_file_object = \
+        original_load_signable_json_file_object
+      tuf.util.load_json_file = original_load_json_file
+      tuf.conf.metadata_streaming_threshold = original_threshold
+
+      # Test: a changed metadata file is parsed again.
+      targets_meta['signed']['version'] = targets_meta['signed']['version']+1
+      signerlib.write_metadata_file(targets_meta, targets_filepath)
+      self.Repository._load_metadata_from_file('current', 'targets')
+      self.assertEqual(self.Repository.metadata['current']['targets'],
+                       targets_meta['signed'])
+
+      # Test: the cache file is JSON.  A cache file in another format version
+      # is ignored.
+      file_length, file_hashes = tuf.util.get_file_details(targets_filepath)
+      cache_entry = tuf.util.load_json_file(cache_filepath)
+      self.assertEqual(updater._METADATA_CACHE_VERSION, cache_entry['version'])
+      self.assertEqual(file_length, cache_entry['length'])
+      self.assertEqual(targets_meta['signed'], cache_entry['metadata'])
+      self.assertEqual(targets_meta['signed'],
+        self.Repository._load_metadata_from_cache('current', 'targets',
+                                                  file_length, file_hashes))
+      cache_entry['version'] = updater._METADATA_CACHE_VERSION - 1
+      cache_file = open(cache_filepath, 'wb')
+      tuf.util.import_json().dump(cache_entry, cache_file)
+      cache_file.close()
+      self.assertEqual(None,
+        self.Repository._load_metadata_from_cache('current', 'targets',
+                                                  file_length, file_hashes))
+
+      # Test: an invalid cache file is ignored.
+      cache_file = open(cache_filepath, 'wb')
+      cache_file.write(self.random_string())
+      cache_file.close()
+      self.assertEqual(None,
+        self.Repository._load_metadata_from_cache('current', 'targets',
+                                                  0, {}))
+      self.Repository._load_metadata_from_file('current', 'targets')
+      self.assertEqual(self.Repository.metadata['current']['targets'],
+                       targets_meta['signed'])
+
+    finally:
+      tuf.conf.metadata_cache = original_metadata_cache
+      tuf.util.load_signable_json_file_object = \
+        original_load_signable_json_file_object
+      tuf.util.load_json_file = original_load_json_file
+      tuf.conf.metadata_streaming_threshold = original_threshold
+      shutil.rmtree(os.path.join(self.client_meta_dir, 'cache'))
+
 
 
 
@@ -467,6 +587,125 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
                       'targets/delegated_role1',
                       role1_metadata)
 
+    # Test: the same targets are checked one at a time as they are loaded.
+    target_check = self.Repository._get_target_check('targets/delegated_role1')
+    self.assertRaises(tuf.RepositoryError, target_check, deleg_target_path)
+    self.assertEqual(None, self.Repository._get_target_check('targets'))
+
+
+
+
+
+  def test_2__compact_targets(self):
+    sha256 = 'ab' * 32
+    targets = {u'a.txt': {'length': 10, 'hashes': {'sha256': sha256}},
+               u'b/\u00e9.txt': {'length': 0, 'hashes': {'sha256': u'cd' * 32}},
+               u'c.txt': {'length': 1, 'hashes': {'sha256': 'AB' * 32}},
+               u'd.txt': {'length': 1, 'hashes': {'md5': 'ab' * 16}},
+               u'e.txt': {'length': 1, 'hashes': {'sha256': sha256},
+                          'custom': {'type': 'text'}}}
+    compact_targets = updater._CompactTargets()
+    for target_filepath in sorted(targets):
+      compact_targets[target_filepath] = targets[target_filepath]
+
+    # Test: the targets are listed with the same fileinfo.
+    self.assertEqual(compact_targets, targets)
+    self.assertEqual(targets, compact_targets)
+    self.assertEqual(targets, dict(compact_targets.items()))
+    self.assertEqual(targets, dict(compact_targets))
+    self.assertEqual(targets, dict(compact_targets.viewitems()))
+    self.assertEqual(sorted(targets.values()),
+                     sorted(compact_targets.viewvalues()))
+    self.assertEqual(targets, compact_targets.to_dict())
+    self.assertEqual(sorted(targets), sorted(compact_targets))
+    self.assertEqual(targets['a.txt'], compact_targets['a.txt'])
+    self.assertEqual(None, compact_targets.get('f.txt'))
+    self.assertRaises(KeyError, compact_targets.__getitem__, 'f.txt')
+    tuf.formats.FILEDICT_SCHEMA.check_match(compact_targets)
+
+    # Test: ASCII paths are interned byte strings.
+    self.assertTrue(u'a.txt' in compact_targets)
+    for target_filepath in compact_targets:
+      if target_filepath != u'b/\u00e9.txt':
+        self.assertEqual(str, type(target_filepath))
+
+    # Test: only fileinfo of the shape of the first target is stored in rows.
+    rows = compact_targets._rows.values()
+    self.assertEqual(2, len([row for row in rows if type(row) is int]))
+
+    # Test: a changed target is no longer equal, and its row is reused.
+    changed_fileinfo = {'length': 11, 'hashes': {'sha256': sha256}}
+    compact_targets['a.txt'] = changed_fileinfo
+    self.assertNotEqual(compact_targets, targets)
+    self.assertEqual(changed_fileinfo, compact_targets['a.txt'])
+    for length in range(3):
+      compact_targets['a.txt'] = {'length': length,
+                                  'hashes': {'sha256': sha256}}
+    compact_targets['a.txt'] = changed_fileinfo
+    self.assertEqual(3, len(compact_targets._lengths))
+
+    # Test: removed targets free their rows for later targets.
+    self.assertEqual(changed_fileinfo, compact_targets.pop('a.txt'))
+    del compact_targets[u'b/\u00e9.txt']
+    self.assertFalse('a.txt' in compact_targets)
+    self.assertEqual(3, len(compact_targets))
+    self.assertEqual(0, len(compact_targets._lengths))
+    compact_targets['a.txt'] = targets['a.txt']
+    compact_targets['f.txt'] = changed_fileinfo
+    self.assertEqual(2, len(compact_targets._lengths))
+    target_filepath, fileinfo = compact_targets.popitem()
+    self.assertEqual(targets.get(target_filepath, changed_fileinfo), fileinfo)
+    self.assertEqual(4, len(compact_targets))
+    compact_targets.clear()
+    self.assertEqual({}, compact_targets.to_dict())
+
+
+
+
+
+  def test_2__delegation_matcher(self):
+    child_roles = [{'name': 'targets/a', 'keyids': [], 'threshold': 1,
+                    'paths': ['a/', 'shared/file.txt']},
+                   {'name': 'targets/b', 'keyids': [], 'threshold': 1,
+                    'paths': ['a/b/', 'shared/']},
+                   {'name': 'targets/bin-0', 'keyids': [], 'threshold': 1,
+                    'path_hash_prefix': '0'},
+                   {'name': 'targets/bin-1', 'keyids': [], 'threshold': 1,
+                    'path_hash_prefix': '1'}]
+    delegation_matcher = updater._DelegationMatcher(child_roles)
+    get_delegated_roles = delegation_matcher.get_delegated_roles
+
+    # Test: roles are listed once, in order of appearance.
+    self.assertEqual(['targets/a', 'targets/b'],
+                     get_delegated_roles('a/b/file.txt', 'ff'))
+    self.assertEqual(['targets/a', 'targets/b'],
+                     get_delegated_roles('shared/file.txt', 'ff'))
+    self.assertEqual(['targets/b'], get_delegated_roles('shared/x', 'ff'))
+    self.assertEqual(['targets/a', 'targets/bin-1'],
+                     get_delegated_roles('a/file.txt', '1f'))
+    self.assertEqual([], get_delegated_roles('b/file.txt', 'ff'))
+
+    # Test: paths allowed for a single role.
+    self.assertTrue(delegation_matcher.allows_path('targets/a', 'a/b/c'))
+    self.assertTrue(delegation_matcher.allows_path('targets/a',
+                                                   'shared/file.txt'))
+    self.assertFalse(delegation_matcher.allows_path('targets/a', 'shared/x'))
+    self.assertFalse(delegation_matcher.allows_path('targets/b', 'a/file'))
+    self.assertFalse(delegation_matcher.allows_path('targets/c', 'a/file'))
+
+    # Test: the matcher is cached until the delegations are replaced.
+    get_delegation_matcher = self.Repository._get_delegation_matcher
+    targets_matcher = get_delegation_matcher('targets')
+    self.assertTrue(targets_matcher is get_delegation_matcher('targets'))
+    targets_metadata = self.Repository.metadata['current']['targets']
+    delegations = targets_metadata['delegations']
+    original_roles = delegations['roles']
+    delegations['roles'] = list(original_roles)
+    try:
+      self.assertFalse(targets_matcher is get_delegation_matcher('targets'))
+    finally:
+      delegations['roles'] = original_roles
+
 
 
 
@@ -526,12 +765,29 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
     self._mock_download_url_to_tempfileobj(targets_filepath_compressed)
     _update_metadata('targets', compression='gzip')
     list_of_targets = self.Repository.metadata['current']['targets']['targets']
+    self.assertEqual(dict, type(list_of_targets))
 
     #  Verify that the added target's path is listed in target's metadata.
     if added_target_2 not in list_of_targets.keys():
       self.fail('\nFailed to update targets metadata.')
 
 
+    # Test: compressed metadata from the streaming threshold on is loaded a
+    # piece at a time, and its targets stored compactly.
+    added_target_3 = self._add_target_to_targets_dir(targets_keyids)
+    targets_filepath_compressed = self._compress_file(self.targets_filepath)
+    self._mock_download_url_to_tempfileobj(targets_filepath_compressed)
+    original_threshold = tuf.conf.metadata_streaming_threshold
+    tuf.conf.metadata_streaming_threshold = 0
+    try:
+      _update_metadata('targets', compression='gzip')
+    finally:
+      tuf.conf.metadata_streaming_threshold = original_threshold
+    list_of_targets = self.Repository.metadata['current']['targets']['targets']
+    self.assertTrue(isinstance(list_of_targets, updater._CompactTargets))
+    self.assertTrue(added_target_3 in list_of_targets)
+
+
     # Restoring server's repository to the initial state.
     os.remove(targets_filepath_compressed)
     os.remove(os.path.join(self.client_current_dir,'targets.txt.gz'))
@@ -542,6 +798,240 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
 
 
 
+  def test_3__download_metadata_hedged(self):
+    # Setup
+    original_download = tuf.download.download_url_to_tempfileobj
+    original_hedge_delay = tuf.conf.metadata_hedge_delay
+    timestamp_filepath = self.timestamp_filepath
+
+    #  Only 'mirror2' responds promptly.  The others are slow until their
+    #  requests are cancelled.
+    cancelled_urls = []
+    def _mock_download(url, hashes=None, length=None, cancel_event=None,
+                       **kwargs):
+      if not url.startswith('http://mirror2.com'):
+        cancel_event.wait(1)
+        if cancel_event.is_set():
+          cancelled_urls.append(url)
+          raise tuf.DownloadError('Download cancelled.')
+      temp_fileobj = tuf.util.TempFile()
+      temp_fileobj.write(open(timestamp_filepath, 'rb').read())
+      return temp_fileobj
+    tuf.download.download_url_to_tempfileobj = _mock_download
+
+    try:
+      # Test: the request is hedged, and the fastest mirror wins.
+      tuf.conf.metadata_hedge_delay = 0.05
+      start_time = time.time()
+      metadata_file_object, metadata_signable, mirror_url = \
+        self.Repository._download_metadata('timestamp')
+      self.assertTrue(time.time() - start_time < 0.9)
+      self.assertTrue(mirror_url.startswith('http://mirror2.com'))
+      self.assertEqual(metadata_signable,
+                       tuf.util.load_json_file(timestamp_filepath))
+      metadata_file_object.close_temp_file()
+
+      # Test: the slower requests are cancelled once the fastest one wins.
+      for attempt in range(50):
+        if cancelled_urls:
+          break
+        time.sleep(0.01)
+      self.assertTrue(cancelled_urls)
+      self.assertTrue(time.time() - start_time < 0.9)
+
+      # Test: no valid copy on any mirror.
+      def _mock_failed_download(url, hashes=None, length=None, **kwargs):
+        raise tuf.DownloadError('Unreachable mirror.')
+      tuf.download.download_url_to_tempfileobj = _mock_failed_download
+      self.assertRaises(tuf.RepositoryError,
+                        self.Repository._download_metadata, 'timestamp')
+
+    finally:
+      tuf.conf.metadata_hedge_delay = original_hedge_delay
+      tuf.download.download_url_to_tempfileobj = original_download
+
+
+
+
+
+  def test_3__update_metadata_conditionally(self):
+    # Setup
+    original_download = tuf.download.download_url_to_tempfileobj
+    original_conditional = tuf.conf.conditional_metadata_requests
+    timestamp_filepath = self.timestamp_filepath
+    validators_filepath = self.Repository._get_metadata_validators_filepath()
+    requests = []
+
+    #  The mirrors serve 'timestamp.txt' with the entity tag '"1"', and reply
+    #  'Not Modified' to requests conditional on it.
+    def _mock_download(url, hashes=None, length=None, validators=None,
+                       **kwargs):
+      if validators is None:
+        requests.append(None)
+      else:
+        requests.append(dict(validators))
+      if validators is not None:
+        if validators.get('etag') == '"1"':
+          return None
+        validators.clear()
+        validators['etag'] = '"1"'
+      temp_fileobj = tuf.util.TempFile()
+      temp_fileobj.write(open(timestamp_filepath, 'rb').read())
+      return temp_fileobj
+    tuf.download.download_url_to_tempfileobj = _mock_download
+
+    try:
+      tuf.conf.conditional_metadata_requests = True
+
+      # Test: the first request is unconditional, and its validators are
+      # saved.
+      self.Repository._update_metadata('timestamp')
+      self.assertEqual([{}], requests)
+      self.assertTrue(os.path.exists(validators_filepath))
+
+      # Test: the current timestamp is kept if it has not been modified.  The
+      # validators are loaded from the validators file.
+      timestamp = self.Repository.metadata['current']['timestamp']
+      self.Repository._metadata_validators = None
+      self.Repository._update_metadata('timestamp')
+      self.assertEqual({'etag': '"1"'}, requests[-1])
+      self.assertTrue(timestamp is
+                      self.Repository.metadata['current']['timestamp'])
+
+      #  The expiration of the kept timestamp is still enforced.
+      timestamp['expires'] = tuf.formats.format_time(time.time() - 10)
+      self.Repository._update_metadata('timestamp')
+      self.assertRaises(tuf.ExpiredMetadataError,
+                        self.Repository._ensure_not_expired, 'timestamp')
+
+      # Test: the validators are not used without a current timestamp.
+      del self.Repository.metadata['current']['timestamp']
+      self.Repository._update_metadata('timestamp')
+      self.assertEqual({}, requests[-1])
+      self.assertTrue('timestamp' in self.Repository.metadata['current'])
+
+      # Test: requests are unconditional unless enabled.
+      tuf.conf.conditional_metadata_requests = False
+      self.Repository._update_metadata('timestamp')
+      self.assertEqual(None, requests[-1])
+
+    finally:
+      tuf.conf.conditional_metadata_requests = original_conditional
+      tuf.download.download_url_to_tempfileobj = original_download
+      self.Repository._metadata_validators = None
+      if os.path.exists(validators_filepath):
+        os.remove(validators_filepath)
+
+
+
+
+
+  def test_2__get_metadata_update_details(self):
+    release_meta = self.Repository.metadata['current']['release']['meta']
+    get_update_details = self.Repository._get_metadata_update_details
+
+    # Test: unchanged metadata.
+    self.assertEqual(None, get_update_details('targets'))
+
+    # Test: the smallest compressed version supported is chosen.
+    new_fileinfo = tuf.formats.make_fileinfo(1000, {'sha256': '01'*32})
+    release_meta['targets.txt'] = new_fileinfo
+    self.assertEqual((new_fileinfo, None, None, None),
+                     get_update_details('targets'))
+
+    gzip_fileinfo = tuf.formats.make_fileinfo(200, {'sha256': '02'*32})
+    release_meta['targets.txt.gz'] = gzip_fileinfo
+    release_meta['targets.txt.zip'] = \
+      tuf.formats.make_fileinfo(10, {'sha256': '03'*32})
+    self.assertEqual((new_fileinfo, 'gzip', gzip_fileinfo, None),
+                     get_update_details('targets'))
+
+    bz2_fileinfo = tuf.formats.make_fileinfo(100, {'sha256': '04'*32})
+    release_meta['targets.txt.bz2'] = bz2_fileinfo
+    if 'bz2' in tuf.util.get_compressions():
+      self.assertEqual((new_fileinfo, 'bz2', bz2_fileinfo, None),
+                       get_update_details('targets'))
+
+    # Test: a compressed version larger than the file is not chosen.
+    release_meta['targets.txt'] = \
+      tuf.formats.make_fileinfo(50, {'sha256': '01'*32})
+    self.assertEqual(None, get_update_details('targets')[1])
+
+
+
+
+
+  def test_3__update_metadata_with_delta(self):
+    # Setup
+    original_download = tuf.download.download_url_to_tempfileobj
+    targets_keyids = setup.role_keyids['targets']
+    current_targets_filepath = os.path.join(self.client_current_dir,
+                                            'targets.txt')
+
+    #  Rebuild the targets metadata on the server, and the delta from the
+    #  client's current version.
+    added_target = self._add_target_to_targets_dir(targets_keyids)
+    delta_filepath, = \
+      signerlib.build_metadata_deltas(self.targets_filepath,
+                                      [current_targets_filepath])
+    delta_filename = os.path.basename(delta_filepath)
+    new_fileinfo = signerlib.get_metadata_file_info(self.targets_filepath)
+    delta_fileinfo = signerlib.get_metadata_file_info(delta_filepath)
+    self.assertTrue(delta_fileinfo['length'] < new_fileinfo['length'])
+
+    #  The release metadata lists the delta.
+    self.Repository._update_fileinfo('targets.txt')
+    release_meta = self.Repository.metadata['current']['release']['meta']
+    release_meta['targets.txt'] = new_fileinfo
+    release_meta[delta_filename] = delta_fileinfo
+
+    try:
+      # Test: the delta from the current version is found.
+      delta = (delta_filename, delta_fileinfo)
+      self.assertEqual(delta,
+                       self.Repository._get_metadata_delta('targets',
+                                                           new_fileinfo))
+      self.assertEqual((new_fileinfo, None, None, delta),
+                 self.Repository._get_metadata_update_details('targets'))
+
+      # Test: a delta that is not smaller than the file is not used.
+      release_meta[delta_filename] = \
+        tuf.formats.make_fileinfo(new_fileinfo['length'],
+                                  delta_fileinfo['hashes'])
+      self.assertEqual(None,
+                       self.Repository._get_metadata_delta('targets',
+                                                           new_fileinfo))
+      release_meta[delta_filename] = delta_fileinfo
+
+      # Test: a bad delta is abandoned for the whole file.
+      self._mock_download_url_to_tempfileobj([self.root_filepath,
+                                              self.targets_filepath])
+      downloaded, compression = \
+        self.Repository._download_metadata_update('targets', new_fileinfo,
+                                                  None, None, delta)
+      self.assertTrue(added_target in downloaded[1]['signed']['targets'])
+      downloaded[0].close_temp_file()
+
+      # Test: normal case.  The delta is applied to the current version.
+      self._mock_download_url_to_tempfileobj(delta_filepath)
+      self.Repository._update_metadata('targets', new_fileinfo, delta=delta)
+      list_of_targets = self.Repository.metadata['current']['targets']['targets']
+      self.assertTrue(added_target in list_of_targets)
+      self.assertEqual(open(self.targets_filepath, 'rb').read(),
+                       open(current_targets_filepath, 'rb').read())
+
+    finally:
+      # Restoring repositories to the initial state.
+      os.remove(delta_filepath)
+      self._remove_target_from_targets_dir(added_target)
+
+      # RESTORE
+      tuf.download.download_url_to_tempfileobj = original_download
+
+
+
+
+
   def test_1__update_fileinfo(self):
     # Tests
     #  Verify that fileinfo dictionary is empty.
@@ -853,6 +1343,97 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
 
 
 
+  def test_4__refresh_roles_concurrently(self):
+
+    # Setup
+    original_download = tuf.download.download_url_to_tempfileobj
+    original_workers = tuf.conf.delegated_metadata_workers
+
+    # As in 'test_4__refresh_targets_metadata', target files are added to the
+    # delegated roles and the server's metadata is rebuilt.  Both roles
+    # change, so that both are downloaded.
+    targets_deleg_dir1 = os.path.join(self.targets_dir, 'delegated_level1')
+    targets_deleg_dir2 = os.path.join(targets_deleg_dir1, 'delegated_level2')
+    shutil.rmtree(self.server_meta_dir)
+    shutil.rmtree(os.path.join(self.server_repo_dir, 'keystore'))
+    tuf.roledb._roledb_dict['targets/delegated_role1'] = \
+        self.semi_roledict['targets/delegated_role1'] 
+    tuf.roledb._roledb_dict['targets/delegated_role1/delegated_role2'] = \
+        self.semi_roledict['targets/delegated_role1/delegated_role2']
+
+    deleg_target_filepath1 = self._add_file_to_directory(targets_deleg_dir1)
+    junk, deleg_target_file1 = os.path.split(deleg_target_filepath1)
+    deleg_target_filepath2 = self._add_file_to_directory(targets_deleg_dir2)
+    junk, deleg_target_file2 = os.path.split(deleg_target_filepath2)
+
+    try:
+      setup.build_server_repository(self.server_repo_dir, self.targets_dir)
+      self._update_top_level_roles()
+
+      #  The order in which the worker threads request metadata is not fixed,
+      #  so the patched download function serves the server's metadata file
+      #  named by the requested url.  'downloaded_roles' records the requests.
+      downloaded_roles = []
+      def _mock_download(url, hashes=None, length=None, **kwargs):
+        metadata_filename = url.split('/metadata/', 1)[1]
+        downloaded_roles.append(metadata_filename)
+        file_obj = open(os.path.join(self.server_meta_dir, metadata_filename),
+                        'rb')
+        temp_fileobj = tuf.util.TempFile()
+        temp_fileobj.write(file_obj.read())
+        file_obj.close()
+        return temp_fileobj
+      tuf.download.download_url_to_tempfileobj = _mock_download
+      tuf.conf.delegated_metadata_workers = 4
+
+
+      # Test: normal case.
+      self.Repository._refresh_targets_metadata(include_delegations=True)
+
+      #  The parent role must be downloaded before the role it delegates to.
+      role1_filename = os.path.join('targets', 'delegated_role1.txt')
+      role2_filename = os.path.join('targets', 'delegated_role1',
+                                    'delegated_role2.txt')
+      self.assertTrue(role1_filename in downloaded_roles)
+      self.assertTrue(role2_filename in downloaded_roles)
+      self.assertTrue(downloaded_roles.index(role1_filename) <
+                      downloaded_roles.index(role2_filename))
+     
+      #  Verify the added target files are listed in the client's metadata.
+      for deleg_role, deleg_target_file in \
+        [('targets/delegated_role1', deleg_target_file1),
+         ('targets/delegated_role1/delegated_role2', deleg_target_file2)]:
+        deleg_metadata = self.Repository.metadata['current'][deleg_role]
+        targets_list = [] 
+        for target in deleg_metadata['targets']:
+          junk, target_file  = os.path.split(target)
+          targets_list.append(target_file)
+
+        self.assertTrue(deleg_target_file in targets_list)
+
+
+      # Test: invalid number of workers.
+      tuf.conf.delegated_metadata_workers = 0
+      self.assertRaises(tuf.FormatError,
+                        self.Repository._refresh_targets_metadata,
+                        include_delegations=True)
+
+    finally:
+      # RESTORE
+      tuf.download.download_url_to_tempfileobj = original_download
+      tuf.conf.delegated_metadata_workers = original_workers
+
+      #  Clean up.
+      self._remove_filepath(deleg_target_filepath1)
+      self._remove_filepath(deleg_target_filepath2)
+      shutil.rmtree(os.path.join(self.server_repo_dir, 'metadata'))
+      shutil.rmtree(os.path.join(self.server_repo_dir, 'keystore'))
+      setup.build_server_repository(self.server_repo_dir, self.targets_dir)
+
+
+
+
+
   def test_3__targets_of_role(self):
     # Setup
     targets_dir_content = os.listdir(self.targets_dir)
@@ -908,6 +1489,17 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
    # targets in 'all_targets' should then be 6.
    self.assertTrue(len(all_targets) is 6)   
 
+   # Test: the returned list is checked when it is passed back, including
+   # any changes made to the targets in it.
+   dest_dir = self.make_temp_directory()
+   all_targets[0]['fileinfo']['length'] = 'x'
+   self.assertRaises(tuf.FormatError, self.Repository.updated_targets,
+                     all_targets, dest_dir)
+   all_targets.pop(0)
+   all_targets.append({'filepath': 'file.txt'})
+   self.assertRaises(tuf.FormatError, self.Repository.updated_targets,
+                     all_targets, dest_dir)
+
    # RESTORE
    tuf.download.download_url_to_tempfileobj = original_download
 
@@ -1021,6 +1613,63 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
 
 
 
+  def test_6_download_targets(self):
+
+    # Setup:
+    original_download = tuf.download.download_url_to_tempfileobj
+    
+    target_rel_paths_src = self._get_list_of_target_paths(self.targets_dir)
+    targets = []
+    for file_path in target_rel_paths_src:
+      targets.append(self.Repository.target(file_path))
+    dest_dir = self.make_temp_directory()
+
+    #  The targets are downloaded concurrently, so the patched download
+    #  function serves the target named by the requested url.  The download
+    #  of 'failing_target' fails on every mirror.
+    failing_target = target_rel_paths_src[0]
+    def _mock_download(url, hashes=None, length=None, **kwargs):
+      target_filepath = url.split('/targets/', 1)[1]
+      if target_filepath == failing_target:
+        raise tuf.DownloadError('Unable to download '+repr(url))
+      file_obj = open(os.path.join(self.targets_dir, target_filepath), 'rb')
+      temp_fileobj = tuf.util.TempFile()
+      temp_fileobj.write(file_obj.read())
+      file_obj.close()
+      return temp_fileobj
+    tuf.download.download_url_to_tempfileobj = _mock_download
+
+
+    # Test: normal case.  Duplicate targets are downloaded only once.
+    report = self.Repository.download_targets(targets+targets, dest_dir,
+                                              max_workers=3,
+                                              per_mirror_limit=1)
+    
+    self.assertEqual(sorted(report['downloaded']),
+                     sorted(target_rel_paths_src[1:]))
+    self.assertEqual(report['failed'].keys(), [failing_target])
+    self.assertTrue(isinstance(report['failed'][failing_target],
+                               tuf.DownloadError))
+    target_rel_paths_dest = self._get_list_of_target_paths(dest_dir)
+    self.assertEqual(sorted(target_rel_paths_dest),
+                     sorted(target_rel_paths_src[1:]))
+
+
+    # Test: invalid arguments.
+    self.assertRaises(tuf.FormatError, self.Repository.download_targets,
+                      targets[0], dest_dir)
+    self.assertRaises(tuf.FormatError, self.Repository.download_targets,
+                      targets, dest_dir, max_workers=0)
+    self.assertRaises(tuf.FormatError, self.Repository.download_targets,
+                      targets, dest_dir, per_mirror_limit=0)
+
+    # RESTORE
+    tuf.download.download_url_to_tempfileobj = original_download
+
+
+
+
+
   def test_7_updated_targets(self):
     
     # Setup:
@@ -1092,6 +1741,113 @@ class TestUpdater(unittest_toolbox.Modified_TestCase):
     
 
 
+  def test_7__target_index(self):
+    # Setup
+    dest_dir = self.make_temp_directory()
+    target_filepath = os.path.join(dest_dir, 'file1.txt')
+    target_data = self.random_string()
+    target_file = open(target_filepath, 'wb')
+    target_file.write(target_data)
+    target_file.close()
+    old_mtime = time.time() - 10 * updater._MTIME_RESOLUTION
+    os.utime(target_filepath, (old_mtime, old_mtime))
+    fileinfo = {'length': len(target_data),
+                'hashes': {'sha256': hashlib.sha256(target_data).hexdigest()}}
+    targets = [{'filepath': 'file1.txt', 'fileinfo': fileinfo}]
+    index_filepath = self.Repository._get_target_index_filepath()
+    original_target_index = tuf.conf.target_index
+    original_rehash_interval = tuf.conf.target_index_rehash_interval
+    original_digest_filenames = tuf.hash.digest_filenames
+    tuf.conf.target_index = True
+    self.Repository._target_index = None
+
+    hashed_filepaths = []
+    def _digest_filenames(jobs):
+      hashed_filepaths.extend([filepath for filepath, algorithms in jobs])
+      return original_digest_filenames(jobs)
+    tuf.hash.digest_filenames = _digest_filenames
+
+    try:
+      # Test: the file is hashed and recorded in the saved index.
+      self.assertEqual([], self.Repository.updated_targets(targets, dest_dir))
+      self.assertEqual(1, len(hashed_filepaths))
+      self.assertTrue(os.path.exists(index_filepath))
+
+      # Test: an unchanged file is not hashed again, even by a new updater.
+      self.Repository._target_index = None
+      self.assertEqual([], self.Repository.updated_targets(targets, dest_dir))
+      self.assertEqual(1, len(hashed_filepaths))
+
+      # Test: the index file is JSON.  An index file in another format
+      # version is ignored, and the file is hashed again.
+      index_contents = tuf.util.load_json_file(index_filepath)
+      self.assertEqual(updater._TARGET_INDEX_VERSION, index_contents['version'])
+      self.assertTrue(os.path.abspath(target_filepath) in
+                      index_contents['targets'])
+      index_contents['version'] = updater._TARGET_INDEX_VERSION - 1
+      index_file = open(index_filepath, 'wb')
+      tuf.util.import_json().dump(index_contents, index_file)
+      index_file.close()
+      self.Repository._target_index = None
+      self.assertEqual([], self.Repository.updated_targets(targets, dest_dir))
+      self.assertEqual(2, len(hashed_filepaths))
+
+      # Test: hashes for another algorithm are computed.
+      fileinfo['hashes']['md5'] = hashlib.md5(target_data).hexdigest()
+      self.assertEqual([], self.Repository.updated_targets(targets, dest_dir))
+      self.assertEqual(3, len(hashed_filepaths))
+
+      # Test: recorded files are hashed again after the rehash interval.
+      tuf.conf.target_index_rehash_interval = 0
+      self.assertEqual([], self.Repository.updated_targets(targets, dest_dir))
+      self.assertEqual(4, len(hashed_filepaths))
+      tuf.conf.target_index_rehash_interval = original_rehash_interval
+
+      # Test: a file modified within the mtime resolution of its verification
+      # is not recorded, so that rewriting it within the same mtime and at
+      # the same size is noticed.
+      target_file = open(target_filepath, 'wb')
+      target_file.write(target_data)
+      target_file.close()
+      self.assertEqual([], self.Repository.updated_targets(targets, dest_dir))
+      self.assertEqual(5, len(hashed_filepaths))
+      self.assertFalse(os.path.abspath(target_filepath) in
+                       self.Repository._target_index)
+      mtime = os.stat(target_filepath).st_mtime
+      target_file = open(target_filepath, 'wb')
+      target_file.write(self.random_string(len(target_data)))
+      target_file.close()
+      os.utime(target_filepath, (mtime, mtime))
+      self.assertEqual(targets,
+                       self.Repository.updated_targets(targets, dest_dir))
+      self.assertEqual(6, len(hashed_filepaths))
+
+      # Test: a modified file is hashed again.
+      target_file = open(target_filepath, 'ab')
+      target_file.write(self.random_string())
+      target_file.close()
+      self.assertEqual(targets,
+                       self.Repository.updated_targets(targets, dest_dir))
+      self.assertEqual(7, len(hashed_filepaths))
+
+      # Test: a missing file is updated, and removed from the index.
+      os.remove(target_filepath)
+      self.assertEqual(targets,
+                       self.Repository.updated_targets(targets, dest_dir))
+      self.assertFalse(target_filepath in self.Repository._target_index)
+
+    finally:
+      tuf.conf.target_index = original_target_index
+      tuf.conf.target_index_rehash_interval = original_rehash_interval
+      tuf.hash.digest_filenames = original_digest_filenames
+      self.Repository._target_index = None
+      if os.path.exists(index_filepath):
+        os.remove(index_filepath)
+
+
+
+
+
   def test_8_remove_obsolete_targets(self):
     
     # Setup:
@@ -27,6 +27,7 @@ import unittest
 import tuf
 import tuf.log
 import tuf.hash
+import tuf.formats
 import tuf.util as util
 import tuf.tests.unittest_toolbox as unittest_toolbox
 
@@ -141,6 +142,56 @@ class TestUtil(unittest_toolbox.Modified_TestCase):
 
 
 
+  def test_A5_tempfile_move_by_rename(self):
+    # Test: a temporary file created in the destination directory is renamed.
+    dest_temp_dir = self.make_temp_directory()
+    dest_path = os.path.join(dest_temp_dir, self.random_string())
+    data = self.random_string()
+    temp_fileobj = util.TempFile(directory=dest_temp_dir)
+    temporary_path = temp_fileobj._temporary_path
+    self.assertEquals(dest_temp_dir, os.path.dirname(temporary_path))
+    temp_fileobj.write(data)
+    temp_fileobj.move(dest_path)
+    self.assertFalse(os.path.exists(temporary_path))
+    self.assertEquals(data, open(dest_path, 'rb').read())
+    self.assertTrue(temp_fileobj.temporary_file.closed)
+
+    # Test: an existing destination file is replaced.
+    data = self.random_string()
+    temp_fileobj = util.TempFile(directory=dest_temp_dir)
+    temp_fileobj.write(data)
+    temp_fileobj.move(dest_path)
+    self.assertEquals(data, open(dest_path, 'rb').read())
+    self.assertEquals([os.path.basename(dest_path)], os.listdir(dest_temp_dir))
+
+    # Test: the file is copied if it cannot be renamed.
+    saved_rename = util.os.rename
+    def _failed_rename(source, destination):
+      raise OSError(18, 'Invalid cross-device link')
+    util.os.rename = _failed_rename
+    try:
+      data = self.random_string()
+      temp_fileobj = util.TempFile(directory=dest_temp_dir)
+      temp_fileobj.write(data)
+      temp_fileobj.move(dest_path)
+    finally:
+      util.os.rename = saved_rename
+    self.assertEquals(data, open(dest_path, 'rb').read())
+    self.assertEquals([os.path.basename(dest_path)], os.listdir(dest_temp_dir))
+
+    # Test: a closed temporary file is removed.
+    temp_fileobj = util.TempFile(directory=dest_temp_dir)
+    temp_fileobj.close_temp_file()
+    self.assertEquals([os.path.basename(dest_path)], os.listdir(dest_temp_dir))
+
+    # Test: the temporary directory is used if 'directory' is unusable.
+    missing_directory = os.path.join(dest_temp_dir, self.random_string())
+    temp_fileobj = util.TempFile(directory=missing_directory)
+    self.assertEquals(None, temp_fileobj._temporary_path)
+    temp_fileobj.close_temp_file()
+
+
+
   def _compress_existing_file(self, filepath):
     """[Helper]Compresses file 'filepath' and returns file path of 
        the compresses file."""
@@ -202,7 +253,88 @@ class TestUtil(unittest_toolbox.Modified_TestCase):
     # Try decompressing once more.
     self.assertRaises(tuf.Error, 
                       self.temp_fileobj.decompress_temp_file_object,'gzip')
-    
+
+
+
+  def test_A7_compression_registry(self):
+    data = self.random_string() * 100
+
+    # Every registered compression round-trips through a TempFile, which is
+    # decompressed as it is read.
+    self.assertEqual('gz', util.get_compressions()['gzip'])
+    for compression in util.get_compressions():
+      temp_fileobj = util.TempFile()
+      temp_fileobj.write(util.compress(data, compression))
+      temp_fileobj.decompress_temp_file_object(compression)
+      self.assertEqual(data[:10], temp_fileobj.read(10))
+      self.assertEqual(data, temp_fileobj.read())
+      temp_fileobj.close_temp_file()
+
+    # The decompressed data is checked against the trusted length as it is
+    # decompressed, so a small compressed file that expands to a much larger
+    # one (a "decompression bomb") is rejected early.
+    bomb_length = 10 * 1024 * 1024
+    for compression in util.get_compressions():
+      temp_fileobj = util.TempFile()
+      temp_fileobj.write(util.compress(data, compression))
+      temp_fileobj.decompress_temp_file_object(compression, len(data))
+      self.assertEqual(data, temp_fileobj.read())
+      temp_fileobj.close_temp_file()
+
+      for uncompressed_length in [len(data) - 1, len(data) + 1]:
+        temp_fileobj = util.TempFile()
+        temp_fileobj.write(util.compress(data, compression))
+        temp_fileobj.decompress_temp_file_object(compression,
+                                                 uncompressed_length)
+        self.assertRaises(IOError, temp_fileobj.read)
+        temp_fileobj.close_temp_file()
+
+      temp_fileobj = util.TempFile()
+      temp_fileobj.write(util.compress('\0' * bomb_length, compression))
+      temp_fileobj.decompress_temp_file_object(compression, len(data))
+      self.assertRaises(IOError, temp_fileobj.read)
+      self.assertEqual(len(data) + 1, temp_fileobj.temporary_file._length)
+      temp_fileobj.close_temp_file()
+    temp_fileobj = util.TempFile()
+    self.assertRaises(tuf.FormatError,
+                      temp_fileobj.decompress_temp_file_object, 'gzip', -1)
+    temp_fileobj.close_temp_file()
+
+    # The gzip compression is compatible with the gzip module.
+    compressed_filepath = self.make_temp_data_file(data=util.compress(data,
+                                                                 'gzip'))
+    self.assertEqual(data, gzip.open(compressed_filepath, 'rb').read())
+    self.assertEqual('release.txt.gz',
+                     util.get_compressed_filename('release.txt', 'gzip'))
+
+    # Other compressions may be registered.
+    class _Reverser(object):
+      def __init__(self):
+        self.decompressed_data = ''
+      def decompress(self, data, max_length):
+        self.decompressed_data = self.decompressed_data + data[::-1]
+        decompressed_data = self.decompressed_data[:max_length]
+        self.decompressed_data = self.decompressed_data[max_length:]
+        return decompressed_data
+    util.register_compression('reverse', 'rev', lambda data: data[::-1],
+                              _Reverser)
+    try:
+      self.assertEqual('rev', util.get_compressions()['reverse'])
+      temp_fileobj = util.TempFile()
+      temp_fileobj.write('atad')
+      temp_fileobj.decompress_temp_file_object('reverse')
+      self.assertEqual('data', temp_fileobj.read())
+      temp_fileobj.close_temp_file()
+    finally:
+      del util._compressions['reverse']
+
+    # Unregistered compressions are rejected.
+    self.assertRaises(tuf.Error, util.compress, data, 'zip')
+    self.assertRaises(tuf.Error, util.get_compressed_filename, 'release.txt',
+                      'zip')
+    self.assertRaises(tuf.FormatError, util.register_compression, 1, 'rev',
+                      None, None)
+
 
 
   def test_B1_get_file_details(self):
@@ -286,6 +418,134 @@ class TestUtil(unittest_toolbox.Modified_TestCase):
  
 
 
+  def  test_B5_load_signable_json_string(self):
+    signed = {'_type': 'Targets', 'version': 2,
+              'targets': {'a"\\b.txt': {'length': -1, 'custom': None},
+                          u'\u00e9': [True, False, '']}}
+    signable = {'signatures': [{'keyid': '1', 'method': 'evp', 'sig': '2'}],
+                'signed': signed}
+    signed_data = tuf.formats.encode_canonical(signed)
+
+    # The canonical encoding of 'signed' is taken from canonical JSON.
+    for data in [tuf.formats.encode_canonical(signable),
+                 tuf.formats.encode_canonical(signable)+'\n']:
+      self.assertEqual((signable, signed_data),
+                       util.load_signable_json_string(data))
+
+    # Non-canonical JSON is loaded, but the encoding is not returned.
+    signatures = tuf.formats.encode_canonical(signable['signatures'])
+    prefix = '{"signatures":'+signatures+',"signed":'
+    for non_canonical in [signed_data.replace(':', ': '),
+                          signed_data.replace('"a\\"', '"a\\u0022'),
+                          signed_data.replace('\xc3\xa9', '\\u00e9'),
+                          signed_data.replace('-1', '-0'),
+                          signed_data.replace('-1', '-1.0'),
+                          signed_data.replace('"_type":"Targets",', '')[:-1]+
+                            ',"_type":"Targets"}',
+                          signed_data[:-1]+',"version":2}']:
+      data = prefix+non_canonical+'}'
+      self.assertEqual((util.json.loads(data), None),
+                       util.load_signable_json_string(data))
+    data = util.json.dumps(signable, indent=1, sort_keys=True)
+    self.assertEqual((signable, None), util.load_signable_json_string(data))
+
+    # Invalid JSON is reported as by load_json_string().
+    self.assertRaises(ValueError, util.load_signable_json_string,
+                      prefix+signed_data)
+
+    # Control characters, such as the newlines of PEM keys, are escaped so
+    # that the encoding is valid JSON, and unescaped again in 'signed_data'.
+    signed['keys'] = {'public': '-----BEGIN\nA\\u000a\x1f-----\n'}
+    signed_data = tuf.formats.encode_canonical(signed)
+    data = util.encode_signable_json_string(signable)
+    self.assertTrue('\n' not in data)
+    self.assertEqual(signable, util.json.loads(data))
+    self.assertEqual((signable, signed_data),
+                     util.load_signable_json_string(data))
+    for non_canonical in [data.replace('N\\u000a', 'N\\u000A'),
+                          data.replace('\\u001f', '\\u001F'),
+                          data.replace('N\\u000a', 'N\\n')]:
+      self.assertEqual((signable, None),
+                       util.load_signable_json_string(non_canonical))
+
+
+
+  def  test_B5_load_signable_json_file_object(self):
+    signed = {'_type': 'Targets', 'version': 2, 'expires': '1\n\\u000a',
+              'targets': {'a"\\b.txt': {'length': 12345678},
+                          u'\u00e9': {'length': 0}, 'c\td': {}}}
+    signable = {'signatures': [{'keyid': '1', 'method': 'evp', 'sig': '2'}],
+                'signed': signed}
+    signed_data = tuf.formats.encode_canonical(signed)
+
+    class _SignedData(object):
+      def __init__(self):
+        self.pieces = []
+      def update(self, data):
+        self.pieces.append(data)
+
+    # Read a few bytes at a time, so that values span several reads.
+    original_read_size = util._JSON_READ_SIZE
+    util._JSON_READ_SIZE = 3
+    try:
+      # The canonical encoding of 'signed' is given to 'signed_data' in
+      # pieces, and each target path to 'target_check', as they are read.
+      temp_fileobj = util.TempFile()
+      temp_fileobj.write(util.encode_signable_json_string(signable)+'\n')
+      target_filepaths = []
+      loaded_signed_data = _SignedData()
+      self.assertEqual((signable, loaded_signed_data),
+                       util.load_signable_json_file_object(temp_fileobj,
+                                                  loaded_signed_data,
+                                                  target_filepaths.append))
+      self.assertEqual(signed_data, ''.join(loaded_signed_data.pieces))
+      self.assertEqual(sorted(signed['targets']), target_filepaths)
+
+      # The targets are stored in the object returned by 'targets_factory'.
+      class _Targets(dict):
+        pass
+      loaded_signable = util.load_signable_json_file_object(temp_fileobj,
+                                          targets_factory=_Targets)[0]
+      self.assertEqual(_Targets, type(loaded_signable['signed']['targets']))
+      self.assertEqual(signable, loaded_signable)
+
+      # An exception raised by 'target_check' ends loading.
+      def _target_check(target_filepath):
+        raise tuf.RepositoryError(target_filepath)
+      self.assertRaises(tuf.RepositoryError,
+                        util.load_signable_json_file_object, temp_fileobj,
+                        None, _target_check)
+      temp_fileobj.close_temp_file()
+
+      # Non-canonical JSON is loaded whole, and 'signed_data' is not returned.
+      data = util.json.dumps(signable, indent=1, sort_keys=True)
+      for non_canonical in [data,
+                            util.encode_signable_json_string(signable).replace(
+                              '12345678', '-0')]:
+        temp_fileobj = util.TempFile()
+        temp_fileobj.write(non_canonical)
+        target_filepaths = []
+        self.assertEqual((util.json.loads(non_canonical), None),
+                         util.load_signable_json_file_object(temp_fileobj,
+                                                    _SignedData(),
+                                                    target_filepaths.append))
+        self.assertEqual(set(signed['targets']), set(target_filepaths))
+        self.assertEqual(_Targets, type(util.load_signable_json_file_object(
+          temp_fileobj, targets_factory=_Targets)[0]['signed']['targets']))
+        temp_fileobj.close_temp_file()
+
+      # Invalid JSON is reported as by load_json_string().
+      temp_fileobj = util.TempFile()
+      temp_fileobj.write(util.encode_signable_json_string(signable)[:-1])
+      self.assertRaises(ValueError, util.load_signable_json_file_object,
+                        temp_fileobj)
+      temp_fileobj.close_temp_file()
+
+    finally:
+      util._JSON_READ_SIZE = original_read_size
+
+
+
   def  test_B6_load_json_file(self):
     data = ['a', {'b': ['c', None, 30.3, 29]}]
     filepath = self.make_temp_file()
@@ -14,15 +14,17 @@
 <Purpose>
   Provides utility services.  This module supplies utility functions such as:
   get_file_details() that computes the length and hash of a file, import_json
-  that tries to import a working json module, load_json_* functions, and a
-  TempFile class that generates a file-like object for temporary storage, etc.
+  that tries to import a working json module, load_json_* functions, the
+  registry of metadata compressions, and a TempFile class that generates a
+  file-like object for temporary storage, etc.
 
 """
 
 
 import os
+import re
 import sys
-import gzip
+import zlib
 import shutil
 import logging
 import tempfile
@@ -36,6 +38,391 @@ import tuf.formats
 # See 'log.py' to learn how logging is handled in TUF.
 logger = logging.getLogger('tuf.util')
 
+# The process umask.  Files created by 'tempfile.mkstemp()' are only readable
+# by their owner, so a temporary file renamed into place by 'TempFile.move()'
+# is given the permissions 'open()' would have given a new file.  The umask
+# can only be read by setting it, so it is read once, at import time.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# The compressions that metadata files may be downloaded in, in the form
+# {name: (file extension, compress function, decompressor factory)}.  See
+# register_compression().
+_compressions = {}
+
+# The number of compressed bytes decompressed at a time by _DecompressedFile,
+# and the most decompressed bytes it asks its decompressor for at a time.
+_DECOMPRESSION_READ_SIZE = 65536
+
+# The number of compressed bytes given to bz2 at a time by _Bz2Decompressor.
+# No bz2 block is smaller, so a single call completes at most one block.
+_BZ2_SLICE_SIZE = 32
+
+
+
+
+
+def register_compression(name, extension, compress_function,
+                         decompressor_factory):
+  """
+  <Purpose>
+    Register a compression that metadata files may be saved and downloaded in.
+    'gzip' and, if the bz2 module is available, 'bz2' are registered when
+    this module is imported.  A compressed metadata file is named after the
+    metadata file followed by '.' and 'extension', e.g., 'release.txt.gz'.
+
+  <Arguments>
+    name:
+      The name of the compression, e.g., 'gzip'.  A compression registered
+      under the same name is replaced.
+
+    extension:
+      The file extension of the compressed files, e.g., 'gz'.
+
+    compress_function:
+      A function that returns the compressed version of the string it is
+      given.
+
+    decompressor_factory:
+      A function that returns a new decompressor object.  Decompressor objects
+      have a decompress(data, max_length) method that decompresses the string
+      'data' and returns at most 'max_length' (a positive integer) bytes of
+      decompressed data.  The compressed data that is not yet decompressed is
+      kept, and decompressed by the next calls, which may pass an empty
+      'data'.  Fewer than 'max_length' bytes are returned only once all of
+      the data given so far has been decompressed.  The output is bounded so
+      that a small compressed file cannot expand into memory before its
+      trusted uncompressed length is checked.
+
+  <Exceptions>
+    tuf.FormatError, if 'name' or 'extension' are improperly formatted.
+
+  <Side Effects>
+    The compression is registered.
+
+  <Returns>
+    None.
+
+  """
+
+  # Raise 'tuf.FormatError' if there is a mismatch.
+  tuf.formats.NAME_SCHEMA.check_match(name)
+  tuf.formats.NAME_SCHEMA.check_match(extension)
+
+  _compressions[name] = (extension, compress_function, decompressor_factory)
+
+
+
+
+
+def get_compressions():
+  """
+  <Purpose>
+    Return the registered compressions, in the form {name: file extension}.
+
+  <Arguments>
+    None.
+
+  <Exceptions>
+    None.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    A dictionary mapping the name of each registered compression to its file
+    extension.
+
+  """
+
+  compressions = {}
+  for name, (extension, compress_function, decompressor_factory) in \
+      _compressions.items():
+    compressions[name] = extension
+
+  return compressions
+
+
+
+
+
+def get_compressed_filename(filename, compression):
+  """
+  <Purpose>
+    Return the name of the version of 'filename' compressed with
+    'compression', e.g., 'release.txt.gz' for 'release.txt' and 'gzip'.
+
+  <Arguments>
+    filename:
+      The name of a metadata file.
+
+    compression:
+      The name of a registered compression.
+
+  <Exceptions>
+    tuf.FormatError, if the arguments are improperly formatted.
+
+    tuf.Error, if 'compression' is not registered.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    The compressed filename.
+
+  """
+
+  tuf.formats.PATH_SCHEMA.check_match(filename)
+
+  return filename + '.' + _get_compression(compression)[0]
+
+
+
+
+
+def compress(data, compression):
+  """
+  <Purpose>
+    Compress 'data' with 'compression'.
+
+  <Arguments>
+    data:
+      The string to compress.
+
+    compression:
+      The name of a registered compression.
+
+  <Exceptions>
+    tuf.FormatError, if 'compression' is improperly formatted.
+
+    tuf.Error, if 'compression' is not registered.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    The compressed string.
+
+  """
+
+  return _get_compression(compression)[1](data)
+
+
+
+
+
+def get_decompressor(compression):
+  """
+  <Purpose>
+    Return a new decompressor object for 'compression', which decompresses
+    the data given to its decompress() method a piece at a time (see
+    register_compression()).
+
+  <Arguments>
+    compression:
+      The name of a registered compression.
+
+  <Exceptions>
+    tuf.FormatError, if 'compression' is improperly formatted.
+
+    tuf.Error, if 'compression' is not registered.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    A decompressor object.
+
+  """
+
+  return _get_compression(compression)[2]()
+
+
+
+
+
+def _get_compression(compression):
+  """Return the registry entry of 'compression', or raise tuf.Error."""
+
+  # Raise 'tuf.FormatError' if there is a mismatch.
+  tuf.formats.NAME_SCHEMA.check_match(compression)
+
+  try:
+    return _compressions[compression]
+  except KeyError:
+    raise tuf.Error('Unsupported compression: '+repr(compression))
+
+
+
+
+
+def _gzip_compress(data):
+  compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return compressor.compress(data) + compressor.flush()
+
+
+
+class _GzipDecompressor(object):
+  """Decompress gzip data, at most 'max_length' bytes at a time (see
+  register_compression())."""
+
+  def __init__(self):
+    # The window size of 16 + zlib.MAX_WBITS selects the gzip format.
+    self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+
+  def decompress(self, data, max_length):
+    # zlib keeps the data it did not decompress in 'unconsumed_tail'.
+    data = self._decompressor.unconsumed_tail + data
+    return self._decompressor.decompress(data, max_length)
+
+
+register_compression('gzip', 'gz', _gzip_compress, _GzipDecompressor)
+
+try:
+  import bz2
+except ImportError:
+  logger.debug('bz2 compression is not supported: could not import bz2.')
+else:
+  class _Bz2Decompressor(object):
+    """Decompress bz2 data, at most 'max_length' bytes at a time (see
+    register_compression()).  'bz2.BZ2Decompressor' cannot limit its output,
+    so it is given '_BZ2_SLICE_SIZE' bytes at a time, and is not given more
+    once 'max_length' bytes are decompressed.  The output of a single call,
+    at most one bz2 block (about 46 MB), is kept until it is returned."""
+
+    def __init__(self):
+      self._decompressor = bz2.BZ2Decompressor()
+      self._compressed_data = ''
+      self._compressed_offset = 0
+      self._decompressed_data = ''
+      self._decompressed_offset = 0
+
+
+
+    def decompress(self, data, max_length):
+      if data:
+        self._compressed_data = \
+          self._compressed_data[self._compressed_offset:] + data
+        self._compressed_offset = 0
+
+      chunks = []
+      length = 0
+      while length < max_length:
+        # Decompress the next slice once the output of the last is returned.
+        if self._decompressed_offset == len(self._decompressed_data):
+          if self._compressed_offset == len(self._compressed_data):
+            break
+          end = self._compressed_offset + _BZ2_SLICE_SIZE
+          compressed_slice = self._compressed_data[self._compressed_offset:end]
+          self._compressed_offset = self._compressed_offset + \
+                                    len(compressed_slice)
+          self._decompressed_data = \
+            self._decompressor.decompress(compressed_slice)
+          self._decompressed_offset = 0
+          continue
+
+        end = self._decompressed_offset + max_length - length
+        chunk = self._decompressed_data[self._decompressed_offset:end]
+        self._decompressed_offset = self._decompressed_offset + len(chunk)
+        chunks.append(chunk)
+        length = length + len(chunk)
+
+      return ''.join(chunks)
+
+
+  register_compression('bz2', 'bz2', bz2.compress, _Bz2Decompressor)
+
+
+
+
+
+class _DecompressedFile(object):
+  """
+  A read-only file object that decompresses the data of a compressed file
+  object as it is read.  It may only be rewound, which restarts the
+  decompression.  Closing it does not close the compressed file object.
+  If 'uncompressed_length' is set, reading fails with IOError as soon as more
+  data, or at the end less data, is decompressed.
+  """
+
+  def __init__(self, compressed_file, decompressor_factory,
+               uncompressed_length=None):
+    self._compressed_file = compressed_file
+    self._decompressor_factory = decompressor_factory
+    self._uncompressed_length = uncompressed_length
+    self.seek(0)
+
+
+
+  def seek(self, offset, whence=0):
+    if offset != 0 or whence != 0:
+      raise IOError('A decompressed file can only be rewound.')
+    self._compressed_file.seek(0)
+    self._decompressor = self._decompressor_factory()
+    self._buffer = ''
+    self._length = 0
+    self._end_reached = False
+
+
+
+  def _decompress_more(self, size):
+    # Decompress at most one byte more than the trusted length, which is
+    # enough to tell that the data is too long.
+    max_length = size
+    if self._uncompressed_length is not None:
+      max_length = min(size, self._uncompressed_length - self._length + 1)
+
+    try:
+      data = self._decompressor.decompress('', max_length)
+      if not data:
+        compressed_data = self._compressed_file.read(_DECOMPRESSION_READ_SIZE)
+        if compressed_data:
+          data = self._decompressor.decompress(compressed_data, max_length)
+        else:
+          self._end_reached = True
+    except (zlib.error, EOFError), e:
+      raise IOError('Invalid compressed data: '+str(e))
+
+    self._length = self._length + len(data)
+    if self._uncompressed_length is not None:
+      if self._length > self._uncompressed_length:
+        raise IOError('Decompressed more than '+\
+                      str(self._uncompressed_length)+' bytes.')
+      if self._end_reached and self._length != self._uncompressed_length:
+        raise IOError('Decompressed '+str(self._length)+' bytes.  Expected '+\
+                      str(self._uncompressed_length)+' bytes.')
+    return data
+
+
+
+  def read(self, size=-1):
+    if size is None or size < 0:
+      chunks = [self._buffer]
+      while not self._end_reached:
+        chunks.append(self._decompress_more(_DECOMPRESSION_READ_SIZE))
+      self._buffer = ''
+      return ''.join(chunks)
+
+    while len(self._buffer) < size and not self._end_reached:
+      self._buffer = self._buffer + \
+        self._decompress_more(size - len(self._buffer))
+    data = self._buffer[:size]
+    self._buffer = self._buffer[size:]
+    return data
+
+
+
+  def flush(self):
+    pass
+
+
+
+  def close(self):
+    self._decompressor = None
+    self._buffer = ''
+
 
 class TempFile(object):
   """
@@ -59,7 +446,15 @@ class TempFile(object):
 
 
 
-  def __init__(self, prefix='tuf_temp_'):
+  def _named_temporary_file(self, prefix, directory):
+    """__init__ helper."""
+    file_descriptor, self._temporary_path = \
+      tempfile.mkstemp(prefix=prefix, dir=directory)
+    self.temporary_file = os.fdopen(file_descriptor, 'w+b')
+
+
+
+  def __init__(self, prefix='tuf_temp_', directory=None, filepath=None):
     """
     <Purpose>
       Initializes TempFile.
@@ -68,8 +463,22 @@ class TempFile(object):
       prefix:
         A string argument to be used with tempfile.TemporaryFile function.
 
+      directory:
+        An optional directory in which to create the temporary file, which is
+        then given a name.  A temporary file created on the same filesystem as
+        the path later given to move() is renamed into place instead of being
+        copied.  If the file cannot be created in 'directory', the temporary
+        directory is used.
+
+      filepath:
+        An optional path of a file to use as the temporary file.  The file is
+        created if it does not exist, and its existing data is kept; the file
+        position is at its end.  Like a file created in 'directory', it is
+        removed by close_temp_file() unless asked otherwise.  Used by
+        'tuf.download' for partial downloads that may be resumed.
+
     <Exceptions>
-      tuf.Error on failure to load temp dir.
+      tuf.Error on failure to load temp dir, or to open 'filepath'.
 
     <Return>
       None.
@@ -79,6 +488,22 @@ class TempFile(object):
     self._compression = None
     # If compression is set then the original file is saved in 'self._orig_file'.
     self._orig_file = None
+    # The path of the temporary file, if it was created in 'directory'.
+    self._temporary_path = None
+    if filepath is not None:
+      try:
+        self.temporary_file = open(filepath, 'a+b')
+      except IOError, err:
+        raise tuf.Error(err)
+      self._temporary_path = filepath
+      return
+    if directory is not None:
+      try:
+        self._named_temporary_file(prefix, directory)
+        return
+      except OSError, err:
+        logger.error('Temp file in '+directory+' failed: '+repr(err))
+        logger.error('Will attempt to use the temporary directory.')
     temp_dir = tuf.conf.temporary_directory
     if  temp_dir is not None and isinstance(temp_dir, str):
       try:
@@ -175,6 +600,12 @@ class TempFile(object):
       Copies 'self.temporary_file' to a non-temp file at 'destination_path' and
       closes 'self.temporary_file' so that it is removed.
 
+      If the temporary file was created in the directory or at the path given
+      to __init__() and has not been decompressed, it is instead synced to
+      disk and renamed to 'destination_path', which replaces any existing file
+      atomically.  If the rename fails (e.g., 'destination_path' is on another
+      filesystem), the file is copied.
+
     <Arguments>
       destination_path:
         Path to store the file in.
@@ -188,6 +619,19 @@ class TempFile(object):
     """
 
     self.flush()
+    if self._temporary_path is not None and self._orig_file is None:
+      try:
+        os.fsync(self.temporary_file.fileno())
+        os.chmod(self._temporary_path, 0666 & ~_UMASK)
+        os.rename(self._temporary_path, destination_path)
+      except OSError, err:
+        logger.warn('Could not rename '+repr(self._temporary_path)+' to '+\
+                    repr(destination_path)+': '+repr(err)+'.  Copying it.')
+      else:
+        self._temporary_path = None
+        self.close_temp_file()
+        return
+
     self.seek(0)
     destination_file = open(destination_path, 'wb')
     shutil.copyfileobj(self.temporary_file, destination_file)
@@ -197,6 +641,36 @@ class TempFile(object):
 
 
 
+  def rename_temp_file(self, filepath):
+    """
+    <Purpose>
+      Rename the temporary file created in the directory or at the path given
+      to __init__() to 'filepath'.  It is still a temporary file, removed from
+      'filepath' by close_temp_file().  Used by 'tuf.download' to free the
+      path of a partial download spool once the download is complete.
+
+    <Arguments>
+      filepath:
+        The new path of the temporary file, on the same filesystem.
+
+    <Exceptions>
+      tuf.Error, if the file has no path or could not be renamed.
+
+    <Return>
+      None.
+
+    """
+
+    if self._temporary_path is None:
+      raise tuf.Error('The temporary file has no path to rename.')
+    try:
+      os.rename(self._temporary_path, filepath)
+    except OSError, err:
+      raise tuf.Error(err)
+    self._temporary_path = filepath
+
+
+
   def seek(self, *args):
     """
     <Purpose>
@@ -221,7 +695,7 @@ class TempFile(object):
 
 
 
-  def decompress_temp_file_object(self, compression):
+  def decompress_temp_file_object(self, compression, uncompressed_length=None):
     """
     <Purpose>
       To decompress a compressed temp file object.  Decompression is performed
@@ -242,48 +716,60 @@ class TempFile(object):
     <Arguments>
       compression:
         A string indicating the type of compression that was used to compress
-        a file.  Only gzip is allowed.
+        a file.  See register_compression().
+
+      uncompressed_length:
+        The trusted length of the decompressed file, or None.  Reading fails
+        with IOError as soon as more data, or at the end less data, is
+        decompressed.
 
     <Exceptions>
-      tuf.FormatError: If 'compression' is improperly formatted.
+      tuf.FormatError: If the arguments are improperly formatted.
 
-      tuf.Error: If an invalid compression is given.
+      tuf.Error: If an unsupported compression is given.
 
     <Side Effects>
       'self._orig_file' is used to store the original data of 'temporary_file'.
+      The data is decompressed as it is read.
 
     <Return>
       None.
 
     """
 
-    # Does 'compression' have the correct format?
-    # Raise 'tuf.FormatError' if there is a mismatch.
-    tuf.formats.NAME_SCHEMA.check_match(compression)
+    # Raise 'tuf.FormatError' if 'compression' is improperly formatted, and
+    # 'tuf.Error' if it is not supported.
+    extension, compress_function, decompressor_factory = \
+      _get_compression(compression)
+    if uncompressed_length is not None:
+      tuf.formats.LENGTH_SCHEMA.check_match(uncompressed_length)
     
     if self._orig_file is not None:
       raise tuf.Error('Can only set compression on a TempFile once.')
 
-    if compression != 'gzip':
-      raise tuf.Error('Only gzip compression is supported.')
-    self.seek(0)
+    self.flush()
     self._compression = compression
     self._orig_file = self.temporary_file
-    self.temporary_file = gzip.GzipFile(fileobj=self.temporary_file, mode='rb')
+    self.temporary_file = _DecompressedFile(self.temporary_file,
+                                            decompressor_factory,
+                                            uncompressed_length)
 
 
 
-  def close_temp_file(self):
+  def close_temp_file(self, keep_file=False):
     """
     <Purpose>
       Closes the temporary file object. 'close_temp_file' mimics usual
       file.close(), however temporary file destroys itself when
       'close_temp_file' is called. Further if compression is set, second
       temporary file instance 'self._orig_file' is also closed so that no open
-      temporary files are left open.
+      temporary files are left open.  A temporary file created in the
+      directory or at the path given to __init__() is removed.
 
     <Arguments>
-      None.
+      keep_file:
+        If True, a temporary file created in the directory or at the path
+        given to __init__() is not removed.
 
     <Exceptions>
       None.
@@ -301,6 +787,13 @@ class TempFile(object):
     # file object.
     if self._orig_file is not None:
       self._orig_file.close()
+    # A named temporary file is not removed when it is closed.
+    if self._temporary_path is not None and not keep_file:
+      try:
+        os.remove(self._temporary_path)
+      except OSError:
+        pass
+    self._temporary_path = None
 
 
 
@@ -326,27 +819,66 @@ def get_file_details(filepath):
     A tuple (length, hashes) describing 'filepath'.
 
   """
+
   # Making sure that the format of 'filepath' is a path string.
   # 'tuf.FormatError' is raised on incorrect format.
   tuf.formats.PATH_SCHEMA.check_match(filepath)
 
-  # Does the path exists?
-  if not os.path.exists(filepath):
-    raise tuf.Error('Path '+repr(filepath)+' doest not exist.')
-  filepath = os.path.abspath(filepath)
+  return get_files_details([filepath])[0]
 
-  # Obtaining length of the file.
-  file_length = os.path.getsize(filepath)
 
-  # Obtaining hash of the file.
-  digest_object = tuf.hash.digest_filename(filepath, algorithm='sha256')
-  file_hash = {'sha256' : digest_object.hexdigest()}
 
-  # Performing a format check to ensure 'file_hash' corresponds HASHDICT_SCHEMA.
-  # Raise 'tuf.FormatError' if there is a mismatch.
-  tuf.formats.HASHDICT_SCHEMA.check_match(file_hash)
 
-  return file_length, file_hash
+
+def get_files_details(filepaths):
+  """
+  <Purpose>
+    To get the length and hash information of many files, as returned by
+    get_file_details().  The files are hashed concurrently by
+    'tuf.hash.digest_filenames()' (see 'tuf.conf.hash_workers').
+
+  <Arguments>
+    filepaths:
+      A list of absolute file paths.
+
+  <Exceptions>
+    tuf.FormatError: If 'filepaths' is improperly formatted.
+
+    tuf.Error: If one of 'filepaths' does not exist or cannot be read.
+
+  <Returns>
+    A list of (length, hashes) tuples, one for each of 'filepaths', in order.
+
+  """
+
+  # Making sure that the format of 'filepaths' is a list of path strings.
+  # 'tuf.FormatError' is raised on incorrect format.
+  tuf.formats.PATHS_SCHEMA.check_match(filepaths)
+
+  # Do the paths exist?
+  absolute_filepaths = []
+  for filepath in filepaths:
+    if not os.path.exists(filepath):
+      raise tuf.Error('Path '+repr(filepath)+' doest not exist.')
+    absolute_filepaths.append(os.path.abspath(filepath))
+
+  # Obtaining the hashes of the files.
+  jobs = [(filepath, ['sha256']) for filepath in absolute_filepaths]
+  files_hashes = tuf.hash.digest_filenames(jobs)
+
+  files_details = []
+  for filepath, file_hash in zip(absolute_filepaths, files_hashes):
+    if file_hash is None:
+      raise tuf.Error('Path '+repr(filepath)+' could not be read.')
+
+    # Performing a format check to ensure 'file_hash' corresponds
+    # HASHDICT_SCHEMA.  Raise 'tuf.FormatError' if there is a mismatch.
+    tuf.formats.HASHDICT_SCHEMA.check_match(file_hash)
+
+    # Obtaining length of the file.
+    files_details.append((os.path.getsize(filepath), file_hash))
+
+  return files_details
 
 
 
@@ -507,6 +1039,423 @@ def load_json_string(data):
 
 
 
+# The beginning of a canonical JSON signable and the separator between its
+# 'signatures' and 'signed' values.
+_CANONICAL_SIGNABLE_PREFIX = '{"signatures":'
+_CANONICAL_SIGNED_SEPARATOR = ',"signed":'
+
+# A JSON string in which the only escape sequences are the two permitted in
+# canonical JSON, '\"' and '\\', and the escaped control characters of
+# encode_signable_json_string().  Once every such string has been removed from
+# a JSON document, the document is in canonical form only if what is left has
+# no whitespace, no backslash and no negative zero.
+_CANONICAL_JSON_STRING = \
+  re.compile(r'"[^"\\]*(?:\\(?:["\\]|u00[01][0-9a-f])[^"\\]*)*"')
+_NON_CANONICAL_JSON = re.compile(r'[ \t\n\r\\]|-0')
+
+# Canonical JSON leaves control characters in strings (e.g., the newlines of
+# PEM keys) unescaped, which JSON does not allow.  They are escaped in files,
+# and unescaped again to recover the canonical encoding.
+_CONTROL_CHARACTER = re.compile('[\x00-\x1f]')
+_ESCAPE_SEQUENCE = re.compile(r'\\(u00[01][0-9a-f]|.)')
+
+
+def _escape_control_character(match):
+  return '\\u%04x' % ord(match.group())
+
+
+
+def _unescape_control_character(match):
+  escape = match.group(1)
+  if escape.startswith('u'):
+    return chr(int(escape[1:], 16))
+  return match.group()
+
+
+
+def _unescape_control_characters(text):
+  """Return the canonical JSON 'text' with its escaped control characters
+  (see encode_signable_json_string()) unescaped."""
+
+  if '\\u' not in text:
+    return text
+  return _ESCAPE_SEQUENCE.sub(_unescape_control_character, text)
+
+
+
+def encode_signable_json_string(signable):
+  """
+  <Purpose>
+    Encode the signable object 'signable' (see 'tuf.formats.SIGNABLE_SCHEMA')
+    in canonical JSON (see 'tuf.formats.encode_canonical()'), with the control
+    characters in its strings escaped as '\\u00XX' (lowercase), so that the
+    result is valid JSON.  load_signable_json_string() and
+    load_signable_json_file_object() recover the canonical JSON encoding of
+    its 'signed' object from the result.
+
+  <Arguments>
+    signable:
+      The signable object.
+
+  <Exceptions>
+    tuf.FormatError, if 'signable' cannot be encoded in canonical JSON.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    A JSON string.
+
+  """
+
+  return _CONTROL_CHARACTER.sub(_escape_control_character,
+                                tuf.formats.encode_canonical(signable))
+
+
+def _canonical_json_object(pairs):
+  """
+  Build the dictionary of a JSON object whose keys are sorted and unique, as
+  they are in canonical JSON.  Otherwise, raise ValueError.
+  """
+
+  keys = [key for key, value in pairs]
+  if keys != sorted(set(keys)):
+    raise ValueError('Non-canonical JSON object')
+  return dict(pairs)
+
+
+
+def _non_canonical_json_number(string):
+  """Reject the floats and constants that canonical JSON cannot represent."""
+
+  raise ValueError('Non-canonical JSON number: '+repr(string))
+
+
+
+_canonical_json_decoder = json.JSONDecoder(object_pairs_hook=_canonical_json_object,
+                                           parse_float=_non_canonical_json_number,
+                                           parse_constant=_non_canonical_json_number)
+
+
+
+def load_signable_json_string(data):
+  """
+  <Purpose>
+    Deserialize a signable JSON object (see 'tuf.formats.SIGNABLE_SCHEMA')
+    from a string 'data', and extract the canonical JSON encoding of its
+    'signed' object from 'data' as well, if 'data' contains it.
+
+    Metadata written by 'tuf.repo.signerlib.write_metadata_file()' is in
+    canonical JSON (see encode_signable_json_string()), so the bytes over
+    which its signatures were generated are part of 'data', once its escaped
+    control characters are unescaped.  They are returned so that
+    'tuf.sig.verify()' can check the signatures without encoding the
+    deserialized object again.  'data' is parsed once: the bytes of the
+    'signed' object are only returned if they are in canonical form (sorted
+    and unique object keys, no whitespace, no escape sequences other than
+    '\\"', '\\\\' and lowercase '\\u00XX' for control characters, and no
+    floats), which makes them identical to
+    'tuf.formats.encode_canonical(signable['signed'])'.
+
+  <Arguments>
+    data:
+      A JSON string.
+
+  <Exceptions>
+    ValueError, if 'data' is not a valid JSON string.
+
+  <Side Effects>
+    None.
+
+  <Returns>
+    A (signable, signed_data) tuple, where 'signable' is the deserialized
+    object and 'signed_data' the canonical JSON encoding of
+    signable['signed'], or None if 'data' does not contain it.
+
+  """
+
+  if isinstance(data, str) and data.startswith(_CANONICAL_SIGNABLE_PREFIX):
+    try:
+      signatures, index = \
+        _canonical_json_decoder.raw_decode(data, len(_CANONICAL_SIGNABLE_PREFIX))
+      if data.startswith(_CANONICAL_SIGNED_SEPARATOR, index):
+        signed_start = index + len(_CANONICAL_SIGNED_SEPARATOR)
+        signed, signed_end = _canonical_json_decoder.raw_decode(data,
+                                                                signed_start)
+        signed_data = data[signed_start:signed_end]
+
+        # Strings must encode back to the same bytes, and everything outside
+        # them must be free of whitespace.
+        if data[signed_end:].rstrip() == '}' and \
+          signed_data.decode('utf-8').encode('utf-8') == signed_data and \
+          not _NON_CANONICAL_JSON.search(_CANONICAL_JSON_STRING.sub('', signed_data)):
+          return {'signatures': signatures, 'signed': signed}, \
+                 _unescape_control_characters(signed_data)
+
+    # Not canonical JSON.  Any error in 'data' is reported by
+    # 'load_json_string()' below.
+    except (ValueError, UnicodeError):
+      pass
+
+  return load_json_string(data), None
+
+
+
+# The number of bytes read from a file at a time by
+# load_signable_json_file_object().
+_JSON_READ_SIZE = 65536
+
+
+class _CanonicalJSONReader(object):
+  """
+  Decode the canonical JSON read from a file object one value at a time, for
+  load_signable_json_file_object().  Only the part of the file that has not
+  been decoded yet is buffered.  The text of the 'signed' object is checked to
+  be canonical and given to 'signed_data', in pieces, as it is decoded.
+  ValueError is raised if the JSON is invalid or not canonical.
+  """
+
+  def __init__(self, file_object, signed_data):
+    self.file_object = file_object
+    self.signed_data = signed_data
+    self.buffer = ''
+    self.index = 0
+    self.eof = False
+
+    # The index in 'buffer' of the text of the 'signed' object not yet given
+    # to 'signed_data', or None outside the 'signed' object.
+    self.signed_index = None
+
+
+
+  def _read(self):
+    """Read more of the file into the buffer, returning False at its end."""
+
+    if self.eof:
+      return False
+
+    # Read at least as much as is buffered, so that a value that spans many
+    # reads is only decoded again a logarithmic number of times.
+    data = self.file_object.read(max(_JSON_READ_SIZE,
+                                     len(self.buffer) - self.index))
+    if not data:
+      self.eof = True
+      return False
+
+    self.flush_signed()
+    self.buffer = self.buffer[self.index:] + data
+    self.index = 0
+    if self.signed_index is not None:
+      self.signed_index = 0
+    return True
+
+
+
+  def flush_signed(self):
+    """Give the text of the 'signed' object decoded so far to 'signed_data'."""
+
+    if self.signed_index is None or self.signed_index == self.index:
+      return
+
+    # The text always ends between two values, so its strings are complete.
+    text = self.buffer[self.signed_index:self.index]
+    if _NON_CANONICAL_JSON.search(_CANONICAL_JSON_STRING.sub('', text)) or \
+       text.decode('utf-8').encode('utf-8') != text:
+      raise ValueError('Non-canonical JSON')
+    if self.signed_data is not None:
+      self.signed_data.update(_unescape_control_characters(text))
+    self.signed_index = self.index
+
+
+
+  def start_signed(self):
+    self.signed_index = self.index
+
+
+
+  def end_signed(self):
+    self.flush_signed()
+    self.signed_index = None
+
+
+
+  def peek(self):
+    """Return the next character, or '' at the end of the file."""
+
+    while self.index >= len(self.buffer) and self._read():
+      pass
+    return self.buffer[self.index:self.index+1]
+
+
+
+  def expect(self, literal):
+    while len(self.buffer) - self.index < len(literal) and self._read():
+      pass
+    if not self.buffer.startswith(literal, self.index):
+      raise ValueError('Expected '+repr(literal))
+    self.index = self.index + len(literal)
+
+
+
+  def decode(self):
+    """Decode the next value, reading more of the file as needed."""
+
+    while True:
+      try:
+        value, end = _canonical_json_decoder.raw_decode(self.buffer,
+                                                        self.index)
+      except ValueError:
+        if self._read():
+          continue
+        raise
+
+      # A number that ends the buffer may continue in the next read.
+      if end == len(self.buffer) and self._read():
+        continue
+      self.index = end
+      return value
+
+
+
+  def decode_object(self, decode_value, result_factory=dict):
+    """
+    Decode the next value as a JSON object with sorted and unique keys, into
+    the dict, or mapping, returned by result_factory().  Each value is decoded
+    by decode_value(key).
+    """
+
+    self.expect('{')
+    result = result_factory()
+    previous_key = None
+    if self.peek() != '}':
+      while True:
+        key = self.decode()
+        if not isinstance(key, basestring) or \
+           (previous_key is not None and key <= previous_key):
+          raise ValueError('Non-canonical JSON object')
+        previous_key = key
+        self.expect(':')
+        result[key] = decode_value(key)
+        if self.peek() != ',':
+          break
+        self.expect(',')
+    self.expect('}')
+    return result
+
+
+
+  def ensure_end(self):
+    """Ensure that only whitespace is left in the file."""
+
+    while True:
+      if self.buffer[self.index:].strip():
+        raise ValueError('Extra data')
+      self.index = len(self.buffer)
+      if not self._read():
+        return
+
+
+
+def load_signable_json_file_object(file_object, signed_data=None,
+                                   target_check=None, targets_factory=dict):
+  """
+  <Purpose>
+    Deserialize a signable JSON object (see 'tuf.formats.SIGNABLE_SCHEMA')
+    from 'file_object', like load_signable_json_string() does from a string,
+    without reading the whole file into memory.
+
+    If the file is in canonical JSON, as metadata written by
+    'tuf.repo.signerlib.write_metadata_file()' is, it is read and decoded a
+    piece at a time.  The raw text of the file is never held whole, and the
+    entries of the 'targets' object of the 'signed' object, if any, are
+    decoded one at a time.  The canonical JSON encoding of the 'signed' object
+    is given to 'signed_data.update()' as it is read, so that the hashing
+    needed to verify the signatures over it is done while the file is parsed.
+    Any other file is loaded by load_json_string() instead, and 'signed_data'
+    is not used.
+
+  <Arguments>
+    file_object:
+      A file object, or a 'TempFile', holding a JSON string.  It is read from
+      the beginning.
+
+    signed_data:
+      An object with an 'update()' method, such as a 'tuf.sig.SignedData', to
+      be given the canonical JSON encoding of the 'signed' object, or None.
+
+    target_check:
+      A function called with each target path in the 'targets' object of the
+      'signed' object as it is loaded, or None.  Any exception it raises
+      (e.g., because the target is not allowed) ends loading and is re-raised.
+      A target path may be checked twice, if the file turns out not to be in
+      canonical JSON after some of its targets have been loaded.
+
+    targets_factory:
+      A function returning the empty dict, or other mutable mapping, that the
+      entries of the 'targets' object of the 'signed' object are stored in.
+      Each entry is stored as it is loaded.
+
+  <Exceptions>
+    ValueError, if the file is not a valid JSON string.
+
+  <Side Effects>
+    'file_object' is read.
+
+  <Returns>
+    A (signable, signed_data) tuple, where 'signable' is the deserialized
+    object and 'signed_data' the given 'signed_data' if it has been given the
+    canonical JSON encoding of signable['signed'], or None otherwise.
+
+  """
+
+  def decode_signed_value(key):
+    if key == 'targets' and reader.peek() == '{':
+      return reader.decode_object(decode_target, targets_factory)
+    return reader.decode()
+
+  def decode_target(target_filepath):
+    fileinfo = reader.decode()
+    if target_check is not None:
+      target_check(target_filepath)
+    return fileinfo
+
+  file_object.seek(0)
+  reader = _CanonicalJSONReader(file_object, signed_data)
+  try:
+    reader.expect(_CANONICAL_SIGNABLE_PREFIX)
+    signatures = reader.decode()
+    reader.expect(_CANONICAL_SIGNED_SEPARATOR)
+    reader.start_signed()
+    signed = reader.decode_object(decode_signed_value)
+    reader.end_signed()
+    reader.expect('}')
+    reader.ensure_end()
+    return {'signatures': signatures, 'signed': signed}, signed_data
+
+  # Not canonical JSON.  Load the file whole, which also reports any error in
+  # it.
+  except (ValueError, UnicodeError):
+    pass
+
+  file_object.seek(0)
+  signable = load_json_string(file_object.read())
+  try:
+    targets = signable['signed']['targets']
+  except (TypeError, KeyError):
+    targets = None
+
+  if type(targets) is dict:
+    if target_check is not None:
+      for target_filepath in targets:
+        target_check(target_filepath)
+    if targets_factory is not dict:
+      signable['signed']['targets'] = targets_factory()
+      signable['signed']['targets'].update(targets)
+
+  return signable, None
+
+
+
 def load_json_file(filepath):
   """
   <Purpose>